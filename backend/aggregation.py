@@ -0,0 +1,106 @@
+# aggregation.py
+from typing import Dict, Iterable, List, Mapping, Optional
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+from schemas import RefStat, RefPriceStat
+
+# One scan of abb_dbo_test over the window, grouped finely enough that every
+# quality KPI (total/good/bad, per-REF counts, per-REF/price totals) can be
+# folded from the result in Python. The LEFT JOIN keeps tests whose board is
+# missing so they still count towards the totals; `matched` tells them apart.
+# `{extra}` lets callers narrow the window further (see rollups.py).
+GROUPS_SQL_TEMPLATE = """
+    SELECT
+      b.REF_AsteelFlash                       AS ref_asteel,
+      b.prix                                  AS unit_price,
+      b.Id IS NOT NULL                        AS matched,
+      SUM(t.Result = 1)                       AS good,
+      SUM(t.Result != 1 OR t.Result IS NULL)  AS bad,
+      MAX(t.Num_Serie)                        AS num_serie
+    FROM abb_dbo_test t
+    LEFT JOIN abb_dbo_board b ON t.Id_Board = b.Id
+    WHERE t.DateDebut_ts BETWEEN :start AND :end {extra}
+    GROUP BY b.REF_AsteelFlash, b.prix, b.Id IS NOT NULL
+"""
+
+WINDOW_SQL = text(GROUPS_SQL_TEMPLATE.format(extra=""))
+
+
+def _max_serial(a: Optional[str], b: Optional[str]) -> Optional[str]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return max(a, b)
+
+
+class QualityAggregate:
+    """
+    Result of one aggregation pass over a time window.
+    """
+    def __init__(self, total: int, good: int,
+                 ref_stats: List[RefStat], ref_price_stats: List[RefPriceStat]):
+        self.total = total
+        self.good = good
+        self.bad = total - good
+        self.ref_stats = ref_stats
+        self.ref_price_stats = ref_price_stats
+
+    @classmethod
+    def fold(cls, groups: Iterable[Mapping]) -> "QualityAggregate":
+        """
+        Builds the KPIs from (ref_asteel, unit_price, matched, good, bad, num_serie)
+        groups. Groups sharing the same (ref, price) key are summed, so partial
+        results from several sources can be passed in together.
+        """
+        total = good = 0
+        by_ref: Dict[Optional[str], dict] = {}
+        by_price: Dict[tuple, dict] = {}
+
+        for g in groups:
+            g_good, g_bad = int(g["good"] or 0), int(g["bad"] or 0)
+            total += g_good + g_bad
+            good += g_good
+            if not g["matched"]:
+                continue
+
+            ref, serial = g["ref_asteel"], g["num_serie"]
+            rs = by_ref.setdefault(ref, {"ref_asteel": ref, "good_count": 0,
+                                         "bad_count": 0, "serial_number": None})
+            rs["good_count"] += g_good
+            rs["bad_count"] += g_bad
+            rs["serial_number"] = _max_serial(rs["serial_number"], serial)
+
+            price = g["unit_price"]
+            ps = by_price.setdefault((ref, price), {"ref_asteel": ref, "unit_price": price,
+                                                    "good_tests": 0, "bad_tests": 0,
+                                                    "num_serie": None})
+            ps["good_tests"] += g_good
+            ps["bad_tests"] += g_bad
+            ps["num_serie"] = _max_serial(ps["num_serie"], serial)
+
+        for ps in by_price.values():
+            price = ps["unit_price"]
+            ps["total_price"] = ps["good_tests"] * price if price is not None else None
+
+        return cls(
+            total=total,
+            good=good,
+            ref_stats=[RefStat(**r) for r in by_ref.values()],
+            ref_price_stats=[RefPriceStat(**r) for r in by_price.values()],
+        )
+
+
+class QualityAggregator:
+    """
+    Computes every test-table KPI of a quality window from a single read.
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    def groups(self, start: str, end: str) -> List[Mapping]:
+        return self.db.execute(WINDOW_SQL, {"start": start, "end": end}).mappings().all()
+
+    def run(self, start: str, end: str) -> QualityAggregate:
+        return QualityAggregate.fold(self.groups(start, end))
@@ -0,0 +1,228 @@
+"""
+Model artifacts stored as a directory of parts with a checksummed manifest.
+
+    <dir>/manifest.json     format, creation time, extra metadata and, per
+                            part: file, kind, class, bytes, sha256
+    <dir>/<part>.npy        NumPy arrays, memory-mapped on load
+    <dir>/<part>.ubj        XGBoost models, native format
+    <dir>/<part>.joblib     anything else, uncompressed so that the arrays
+                            inside are memory-mapped on load
+
+Memory-mapped arrays are read-only views of the file: pages are loaded on
+first touch and shared through the OS page cache by every worker process
+that maps the same file, instead of each worker unpickling a private copy.
+Objects that copy their arrays when unpickled (scikit-learn trees, XGBoost
+boosters) still get a private copy, but load without decompression.
+
+Parts are written to a temporary directory that replaces `<dir>` in one
+rename. On load the manifest's checksums are verified first
+(ARTIFACT_VERIFY=0 skips it); a mismatch raises ArtifactError.
+
+    python artifacts.py convert        # pack the legacy model files into ARTIFACTS_DIR
+    python artifacts.py verify [DIR]   # check manifests and checksums
+    python artifacts.py bench          # cold load time and RSS, legacy files vs artifacts
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+from datetime import datetime
+from typing import Any, Dict
+
+import numpy as np
+
+import lazy
+
+joblib = lazy.module("joblib")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ARTIFACTS_DIR = os.getenv("ARTIFACTS_DIR", os.path.join(HERE, "artifacts"))
+VERIFY = os.getenv("ARTIFACT_VERIFY", "1") != "0"
+MMAP = os.getenv("ARTIFACT_MMAP", "1") != "0"
+MANIFEST = "manifest.json"
+FORMAT = 1
+
+
+class ArtifactError(ValueError):
+    pass
+
+
+def sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _class_name(obj: Any) -> str:
+    return f"{type(obj).__module__}.{type(obj).__qualname__}"
+
+
+def _write_part(directory: str, key: str, obj: Any) -> dict:
+    if isinstance(obj, np.ndarray) and obj.dtype == object and all(isinstance(v, str) for v in obj.flat):
+        obj = obj.astype(str)  # fixed-width unicode can be memory-mapped
+    if isinstance(obj, np.ndarray) and obj.dtype != object:
+        kind, filename = "npy", f"{key}.npy"
+        np.save(os.path.join(directory, filename), obj)
+    elif type(obj).__module__.startswith("xgboost") and hasattr(obj, "save_model"):
+        kind, filename = "xgboost", f"{key}.ubj"
+        obj.save_model(os.path.join(directory, filename))
+    else:
+        kind, filename = "joblib", f"{key}.joblib"
+        joblib.dump(obj, os.path.join(directory, filename), compress=0)
+    path = os.path.join(directory, filename)
+    return {"file": filename, "kind": kind, "class": _class_name(obj),
+            "bytes": os.path.getsize(path), "sha256": sha256(path)}
+
+
+def save(directory: str, parts: Dict[str, Any], **meta) -> dict:
+    """Writes `parts` (name -> object) to `directory`; returns the manifest."""
+    tmp = directory.rstrip(os.sep) + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    manifest = {"format": FORMAT, "created": datetime.now().isoformat(timespec="seconds"),
+                "meta": meta, "parts": {key: _write_part(tmp, key, obj) for key, obj in parts.items()}}
+    with open(os.path.join(tmp, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2, default=str)
+    old = directory.rstrip(os.sep) + ".old"
+    if os.path.exists(directory):
+        shutil.rmtree(old, ignore_errors=True)
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+def exists(directory: str) -> bool:
+    return os.path.isfile(os.path.join(directory, MANIFEST))
+
+
+def read_manifest(directory: str) -> dict:
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ArtifactError(f"{directory}: unreadable manifest ({e})")
+    if manifest.get("format") != FORMAT:
+        raise ArtifactError(f"{directory}: unsupported format {manifest.get('format')}")
+    return manifest
+
+
+def verify(directory: str) -> dict:
+    """The manifest, after checking every part's size and checksum."""
+    manifest = read_manifest(directory)
+    for key, part in manifest["parts"].items():
+        path = os.path.join(directory, part["file"])
+        if not os.path.isfile(path) or os.path.getsize(path) != part["bytes"]:
+            raise ArtifactError(f"{directory}: part '{key}' is missing or truncated")
+        if sha256(path) != part["sha256"]:
+            raise ArtifactError(f"{directory}: checksum mismatch for part '{key}'")
+    return manifest
+
+
+def _read_part(directory: str, part: dict, mmap: bool) -> Any:
+    path = os.path.join(directory, part["file"])
+    if part["kind"] == "npy":
+        return np.load(path, mmap_mode="r" if mmap else None)
+    if part["kind"] == "xgboost":
+        module, name = part["class"].rsplit(".", 1)
+        model = getattr(importlib.import_module(module), name)()
+        model.load_model(path)
+        return model
+    return joblib.load(path, mmap_mode="r" if mmap else None)
+
+
+def load(directory: str, verify_checksums: bool = VERIFY, mmap: bool = MMAP) -> Dict[str, Any]:
+    """Parts of the artifact in `directory`, plus "_manifest"."""
+    manifest = verify(directory) if verify_checksums else read_manifest(directory)
+    parts = {key: _read_part(directory, part, mmap) for key, part in manifest["parts"].items()}
+    parts["_manifest"] = manifest
+    return parts
+
+
+# --- legacy model files -----------------------------------------------------
+
+def convert() -> Dict[str, str]:
+    """Packs the classifier and price model files of HERE into ARTIFACTS_DIR."""
+    import classifier
+    import pricing
+    out = {}
+    clf = classifier.Classifier.from_files(HERE)
+    path = os.path.join(ARTIFACTS_DIR, "classifier")
+    save(path, clf.parts(), version=clf.version, source="best_model.ubj, scaler.pkl, columns.npy")
+    out["classifier"] = path
+    if os.path.exists(pricing.LEGACY_PATH):
+        price = pricing.PriceModel.from_artifact(joblib.load(pricing.LEGACY_PATH), "legacy")
+        path = os.path.join(ARTIFACTS_DIR, "price")
+        save(path, {"model": price.model, "encoder": price.encoder.to_dict()},
+             source=os.path.basename(pricing.LEGACY_PATH))
+        out["price"] = path
+    return out
+
+
+BENCH_CODE = """
+import resource, sys, time, warnings
+warnings.filterwarnings("ignore")
+import numpy, sklearn.ensemble, xgboost  # imports are not what is measured
+import classifier, pricing
+rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+t0 = time.perf_counter()
+if sys.argv[1] == "legacy":
+    classifier.Classifier.from_files(classifier.CLASSIFIER_DIR)
+    pricing.PriceModel.from_artifact(pricing.joblib.load(pricing.LEGACY_PATH), "legacy")
+else:
+    classifier.load()
+    pricing.PriceModel.from_artifact(pricing.artifacts.load(pricing.BUNDLE_PATH), "bundle")
+print(time.perf_counter() - t0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss0)
+"""
+
+
+def bench(repeat: int = 3) -> Dict[str, dict]:
+    """Best-of-`repeat` load seconds and peak RSS growth (KB) in fresh interpreters."""
+    out = {}
+    for mode in ("legacy", "artifacts"):
+        runs = []
+        for _ in range(repeat):
+            proc = subprocess.run([sys.executable, "-c", BENCH_CODE, mode], cwd=HERE,
+                                  capture_output=True, text=True, check=True)
+            seconds, rss = proc.stdout.split()
+            runs.append((float(seconds), int(rss)))
+        out[mode] = {"seconds": round(min(r[0] for r in runs), 4), "rss_kb": min(r[1] for r in runs)}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("cmd", choices=["convert", "verify", "bench"])
+    ap.add_argument("dirs", nargs="*", help="With verify: artifact directories (default: all in ARTIFACTS_DIR)")
+    args = ap.parse_args()
+
+    if args.cmd == "convert":
+        for name, path in convert().items():
+            print(f"{name}: {path}")
+    elif args.cmd == "verify":
+        dirs = args.dirs or [os.path.join(ARTIFACTS_DIR, d) for d in sorted(os.listdir(ARTIFACTS_DIR))
+                             if exists(os.path.join(ARTIFACTS_DIR, d))]
+        failed = False
+        for d in dirs:
+            try:
+                manifest = verify(d)
+                print(f"ok      {d} ({len(manifest['parts'])} parts)")
+            except ArtifactError as e:
+                failed = True
+                print(f"FAILED  {e}")
+        sys.exit(1 if failed else 0)
+    else:
+        for mode, r in bench().items():
+            print(f"{mode:<10} load {r['seconds']:.3f}s  peak RSS +{r['rss_kb'] / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Batch defect-rate forecasting per REF_AsteelFlash, Id_Machine and TypeTest.
+
+Every series is loaded with one grouped query at (day, ref, machine, type)
+grain, then split in memory per dimension. Series with fewer than
+--min-history days are skipped; the rest are fitted across a process pool
+and all predictions are written to forecast_results under one run id, with
+a summary row (including throughput) in forecast_runs. A series whose fit
+fails is counted in series_failed and the run goes on; the summary row is
+written even when the run itself fails (status 'failed').
+
+    python batch_forecast.py --periods 30 --workers 8 [--engine prophet]
+"""
+import argparse
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Iterator, List
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import engines
+import forecasting
+
+DIMENSIONS = ("ref", "machine", "type_test")
+
+DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS forecast_runs (
+      run_id            CHAR(32) PRIMARY KEY,
+      started           DATETIME NOT NULL,
+      finished          DATETIME NULL,
+      engine            VARCHAR(32) NOT NULL,
+      periods           INT NOT NULL,
+      series_total      INT NOT NULL,
+      series_fitted     INT NOT NULL,
+      series_skipped    INT NOT NULL,
+      series_failed     INT NOT NULL,
+      status            VARCHAR(20) NOT NULL,
+      error             TEXT NULL,
+      seconds           DOUBLE NULL,
+      series_per_second DOUBLE NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS forecast_results (
+      run_id     CHAR(32)     NOT NULL,
+      dimension  VARCHAR(20)  NOT NULL,
+      series_key VARCHAR(255) NOT NULL,
+      ds         DATE         NOT NULL,
+      yhat       DOUBLE,
+      yhat_lower DOUBLE,
+      yhat_upper DOUBLE,
+      PRIMARY KEY (run_id, dimension, series_key, ds)
+    )
+    """,
+]
+
+def load_counts(bind: Engine) -> pd.DataFrame:
+    """
+    Daily test/fail counts at (ds, ref, machine, type_test) grain in one query.
+    """
+    sql = text("""
+        SELECT
+          DATE(t.DateDebut_ts)                      AS ds,
+          b.REF_AsteelFlash                         AS ref,
+          t.Id_Machine                              AS machine,
+          t.TypeTest                                AS type_test,
+          COUNT(*)                                  AS total,
+          SUM(CASE WHEN t.Result = 0 THEN 1 ELSE 0 END) AS fails
+        FROM abb_dbo_test t
+        LEFT JOIN abb_dbo_board b ON t.Id_Board = b.Id
+        WHERE t.DateDebut_ts IS NOT NULL
+        GROUP BY ds, ref, machine, type_test
+    """)
+    df = pd.read_sql(sql, bind)
+    df["ds"] = pd.to_datetime(df["ds"])
+    return df
+
+
+def split_series(counts: pd.DataFrame, dimensions=DIMENSIONS, min_history: int = 14):
+    """
+    Splits the counts into one daily defect-rate series per dimension value.
+    Returns ([(dimension, key, history[ds, y]), ...], skipped_count).
+    """
+    series, skipped = [], 0
+    for dim in dimensions:
+        daily = (counts.dropna(subset=[dim])
+                       .groupby([dim, "ds"], sort=True)[["total", "fails"]].sum()
+                       .reset_index())
+        daily["y"] = daily["fails"] / daily["total"]
+        for key, g in daily.groupby(dim, sort=False):
+            if len(g) < min_history:
+                skipped += 1
+                continue
+            series.append((dim, str(key), g[["ds", "y"]].reset_index(drop=True)))
+    return series, skipped
+
+
+def _chunks(items: List, size: int) -> Iterator[List]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def run(bind: Engine, periods: int = 30, workers: int = os.cpu_count() or 2,
+        min_history: int = 14, dimensions=DIMENSIONS, chunk_size: int = 8,
+        engine: str = engines.DEFAULT_ENGINE) -> dict:
+    engines.get(engine)  # fail fast on an unknown engine
+    run_id = uuid.uuid4().hex
+    started = datetime.now()
+    t0 = time.perf_counter()
+
+    with bind.begin() as conn:
+        for ddl in DDL:
+            conn.execute(text(ddl))
+
+    series, skipped, fitted, failed, error = [], 0, 0, 0, None
+    try:
+        counts = load_counts(bind)
+        series, skipped = split_series(counts, dimensions, min_history)
+        print(f"{len(series)} series to fit, {skipped} skipped (< {min_history} days)")
+
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            futures = [pool.submit(forecasting.forecast_series, chunk, periods, engine)
+                       for chunk in _chunks(series, chunk_size)]
+            for fut in as_completed(futures):
+                preds, failures = fut.result()
+                fitted += len(preds)
+                failed += len(failures)
+                for dimension, key, err in failures:
+                    print(f"  {dimension}={key} failed: {err}")
+                if preds:
+                    out = pd.concat(preds, ignore_index=True)
+                    out.insert(0, "run_id", run_id)
+                    out["ds"] = out["ds"].dt.date
+                    out.to_sql("forecast_results", bind, if_exists="append", index=False,
+                               method="multi", chunksize=5000)
+                print(f"  {fitted}/{len(series)} series "
+                      f"({fitted / (time.perf_counter() - t0):.1f} series/s)")
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        summary = {
+            "run_id": run_id, "started": started, "finished": datetime.now(),
+            "engine": engine, "periods": periods,
+            "series_total": len(series) + skipped, "series_fitted": fitted, "series_skipped": skipped,
+            "series_failed": failed, "status": "failed" if error else "partial" if failed else "done",
+            "error": error, "seconds": round(seconds, 3),
+            "series_per_second": round(fitted / seconds, 3) if seconds else None,
+        }
+        with bind.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO forecast_runs (run_id, started, finished, engine, periods, series_total,
+                                           series_fitted, series_skipped, series_failed, status, error,
+                                           seconds, series_per_second)
+                VALUES (:run_id, :started, :finished, :engine, :periods, :series_total,
+                        :series_fitted, :series_skipped, :series_failed, :status, :error,
+                        :seconds, :series_per_second)
+            """), summary)
+    return summary
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--periods", type=int, default=30)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--min-history", type=int, default=14, help="Skip series with fewer days")
+    ap.add_argument("--dimensions", default=",".join(DIMENSIONS))
+    ap.add_argument("--engine", default=engines.DEFAULT_ENGINE, choices=sorted(engines.ENGINES))
+    args = ap.parse_args()
+
+    from database import engine as db_engine
+    summary = run(db_engine, args.periods, args.workers, args.min_history,
+                  tuple(d for d in args.dimensions.split(",") if d), engine=args.engine)
+    print(f"Run {summary['run_id']}: {summary['series_fitted']} series in {summary['seconds']}s "
+          f"({summary['series_per_second']} series/s), {summary['series_skipped']} skipped, "
+          f"{summary['series_failed']} failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Micro-batching of single-record model calls.
+
+Requests arriving together are queued; a collector task takes the first
+waiting item, keeps collecting until `max_batch` items or `max_wait_ms`
+after that first item, runs the batch function once in a worker thread
+(off the event loop) and resolves every caller's future with its own result.
+
+Each batcher records histograms of batch sizes, queue waits (submit to
+batch start) and inference times, served by /api/admin/batching-stats to
+tune the wait/size trade-off:
+
+    PREDICT_BATCH_MAX=64 PREDICT_BATCH_WAIT_MS=5
+"""
+import asyncio
+import bisect
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+MAX_BATCH = int(os.getenv("PREDICT_BATCH_MAX", "64"))
+MAX_WAIT_MS = float(os.getenv("PREDICT_BATCH_WAIT_MS", "5"))
+
+SIZE_BOUNDS = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+MS_BOUNDS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 1000]
+
+
+class Histogram:
+    """Bucket i counts values <= bounds[i] (and > bounds[i-1]); the last one the rest."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.total += 1
+            self.sum += value
+            self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Upper bound of the bucket holding the q-quantile (at most the max seen)."""
+        if not self.total:
+            return None
+        rank, seen = q * self.total, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [str(b) for b in self.bounds] + ["+inf"]
+            return {
+                "count": self.total,
+                "mean": round(self.sum / self.total, 4) if self.total else None,
+                "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95),
+                "max": self.max,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+class MicroBatcher:
+    def __init__(self, name: str, fn: Callable[[List[Any]], Sequence[Any]],
+                 max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS):
+        self.name = name
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batch_size = Histogram(SIZE_BOUNDS)
+        self.queue_wait_ms = Histogram(MS_BOUNDS)
+        self.inference_ms = Histogram(MS_BOUNDS)
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def submit(self, item: Any) -> Any:
+        """Result of `fn` for `item`, computed in a batch with concurrent submits."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # The collector lives on the loop serving requests
+            self._loop, self._queue = loop, asyncio.Queue()
+            self._task = loop.create_task(self._collect(self._queue))
+        future = loop.create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self, queue: asyncio.Queue) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._run(batch)
+
+    async def _run(self, batch: list) -> None:
+        start = time.perf_counter()
+        self.batch_size.observe(len(batch))
+        for _, _, queued in batch:
+            self.queue_wait_ms.observe((start - queued) * 1000)
+        try:
+            results = await asyncio.to_thread(self.fn, [item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.inference_ms.observe((time.perf_counter() - start) * 1000)
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "batch_size": self.batch_size.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+            "inference_ms": self.inference_ms.snapshot(),
+        }
+
+
+_batchers: Dict[str, MicroBatcher] = {}
+
+
+def batcher(name: str, fn: Callable[[List[Any]], Sequence[Any]], **kwargs) -> MicroBatcher:
+    if name not in _batchers:
+        _batchers[name] = MicroBatcher(name, fn, **kwargs)
+    return _batchers[name]
+
+
+def stats() -> Dict[str, dict]:
+    return {name: b.stats() for name, b in _batchers.items()}
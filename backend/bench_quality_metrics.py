@@ -0,0 +1,164 @@
+"""
+Benchmark: legacy multi-query MetricsService.quality path vs the single-pass
+QualityAggregator, on a synthetic abb_dbo_test table.
+
+    python bench_quality_metrics.py --rows 2000000 --repeat 3
+
+Runs against a throw-away SQLite database (STR_TO_DATE is registered as a
+Python function) so it needs no MySQL server. The legacy path filters on the
+VARCHAR DateDebut, the new one on the indexed DateDebut_ts column.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+from aggregation import QualityAggregator
+
+LEGACY_QUERIES = {
+    "total": """
+        SELECT COUNT(*) FROM abb_dbo_test
+        WHERE STR_TO_DATE(DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
+    """,
+    "good": """
+        SELECT COUNT(*) FROM abb_dbo_test
+        WHERE Result = 1 AND STR_TO_DATE(DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
+    """,
+    "ref_stats": """
+        SELECT
+          b.REF_AsteelFlash AS ref_asteel,
+          SUM(t.Result = 1) AS good_count,
+          SUM(t.Result != 1 OR t.Result IS NULL) AS bad_count,
+          MAX(t.Num_Serie) AS serial_number
+        FROM abb_dbo_board b JOIN abb_dbo_test t ON t.Id_Board = b.Id
+        WHERE STR_TO_DATE(t.DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
+        GROUP BY b.REF_AsteelFlash
+    """,
+    "ref_price": """
+        SELECT
+          b.REF_AsteelFlash AS ref_asteel,
+          SUM(t.Result = 1) AS good_tests,
+          SUM(t.Result != 1 OR t.Result IS NULL) AS bad_tests,
+          b.prix AS unit_price,
+          SUM(t.Result = 1) * b.prix AS total_price,
+          MAX(t.Num_Serie) AS num_serie
+        FROM abb_dbo_board b JOIN abb_dbo_test t ON t.Id_Board = b.Id
+        WHERE STR_TO_DATE(t.DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
+        GROUP BY b.REF_AsteelFlash, b.prix
+    """,
+}
+
+
+def _str_to_date(value, _fmt):
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value).strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def build_engine(path: str):
+    engine = create_engine(f"sqlite:///{path}")
+
+    @event.listens_for(engine, "connect")
+    def _register(dbapi_conn, _):
+        dbapi_conn.create_function("STR_TO_DATE", 2, _str_to_date, deterministic=True)
+
+    return engine
+
+
+def populate(path: str, rows: int, boards: int, days: int, seed: int = 42):
+    rnd = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE abb_dbo_board (Id INTEGER PRIMARY KEY, REF_AsteelFlash TEXT, prix REAL);
+        CREATE TABLE abb_dbo_test (
+            Id INTEGER PRIMARY KEY, Id_Board INTEGER, Num_Serie TEXT,
+            DateDebut TEXT, Result INTEGER, DateDebut_ts TEXT
+        );
+    """)
+    conn.executemany(
+        "INSERT INTO abb_dbo_board VALUES (?, ?, ?)",
+        ((i, f"REF{i % (boards // 2 or 1):05d}", round(rnd.uniform(1, 200), 2)) for i in range(1, boards + 1)),
+    )
+    origin = datetime(2025, 7, 1)
+    span = days * 86400
+
+    def gen():
+        for i in range(1, rows + 1):
+            ts = (origin + timedelta(seconds=rnd.randrange(span))).strftime("%Y-%m-%d %H:%M:%S")
+            yield (i, rnd.randint(1, boards + 5), f"SN{i:09d}",
+                   ts, 1 if rnd.random() < 0.93 else 0, ts)
+
+    conn.executemany("INSERT INTO abb_dbo_test VALUES (?, ?, ?, ?, ?, ?)", gen())
+    conn.execute("CREATE INDEX ix_test_datedebut_ts_result ON abb_dbo_test (DateDebut_ts, Result)")
+    conn.commit()
+    conn.close()
+    return origin
+
+
+def legacy(db, params):
+    return {name: db.execute(text(sql), params).fetchall() for name, sql in LEGACY_QUERIES.items()}
+
+
+def single_pass(db, params):
+    return QualityAggregator(db).run(params["start"], params["end"])
+
+
+def timed(fn, *args, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=2_000_000)
+    ap.add_argument("--boards", type=int, default=400)
+    ap.add_argument("--days", type=int, default=30)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.sqlite")
+        print(f"Generating {args.rows:,} test rows...")
+        t0 = time.perf_counter()
+        origin = populate(path, args.rows, args.boards, args.days)
+        print(f"  done in {time.perf_counter() - t0:.1f}s")
+
+        day = origin + timedelta(days=args.days // 2)
+        params = {"start": f"{day:%Y-%m-%d} 00:00:00", "end": f"{day:%Y-%m-%d} 23:59:59"}
+        db = sessionmaker(bind=build_engine(path))()
+        try:
+            t_old, old = timed(legacy, db, params, repeat=args.repeat)
+            t_new, new = timed(single_pass, db, params, repeat=args.repeat)
+        finally:
+            db.close()
+
+        assert old["total"][0][0] == new.total, "total mismatch"
+        assert old["good"][0][0] == new.good, "good mismatch"
+        assert sorted(tuple(r[:4]) for r in old["ref_stats"]) == sorted(
+            (r.ref_asteel, r.good_count, r.bad_count, r.serial_number) for r in new.ref_stats
+        ), "ref_stats mismatch"
+        assert sorted((r[0], r[1], r[2], r[3]) for r in old["ref_price"]) == sorted(
+            (r.ref_asteel, r.good_tests, r.bad_tests, r.unit_price) for r in new.ref_price_stats
+        ), "ref_price mismatch"
+
+        print(f"Window {params['start']} .. {params['end']}: {new.total:,} tests")
+        print(f"  legacy (4 scans) : {t_old * 1000:9.1f} ms")
+        print(f"  single pass      : {t_new * 1000:9.1f} ms")
+        print(f"  speed-up         : {t_old / t_new:9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark: API cold start.
+
+Measures, each in a fresh interpreter:
+  - `import main` with -X importtime: total, the slowest of main's direct
+    imports and which of the heavy data/ML modules (lazy.HEAVY_MODULES) got loaded;
+  - time to first request: from launching uvicorn to the first successful
+    response on --path.
+
+    python bench_startup.py                      # against the configured DB
+    python bench_startup.py --no-db              # no MySQL needed
+    python bench_startup.py --output startup.jsonl --max-import 1.5
+
+--no-db skips Base.metadata.create_all and the DB-backed background loaders
+(hot window, rollup refresh, retrain scheduler, risk scoring, drift monitor). --output
+appends one JSON line per run so regressions show up over time;
+--max-import / --max-first-request exit non-zero when exceeded.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import datetime
+
+from lazy import HEAVY_MODULES
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NO_DB_PRELUDE = "import database; database.Base.metadata.create_all = lambda **k: None; "
+NO_DB_ENV = {"HOT_WINDOW_DAYS": "0", "ROLLUP_REFRESH": "0", "RETRAIN_SCHEDULER": "0",
+             "RISK_SCORING": "0", "DRIFT_MONITOR": "0"}
+
+
+def _env(no_db: bool) -> dict:
+    env = dict(os.environ)
+    if no_db:
+        env.update(NO_DB_ENV)
+    return env
+
+
+def measure_imports(no_db: bool):
+    """
+    (total seconds, [(module, cumulative seconds)] for main and its direct
+    imports, heavy modules loaded). Interpreter start-up imports (everything
+    up to `site`) are left out.
+    """
+    code = (NO_DB_PRELUDE if no_db else "") + "import main"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=HERE, env=_env(no_db),
+                          capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main failed:\n{proc.stderr[-2000:]}")
+    total, modules, loaded, started = 0.0, [], set(), False
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name, seconds = name.strip(), int(cumulative) / 1e6
+        if not started:
+            started = depth == 0 and name == "site"
+            continue
+        loaded.add(name)
+        if depth <= 1:
+            modules.append((name, seconds))
+        if depth == 0:
+            total += seconds
+    return total, sorted(modules, key=lambda x: -x[1]), [m for m in HEAVY_MODULES if m in loaded]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_first_request(path: str, no_db: bool, timeout: float = 120) -> float:
+    port = _free_port()
+    code = (NO_DB_PRELUDE if no_db else "") + \
+        f"import uvicorn; uvicorn.run('main:app', host='127.0.0.1', port={port}, log_level='warning')"
+    t0 = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=HERE, env=_env(no_db),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited:\n{proc.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as resp:
+                    resp.read()
+                    return time.perf_counter() - t0
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError(f"no response within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--path", default="/openapi.json", help="Endpoint for the first request")
+    ap.add_argument("--no-db", action="store_true")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per measurement; the best is kept")
+    ap.add_argument("--top", type=int, default=10)
+    ap.add_argument("--output", help="Append results as a JSON line to this file")
+    ap.add_argument("--max-import", type=float, help="Fail if `import main` takes longer (s)")
+    ap.add_argument("--max-first-request", type=float, help="Fail if the first response takes longer (s)")
+    args = ap.parse_args()
+
+    runs = [measure_imports(args.no_db) for _ in range(args.repeat)]
+    total, top, heavy = min(runs, key=lambda r: r[0])
+    first = min(measure_first_request(args.path, args.no_db) for _ in range(args.repeat))
+
+    print(f"import main:        {total:.3f}s")
+    for name, seconds in top[:args.top]:
+        print(f"  {name:<30} {seconds:.3f}s")
+    print(f"heavy modules loaded at import: {', '.join(heavy) or 'none'}")
+    print(f"time to first request ({args.path}): {first:.3f}s")
+
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(json.dumps({
+                "at": datetime.now().isoformat(timespec="seconds"), "python": sys.version.split()[0],
+                "import_seconds": round(total, 4), "first_request_seconds": round(first, 4),
+                "modules": {n: round(s, 4) for n, s in top}, "heavy_loaded": heavy,
+            }) + "\n")
+
+    failed = (args.max_import is not None and total > args.max_import) or \
+             (args.max_first_request is not None and first > args.max_first_request)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+In-process scoring with the XGBoost test-result classifier.
+
+Loaded from the `classifier` artifact in artifacts.ARTIFACTS_DIR when there
+is one (see `python artifacts.py convert`), otherwise from the training
+outputs in CLASSIFIER_DIR (default backend/):
+  best_model.ubj   XGBClassifier saved with save_model()
+  scaler.pkl       StandardScaler over a few numeric features
+  columns.npy      feature order used at training (columns.pkl as fallback)
+
+Records are turned into the training feature matrix column by column:
+numeric fields are copied, Test_Duration / Hour_of_Day / Day_of_Week are
+derived from DateDebut/DateFin, and each categorical field is one-hot
+encoded against the saved `<field>_<value>` columns (unseen or missing
+values go to `<field>_Unknown` when the model has one). The whole batch is
+then scored with a single predict_proba call.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import artifacts
+import lazy
+
+log = logging.getLogger(__name__)
+
+joblib = lazy.module("joblib")
+xgb = lazy.module("xgboost")
+
+CLASSIFIER_DIR = os.getenv("CLASSIFIER_DIR", os.path.dirname(os.path.abspath(__file__)))
+ARTIFACT_PATH = os.path.join(artifacts.ARTIFACTS_DIR, "classifier")
+MAX_BATCH = 100_000
+
+# One-hot encoded fields, as named in the column list
+CATEGORICAL = [
+    "Id_Board", "Id_Machine", "family_name", "ref_asteel", "designation", "client",
+    "code_indus", "indice", "software_ver", "id_assembly", "id_process", "id_famille",
+    "board_version",
+]
+# Categories stored as float strings at training ("4.0", "21.0")
+FLOAT_CODED = {"id_assembly", "id_process", "id_famille"}
+DERIVED = {"Test_Duration", "Hour_of_Day", "Day_of_Week"}
+
+
+def _float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _category(field: str, value) -> str:
+    if value is None or value == "":
+        return "Unknown"
+    if field in FLOAT_CODED:
+        try:
+            return str(float(value))
+        except (TypeError, ValueError):
+            return str(value)
+    if field == "Id_Board":
+        return str(int(value))
+    return str(value)
+
+
+def derived(records: Sequence[dict]) -> Dict[str, np.ndarray]:
+    """Test_Duration, Hour_of_Day and Day_of_Week per record (0 without dates)."""
+    start = np.array([r.get("DateDebut") for r in records], dtype="datetime64[s]")
+    end = np.array([r.get("DateFin") for r in records], dtype="datetime64[s]")
+    ok = ~np.isnat(start)
+    return {
+        "Test_Duration": np.where(ok & ~np.isnat(end), (end - start).astype(np.float64), 0.0),
+        "Hour_of_Day": np.where(ok, (start - start.astype("datetime64[D]")).astype("timedelta64[h]").astype(np.float64), 0.0),
+        # 1970-01-01 was a Thursday; Monday = 0 as in pandas' dayofweek
+        "Day_of_Week": np.where(ok, (start.astype("datetime64[D]").astype(np.int64) + 3) % 7, 0).astype(np.float64),
+    }
+
+
+class Classifier:
+    def __init__(self, model: Any, columns: Sequence[str], scaled: Sequence[str],
+                 mean: np.ndarray, scale: np.ndarray, version: str):
+        self.model = model
+        self.columns = [str(c) for c in columns]
+        self.version = version
+        index = {c: i for i, c in enumerate(self.columns)}
+        # field -> {category -> column}; the longest matching field prefix wins
+        self.onehot: Dict[str, Dict[str, int]] = {f: {} for f in CATEGORICAL}
+        self.numeric: Dict[str, int] = {}
+        for i, col in enumerate(self.columns):
+            field = max((f for f in CATEGORICAL if col.startswith(f + "_")), key=len, default=None)
+            if field is None:
+                self.numeric[col] = i
+            else:
+                self.onehot[field][col[len(field) + 1:]] = i
+
+        self.scaled_names = [str(n) for n in scaled]
+        self.scaled = np.array([index[n] for n in self.scaled_names], dtype=np.intp)
+        self.mean = mean
+        self.scale = scale
+
+    @classmethod
+    def from_files(cls, directory: str = CLASSIFIER_DIR) -> "Classifier":
+        path = lambda name: os.path.join(directory, name)
+        model = xgb.XGBClassifier()
+        model.load_model(path("best_model.ubj"))
+        if os.path.exists(path("columns.npy")):
+            columns = np.load(path("columns.npy"), allow_pickle=True)
+        else:
+            columns = joblib.load(path("columns.pkl"))
+        scaler = joblib.load(path("scaler.pkl"))
+        names = list(getattr(scaler, "feature_names_in_", []))
+        mean = scaler.mean_ if scaler.with_mean else np.zeros(len(names))
+        scale = scaler.scale_ if scaler.with_std else np.ones(len(names))
+        return cls(model, columns, names, mean, scale, artifacts.sha256(path("best_model.ubj"))[:12])
+
+    @classmethod
+    def from_artifact(cls, directory: str = ARTIFACT_PATH) -> "Classifier":
+        parts = artifacts.load(directory)
+        manifest = parts["_manifest"]
+        version = manifest["meta"].get("version") or manifest["parts"]["model"]["sha256"][:12]
+        return cls(parts["model"], parts["columns"], parts["scaled"], parts["mean"], parts["scale"], version)
+
+    def parts(self) -> Dict[str, Any]:
+        """What from_artifact() needs, for artifacts.save()."""
+        return {"model": self.model, "columns": np.array(self.columns), "scaled": np.array(self.scaled_names),
+                "mean": np.asarray(self.mean, dtype=np.float64), "scale": np.asarray(self.scale, dtype=np.float64)}
+
+    @property
+    def n_features(self) -> int:
+        return len(self.columns)
+
+    def features(self, records: Sequence[dict]) -> np.ndarray:
+        """The (n, n_features) float32 matrix for `records` (dicts of raw fields)."""
+        n = len(records)
+        X = np.zeros((n, self.n_features), dtype=np.float32)
+
+        for field, col in self.numeric.items():
+            if field in DERIVED:
+                continue
+            vals = np.fromiter((_float(r.get(field)) for r in records), dtype=np.float64, count=n)
+            X[:, col] = np.nan_to_num(vals)
+
+        for field, vals in derived(records).items():
+            if field in self.numeric:
+                X[:, self.numeric[field]] = vals
+
+        rows = np.arange(n)
+        for field, categories in self.onehot.items():
+            if not categories:
+                continue
+            values = np.array([_category(field, r.get(field)) for r in records], dtype=object)
+            uniq, inverse = np.unique(values, return_inverse=True)
+            fallback = categories.get("Unknown", -1)
+            cols = np.array([categories.get(u, fallback) for u in uniq], dtype=np.intp)[inverse]
+            hit = cols >= 0
+            X[rows[hit], cols[hit]] = 1.0
+
+        if len(self.scaled):
+            X[:, self.scaled] = (X[:, self.scaled] - self.mean) / self.scale
+        return X
+
+    def predict_proba(self, records: Sequence[dict]) -> np.ndarray:
+        """P(Result = 1) per record, from one predict_proba call."""
+        if not len(records):
+            return np.zeros(0)
+        return self.model.predict_proba(self.features(records))[:, 1]
+
+    def predict(self, records: Sequence[dict]) -> Tuple[List[int], List[float]]:
+        proba = self.predict_proba(records)
+        return (proba >= 0.5).astype(int).tolist(), proba.astype(float).tolist()
+
+
+_classifier: Optional[Classifier] = None
+_lock = threading.Lock()
+
+
+def load() -> Classifier:
+    if artifacts.exists(ARTIFACT_PATH):
+        return Classifier.from_artifact(ARTIFACT_PATH)
+    return Classifier.from_files(CLASSIFIER_DIR)
+
+
+def get() -> Classifier:
+    """The classifier, loaded on first use (or by preload() at startup)."""
+    global _classifier
+    if _classifier is None:
+        with _lock:
+            if _classifier is None:
+                _classifier = load()
+    return _classifier
+
+
+def preload() -> None:
+    """Startup hook: loads the artifacts in the background."""
+    def load():
+        try:
+            get()
+        except Exception:
+            log.exception("classifier preload failed")
+    threading.Thread(target=load, name="classifier-preload", daemon=True).start()
@@ -0,0 +1,131 @@
+"""
+Persisted daily test/fail counts of abb_dbo_test, the input of every
+defect-rate forecast and back-test.
+
+daily_defect_counts holds one row per day. The newest stored day is the
+watermark: a refresh recomputes that day (it was probably still open when
+stored) and every day after it with a range scan on DateDebut_ts, upserting
+those rows, so workers refreshing at the same time never remove a day
+another one is reading. Older days are never rescanned, so readers
+get a few hundred rows instead of a GROUP BY over the whole history.
+
+    python daily_store.py refresh    # create the table if needed and catch up
+    python daily_store.py rebuild    # recompute every day
+
+Rows inserted with a DateDebut before the watermark day are only picked up
+by `rebuild`.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import lazy
+
+pd = lazy.module("pandas")
+
+TABLE = "daily_defect_counts"
+# Readers refresh at most this often (seconds) per process
+REFRESH_INTERVAL = float(os.getenv("DAILY_STORE_REFRESH", "60"))
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+      day        DATE     PRIMARY KEY,
+      total      BIGINT   NOT NULL,
+      fails      BIGINT   NOT NULL,
+      updated_at DATETIME NOT NULL
+    )
+"""
+
+
+class DailyDefectStore:
+    def __init__(self, interval: float = REFRESH_INTERVAL):
+        self.interval = interval
+        self._last_refresh = {}
+        self._created = set()
+        self._lock = threading.Lock()
+
+    def init(self, bind: Engine) -> None:
+        """Creates the table; once per process and database, on first use."""
+        key = str(bind.url)
+        if key not in self._created:
+            with bind.begin() as conn:
+                conn.execute(text(DDL))
+            self._created.add(key)
+
+    def refresh(self, bind: Engine) -> int:
+        """
+        Recomputes the watermark day and everything after it. Returns the
+        number of days written.
+        """
+        self.init(bind)
+        with bind.begin() as conn:
+            since = conn.execute(text(f"SELECT MAX(day) FROM {TABLE}")).scalar()
+            if since is None:
+                since = datetime(1970, 1, 1)
+            since = pd.Timestamp(since).to_pydatetime()
+            conn.execute(text(f"""
+                INSERT INTO {TABLE} (day, total, fails, updated_at)
+                SELECT
+                  DATE(t.DateDebut_ts),
+                  COUNT(*),
+                  SUM(CASE WHEN t.Result = 0 THEN 1 ELSE 0 END),
+                  :now
+                FROM abb_dbo_test t
+                WHERE t.DateDebut_ts >= :since
+                GROUP BY DATE(t.DateDebut_ts)
+                ON DUPLICATE KEY UPDATE total = VALUES(total), fails = VALUES(fails),
+                                        updated_at = VALUES(updated_at)
+            """), {"since": since, "now": datetime.now()})
+            written = conn.execute(text(f"SELECT COUNT(*) FROM {TABLE} WHERE day >= :since"),
+                                   {"since": since.date()}).scalar()
+        self._last_refresh[str(bind.url)] = time.monotonic()
+        return int(written)
+
+    def rebuild(self, bind: Engine) -> int:
+        self.init(bind)
+        with bind.begin() as conn:
+            conn.execute(text(f"DELETE FROM {TABLE}"))
+        return self.refresh(bind)
+
+    def load(self, bind: Engine, closed: bool = True) -> pd.DataFrame:
+        """
+        Daily frame [ds, total, fails, y] with y = fails / total, refreshed
+        first when the last refresh is older than `interval`. Today, still
+        open, is left out unless `closed` is False, so the frame (and the
+        fingerprint of models trained on it) changes once a day.
+        """
+        key = str(bind.url)
+        with self._lock:
+            if time.monotonic() - self._last_refresh.get(key, float("-inf")) >= self.interval:
+                self.refresh(bind)
+        where = "total > 0 AND day < :today" if closed else "total > 0"
+        df = pd.read_sql(text(f"SELECT day AS ds, total, fails FROM {TABLE} WHERE {where} ORDER BY day"),
+                         bind, params={"today": datetime.now().date()})
+        df["ds"] = pd.to_datetime(df["ds"])
+        df["y"] = df["fails"] / df["total"]
+        return df
+
+
+daily_store = DailyDefectStore()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("cmd", choices=["refresh", "rebuild"])
+    args = ap.parse_args()
+
+    from database import engine
+    t0 = time.perf_counter()
+    days = daily_store.refresh(engine) if args.cmd == "refresh" else daily_store.rebuild(engine)
+    print(f"{args.cmd}: {days} day(s) written in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
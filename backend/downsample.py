@@ -0,0 +1,76 @@
+"""
+Point reduction for chart payloads.
+
+lttb() keeps the visual shape of a series (Largest-Triangle-Three-Buckets,
+Steinarsson 2013); bucket_mean() averages contiguous buckets. Both keep the
+first and last point and return at most `n` rows.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+import lazy
+
+pd = lazy.module("pandas")
+
+MODES = ("full", "none", "lttb", "mean")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """Indices of the `n` points LTTB selects from (x, y)."""
+    size = len(x)
+    if n >= size:
+        return np.arange(size)
+    if n < 3:
+        raise ValueError("LTTB needs at least 3 points")
+    edges = np.linspace(1, size - 1, n - 1).astype(int)  # n - 2 buckets between the end points
+    out = np.empty(n, dtype=int)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        # Average of the next bucket (the last point for the final bucket)
+        nlo, nhi = hi, edges[i + 2] if i + 2 < len(edges) else size
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(np.argmax(area))
+        out[i + 1] = a
+    return out
+
+
+def bucket_mean(df: pd.DataFrame, n: int, x: str = "ds") -> pd.DataFrame:
+    """
+    `n` contiguous buckets; numeric columns are averaged and `x` is taken
+    from the first row of each bucket. The first and last rows are kept.
+    """
+    if n >= len(df):
+        return df
+    if n < 3:
+        raise ValueError("bucket_mean needs at least 3 points")
+    inner = df.iloc[1:-1]
+    bucket = np.arange(len(inner)) * (n - 2) // len(inner)
+    grouped = inner.groupby(bucket)
+    means = grouped.mean(numeric_only=True)
+    means.insert(0, x, grouped[x].first())
+    return pd.concat([df.iloc[:1], means, df.iloc[-1:]], ignore_index=True)[df.columns]
+
+
+def reduce_history(frame: pd.DataFrame, periods: int, mode: str = "full",
+                   max_points: int = 500, y: str = "yhat") -> pd.DataFrame:
+    """
+    Forecast frame whose last `periods` rows are the horizon: keeps the
+    horizon as is and returns the history in full, not at all, or reduced
+    to `max_points` rows.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown history mode '{mode}', expected one of {list(MODES)}")
+    split = len(frame) - periods
+    history, horizon = frame.iloc[:split], frame.iloc[split:]
+    if mode == "none":
+        return horizon.reset_index(drop=True)
+    if mode == "lttb":
+        x = history["ds"].to_numpy().astype("datetime64[s]").astype(np.int64).astype(float)
+        history = history.iloc[lttb(x, history[y].to_numpy(dtype=float), max_points)]
+    elif mode == "mean":
+        history = bucket_mean(history, max_points)
+    return pd.concat([history, horizon], ignore_index=True)
@@ -0,0 +1,544 @@
+"""
+Input drift of the defect classifier and the price model, from streaming
+feature statistics.
+
+Two profiles are kept per monitored model:
+  reference  built once per model version from the rows it was trained on
+             (price: every board up to the watermark; classifier: the
+             DRIFT_REFERENCE_DAYS of tests up to it)
+  live       updated from each batch of rows above the watermark as they
+             arrive; no row is read twice. Older rows are decayed so the
+             profile weighs about the last DRIFT_LIVE_ROWS rows
+Numeric features keep count, missing, mean and variance (Welford, merged a
+batch at a time), min / max, and counts over DRIFT_BINS bins whose edges
+are the quantiles of the reference's first batch. Categorical features keep
+a Space-Saving sketch of their DRIFT_TOP_K most frequent values.
+
+drift() compares live to reference per feature: PSI over the bins (numeric)
+or over the values both sketches track plus "other" (categorical), and for
+numeric features the KS statistic between the binned CDFs, a lower bound of
+the exact one. A categorical feature whose sketch cannot vouch for at least
+DRIFT_MIN_COVERAGE of its rows (near-unique values such as board
+references) has too many distinct values to compare and is left unscored. A model whose live profile has at least DRIFT_MIN_ROWS rows
+and a feature with PSI >= DRIFT_PSI_ALERT is drifted; the retrain scheduler
+uses that to retrain the price model on drift rather than on a fixed
+schedule only. Only new rows are seen: edits to existing boards or tests
+are not.
+
+Profiles are saved as JSON in model_drift_state after every refresh, so a
+restart resumes at the watermark. Every worker may run the monitor: a MySQL
+named lock lets one refresh at a time, each refresh starts from the saved
+state, and the others skip their turn.
+
+    python drift.py refresh    # update the live profiles from new rows
+    python drift.py rebuild    # rebuild the reference profiles, restart the live ones
+    python drift.py report     # PSI / KS per feature
+
+The API refreshes in a background thread every DRIFT_MONITOR_POLL seconds
+(DRIFT_MONITOR=0 to disable).
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import classifier
+import pricing
+import risk_scores
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("DRIFT_MONITOR", "1") != "0"
+POLL_INTERVAL = float(os.getenv("DRIFT_MONITOR_POLL", "300"))
+REFERENCE_DAYS = float(os.getenv("DRIFT_REFERENCE_DAYS", "30"))
+BINS = int(os.getenv("DRIFT_BINS", "20"))
+TOP_K = int(os.getenv("DRIFT_TOP_K", "50"))
+PSI_ALERT = float(os.getenv("DRIFT_PSI_ALERT", "0.25"))
+PSI_WARN = 0.1
+MIN_ROWS = int(os.getenv("DRIFT_MIN_ROWS", "500"))
+LIVE_ROWS = int(os.getenv("DRIFT_LIVE_ROWS", "5000"))
+MIN_COVERAGE = float(os.getenv("DRIFT_MIN_COVERAGE", "0.5"))
+BATCH_SIZE = 20000
+TABLE = "model_drift_state"
+LOCK_NAME = "model_drift_refresh"
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+      model      VARCHAR(50) PRIMARY KEY,
+      version    VARCHAR(64) NOT NULL,
+      watermark  BIGINT      NOT NULL,
+      reference  LONGTEXT    NOT NULL,
+      live       LONGTEXT    NOT NULL,
+      updated    DATETIME    NOT NULL
+    )
+"""
+
+SAVE_SQL = f"""
+    INSERT INTO {TABLE} (model, version, watermark, reference, live, updated)
+    VALUES (:model, :version, :watermark, :reference, :live, :updated)
+    ON DUPLICATE KEY UPDATE version = VALUES(version), watermark = VALUES(watermark),
+      reference = VALUES(reference), live = VALUES(live), updated = VALUES(updated)
+"""
+
+
+# --- statistics -------------------------------------------------------------
+
+class NumericStats:
+    def __init__(self, edges: Optional[Sequence[float]] = None):
+        self.edges = None if edges is None else np.asarray(edges, dtype=np.float64)
+        self.bins = None if edges is None else np.zeros(len(edges) + 1)
+        self.count = 0
+        self.missing = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def update(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        nan = np.isnan(values)
+        self.missing += int(nan.sum())
+        x = values[~nan]
+        if not len(x):
+            return
+        if self.edges is None:
+            q = np.quantile(x, np.linspace(0, 1, BINS + 1)[1:-1])
+            self.edges = np.unique(q)
+            self.bins = np.zeros(len(self.edges) + 1)
+        # Chan et al.: Welford's update for a whole batch at once
+        n, mean = len(x), float(x.mean())
+        total = self.count + n
+        delta = mean - self.mean
+        self.m2 += float(((x - mean) ** 2).sum()) + delta * delta * self.count * n / total
+        self.mean += delta * n / total
+        self.count = total
+        self.min = float(x.min()) if self.min is None else min(self.min, float(x.min()))
+        self.max = float(x.max()) if self.max is None else max(self.max, float(x.max()))
+        self.bins += np.bincount(np.searchsorted(self.edges, x, side="right"), minlength=len(self.bins))
+
+    def scale(self, factor: float) -> None:
+        """Weighs every row seen so far by `factor` (min / max are kept)."""
+        self.count *= factor
+        self.missing *= factor
+        self.m2 *= factor
+        if self.bins is not None:
+            self.bins *= factor
+
+    def empty_like(self) -> "NumericStats":
+        return NumericStats(self.edges)
+
+    def summary(self) -> dict:
+        return {"count": self.count, "missing": self.missing, "mean": self.mean,
+                "std": self.variance ** 0.5, "min": self.min, "max": self.max}
+
+    def to_dict(self) -> dict:
+        return {**self.summary(), "m2": self.m2,
+                "edges": None if self.edges is None else self.edges.tolist(),
+                "bins": None if self.bins is None else self.bins.tolist()}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "NumericStats":
+        s = cls(d["edges"])
+        if d["bins"] is not None:
+            s.bins = np.asarray(d["bins"], dtype=np.float64)
+        s.count, s.missing, s.mean, s.m2, s.min, s.max = (
+            d["count"], d["missing"], d["mean"], d["m2"], d["min"], d["max"])
+        return s
+
+
+class CategoricalStats:
+    """Space-Saving sketch: counts of the `k` most frequent values (over-estimates)."""
+
+    def __init__(self, k: int = TOP_K):
+        self.k = k
+        self.count = 0
+        self.counts: Dict[str, float] = {}
+
+    def update(self, values: Sequence[str]) -> None:
+        self.count += len(values)
+        for value, n in Counter(values).most_common():
+            if value in self.counts:
+                self.counts[value] += n
+            elif len(self.counts) < self.k:
+                self.counts[value] = n
+            else:
+                evicted = min(self.counts, key=self.counts.get)
+                self.counts[value] = self.counts.pop(evicted) + n
+
+    @property
+    def error(self) -> float:
+        """Most any tracked count can over-estimate by: the smallest one once the sketch is full."""
+        return min(self.counts.values()) if len(self.counts) >= self.k else 0.0
+
+    def share(self, value: str) -> float:
+        """Share of rows guaranteed to hold `value` (0 when it is not tracked)."""
+        if not self.count or value not in self.counts:
+            return 0.0
+        return max(0.0, self.counts[value] - self.error) / self.count
+
+    def coverage(self) -> float:
+        """Share of rows the tracked values account for for certain."""
+        return sum(self.share(v) for v in self.counts)
+
+    def scale(self, factor: float) -> None:
+        self.count *= factor
+        self.counts = {v: n * factor for v, n in self.counts.items()}
+
+    def empty_like(self) -> "CategoricalStats":
+        return CategoricalStats(self.k)
+
+    def summary(self) -> dict:
+        top = sorted(self.counts.items(), key=lambda kv: -kv[1])[:5]
+        return {"count": self.count, "distinct_tracked": len(self.counts), "top": dict(top)}
+
+    def to_dict(self) -> dict:
+        return {"k": self.k, "count": self.count, "counts": self.counts}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CategoricalStats":
+        s = cls(d["k"])
+        s.count, s.counts = d["count"], dict(d["counts"])
+        return s
+
+
+def psi(expected: np.ndarray, actual: np.ndarray, eps: float = 1e-4) -> Optional[float]:
+    """Population stability index between two count (or share) vectors."""
+    if expected.sum() <= 0 or actual.sum() <= 0:
+        return None
+    e = np.maximum(expected / expected.sum(), eps)
+    a = np.maximum(actual / actual.sum(), eps)
+    return float(((a - e) * np.log(a / e)).sum())
+
+
+def ks(expected: np.ndarray, actual: np.ndarray) -> Optional[float]:
+    """Largest gap between the CDFs of two binned distributions."""
+    if expected.sum() <= 0 or actual.sum() <= 0:
+        return None
+    return float(np.abs(np.cumsum(expected / expected.sum()) - np.cumsum(actual / actual.sum())).max())
+
+
+def compare(ref, live) -> dict:
+    if isinstance(ref, NumericStats):
+        if ref.bins is None or live.bins is None or len(ref.bins) != len(live.bins):
+            return {"psi": None, "ks": None}
+        return {"psi": psi(ref.bins, live.bins), "ks": ks(ref.bins, live.bins)}
+    if not ref.count or not live.count or min(ref.coverage(), live.coverage()) < MIN_COVERAGE:
+        # Too many distinct values for a top-k sketch: two samples of the
+        # same near-unique ids would share almost no tracked values
+        return {"psi": None, "ks": None}
+    values = [v for v in ref.counts if v in live.counts]
+    e = np.array([ref.share(v) for v in values])
+    a = np.array([live.share(v) for v in values])
+    # "other": everything outside the values tracked on both sides
+    e, a = np.append(e, max(0.0, 1 - e.sum())), np.append(a, max(0.0, 1 - a.sum()))
+    return {"psi": psi(e, a), "ks": None}
+
+
+class Profile:
+    """Stats per feature of one model."""
+
+    def __init__(self, features: Dict[str, object], window: Optional[int] = None):
+        self.features = features
+        # Rows the profile weighs; older ones are decayed away (None: keep all)
+        self.window = window
+        self.rows = 0
+
+    @classmethod
+    def new(cls, numeric: Sequence[str], categorical: Sequence[str]) -> "Profile":
+        return cls({**{f: NumericStats() for f in numeric}, **{f: CategoricalStats() for f in categorical}})
+
+    def update(self, columns: Dict[str, Sequence]) -> None:
+        n = len(next(iter(columns.values()), []))
+        if self.window and self.rows and self.rows + n > self.window:
+            # The older rows keep what is left of the window after this batch
+            factor = max(0.0, self.window - n) / self.rows
+            for stats in self.features.values():
+                stats.scale(factor)
+            self.rows *= factor
+        for name, stats in self.features.items():
+            stats.update(columns[name])
+        self.rows += n
+
+    def empty_like(self, window: Optional[int] = None) -> "Profile":
+        return Profile({name: s.empty_like() for name, s in self.features.items()}, window)
+
+    def to_dict(self) -> dict:
+        return {"rows": self.rows, "window": self.window, "features": {
+            name: {"kind": "numeric" if isinstance(s, NumericStats) else "categorical", **s.to_dict()}
+            for name, s in self.features.items()}}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Profile":
+        p = cls({name: (NumericStats if f["kind"] == "numeric" else CategoricalStats).from_dict(f)
+                 for name, f in d["features"].items()}, d.get("window"))
+        p.rows = d["rows"]
+        return p
+
+
+# --- monitored models -------------------------------------------------------
+
+class Source:
+    def __init__(self, name: str, version: Callable[[], str], numeric: Callable[[], List[str]],
+                 categorical: List[str], columns: Callable[[List[dict]], Dict[str, Sequence]],
+                 rows_sql: str, watermark_sql: str, reference_start: Callable[..., int],
+                 ignore: Sequence[str] = ()):
+        self.name = name
+        self.version = version
+        self.numeric = numeric
+        self.categorical = categorical
+        # records -> {feature: values}
+        self.columns = columns
+        # rows with Id > :last ORDER BY Id LIMIT :n; "Id" in the result
+        self.rows_sql = rows_sql
+        self.watermark_sql = watermark_sql
+        # (conn, watermark) -> Id the reference starts after
+        self.reference_start = reference_start
+        # Reported but left out of the verdict
+        self.ignore = set(ignore)
+
+
+def _classifier_columns(records: List[dict]) -> Dict[str, Sequence]:
+    model = classifier.get()
+    derived = classifier.derived(records)
+    out = {}
+    for field in model.numeric:
+        out[field] = derived[field] if field in derived else \
+            np.fromiter((classifier._float(r.get(field)) for r in records), dtype=np.float64, count=len(records))
+    for field in classifier.CATEGORICAL:
+        out[field] = [classifier._category(field, r.get(field)) for r in records]
+    return out
+
+
+def _recent_tests(conn, watermark: int) -> int:
+    since = datetime.now() - timedelta(days=REFERENCE_DAYS)
+    return int(conn.execute(text(
+        "SELECT COALESCE(MIN(Id), 1) - 1 FROM abb_dbo_test WHERE DateDebut_ts >= :since AND Id <= :w"
+    ), {"since": since, "w": watermark}).scalar() or 0)
+
+
+BOARDS_SQL = """
+    SELECT b.Id, COALESCE(b.REF_AsteelFlash, '') AS ref_asteel, COALESCE(f.Nom_Famille, '') AS family_name
+    FROM abb_dbo_board b
+    LEFT JOIN abb_dbo_famille f ON f.Id = b.Id_Famille
+    WHERE b.Id > :last
+    ORDER BY b.Id
+    LIMIT :n
+"""
+
+SOURCES = [
+    Source(
+        "classifier",
+        version=lambda: classifier.get().version,
+        numeric=lambda: sorted(classifier.get().numeric),
+        categorical=classifier.CATEGORICAL,
+        columns=_classifier_columns,
+        rows_sql=risk_scores.FEATURES_SQL,
+        watermark_sql="SELECT MAX(Id) FROM abb_dbo_test",
+        reference_start=_recent_tests,
+        ignore=["Id"],  # the row id, grows by construction
+    ),
+    Source(
+        pricing.MODEL_NAME,
+        version=lambda: pricing.current().version,
+        numeric=lambda: [],
+        categorical=pricing.FIELDS,
+        columns=lambda records: {f: ["" if r[f] is None else str(r[f]) for r in records] for f in pricing.FIELDS},
+        rows_sql=BOARDS_SQL,
+        watermark_sql="SELECT MAX(Id) FROM abb_dbo_board",
+        reference_start=lambda conn, watermark: 0,  # trained on every board
+        ignore=["ref_asteel"],  # close to one value per board
+    ),
+]
+
+
+class State:
+    def __init__(self, version: str, watermark: int, reference: Profile, live: Profile,
+                 updated: Optional[datetime] = None):
+        self.version = version
+        self.watermark = watermark
+        self.reference = reference
+        self.live = live
+        self.updated = updated
+
+
+class DriftMonitor:
+    def __init__(self, sources: List[Source], poll: float = POLL_INTERVAL):
+        self.sources = {s.name: s for s in sources}
+        self.poll = poll
+        self.states: Dict[str, State] = {}
+        self._table_ready = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _read(self, bind: Engine, name: Optional[str] = None) -> Dict[str, State]:
+        """
+        Saved states (only `name`'s when given). The table is what every
+        worker shares: the one refreshing writes it, the others read it.
+        """
+        if not self._table_ready:
+            with bind.begin() as conn:
+                conn.execute(text(DDL))
+            self._table_ready = True
+        sql = f"SELECT * FROM {TABLE}" + (" WHERE model = :model" if name else "")
+        with bind.connect() as conn:
+            rows = conn.execute(text(sql), {"model": name}).mappings().fetchall()
+        return {r["model"]: State(r["version"], int(r["watermark"]), Profile.from_dict(json.loads(r["reference"])),
+                                  Profile.from_dict(json.loads(r["live"])), r["updated"])
+                for r in rows if r["model"] in self.sources}
+
+    def _save(self, conn, name: str) -> None:
+        st = self.states[name]
+        st.updated = datetime.now()
+        conn.execute(text(SAVE_SQL), {"model": name, "version": st.version, "watermark": st.watermark,
+               "reference": json.dumps(st.reference.to_dict()), "live": json.dumps(st.live.to_dict()),
+               "updated": st.updated})
+
+    def _stream(self, bind: Engine, source: Source, profile: Profile, last: int,
+                until: Optional[int]) -> Tuple[int, int]:
+        """Feeds the rows with last < Id (<= until) to `profile`; returns the last Id and the rows read."""
+        read = 0
+        while True:
+            with bind.connect() as conn:
+                rows = [dict(r) for r in conn.execute(text(source.rows_sql), {"last": last, "n": BATCH_SIZE}).mappings()]
+            if until is not None:
+                rows = [r for r in rows if int(r["Id"]) <= until]
+            if not rows:
+                return last, read
+            profile.update(source.columns(rows))
+            last = int(rows[-1]["Id"])
+            read += len(rows)
+            if len(rows) < BATCH_SIZE:
+                return last, read
+
+    def _rebuild(self, bind: Engine, source: Source, version: str) -> None:
+        with bind.connect() as conn:
+            watermark = int(conn.execute(text(source.watermark_sql)).scalar() or 0)
+            start = source.reference_start(conn, watermark)
+        reference = Profile.new(source.numeric(), source.categorical)
+        self._stream(bind, source, reference, start, watermark)
+        self.states[source.name] = State(version, watermark, reference, reference.empty_like(LIVE_ROWS or None))
+
+    def refresh(self, bind: Engine, rebuild: bool = False) -> Optional[Dict[str, int]]:
+        """
+        Brings every live profile up to date, rebuilding the reference first
+        for a new model version (or all of them with `rebuild`). Returns the
+        rows added per model, or None when another worker holds the refresh
+        lock.
+        """
+        out = {}
+        with self._lock, bind.connect() as lock_conn:
+            if not lock_conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME}).scalar():
+                return None
+            try:
+                # Another worker may have refreshed since: start from its state
+                self.states = self._read(bind)
+                for source in self.sources.values():
+                    version = source.version()
+                    st = self.states.get(source.name)
+                    if rebuild or st is None or st.version != version:
+                        self._rebuild(bind, source, version)
+                        st = self.states[source.name]
+                    st.live.window = LIVE_ROWS or None
+                    st.watermark, out[source.name] = self._stream(bind, source, st.live, st.watermark, None)
+                    with bind.begin() as conn:
+                        self._save(conn, source.name)
+            finally:
+                lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+        return out
+
+    def drift(self, name: str, st: State) -> dict:
+        source = self.sources[name]
+        features = []
+        for feature, ref in st.reference.features.items():
+            live = st.live.features[feature]
+            f = {"feature": feature, "kind": "numeric" if isinstance(ref, NumericStats) else "categorical",
+                 **compare(ref, live), "reference": ref.summary(), "live": live.summary()}
+            f["status"] = "n/a" if f["psi"] is None else \
+                "drift" if f["psi"] >= PSI_ALERT else "warn" if f["psi"] >= PSI_WARN else "ok"
+            features.append(f)
+        features.sort(key=lambda f: -(f["psi"] or 0))
+        scored = [f for f in features if f["psi"] is not None and f["feature"] not in source.ignore]
+        return {
+            "model": name, "version": st.version, "watermark": st.watermark,
+            "reference_rows": st.reference.rows, "live_rows": round(st.live.rows),
+            "updated": st.updated, "max_psi": max((f["psi"] for f in scored), default=None),
+            "drifted": st.live.rows >= MIN_ROWS and any(f["psi"] >= PSI_ALERT for f in scored),
+            "features": features,
+        }
+
+    def report(self, bind: Engine) -> Dict[str, dict]:
+        """drift() of every model with a saved profile."""
+        return {name: self.drift(name, st) for name, st in self._read(bind).items()}
+
+    def drifted(self, bind: Engine, name: str) -> bool:
+        """
+        True when `name`'s live inputs drifted from what its current version
+        was trained on, as last saved by whichever worker runs the monitor.
+        """
+        st = self._read(bind, name).get(name)
+        if st is None or st.version != self.sources[name].version():
+            return False
+        return self.drift(name, st)["drifted"]
+
+    def _run(self, bind: Engine) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh(bind)
+            except Exception:
+                log.exception("drift monitor refresh failed")
+            self._stop.wait(self.poll)
+
+    def start(self, bind: Engine) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(bind,), name="drift-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+
+monitor = DriftMonitor(SOURCES)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("cmd", choices=["refresh", "rebuild", "report"])
+    ap.add_argument("--top", type=int, default=10, help="With report: features per model")
+    args = ap.parse_args()
+
+    from database import engine
+    if args.cmd != "report":
+        added = monitor.refresh(engine, rebuild=args.cmd == "rebuild")
+        if added is None:
+            print("Another process is refreshing; showing its last saved state")
+        for name, n in (added or {}).items():
+            print(f"{name}: {n} new row(s)")
+    for name, r in monitor.report(engine).items():
+        flag = "DRIFTED" if r["drifted"] else "ok"
+        print(f"\n{name} {r['version']}: {flag}, {r['live_rows']} live / {r['reference_rows']} reference rows")
+        for f in r["features"][:args.top]:
+            psi_ = "-" if f["psi"] is None else f"{f['psi']:.3f}"
+            ks_ = "-" if f["ks"] is None else f"{f['ks']:.3f}"
+            print(f"  {f['feature']:<18} {f['kind']:<12} psi {psi_:>7}  ks {ks_:>6}  {f['status']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Lightweight forecasting engines for the daily defect-rate series.
+
+Every engine takes a frame with [ds, y] and predicts frames shaped like
+Prophet's output ([ds, yhat, yhat_lower, yhat_upper]), so they can stand in
+for each other behind ForecastService. Series are daily with a weekly season
+unless another pandas frequency and season length (`period`) are given. The
+NumPy engines fit in a few milliseconds; Prophet is only imported when its
+engine is used.
+
+  - ewma:            simple exponential smoothing, alpha picked by SSE
+  - holt_winters:    additive damped trend + season, grid-searched
+  - seasonal_naive:  the value from one season earlier
+  - prophet:         forecasting.train_prophet
+"""
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, List, Optional, Tuple, Type
+
+import numpy as np
+
+import lazy
+
+pd = lazy.module("pandas")
+
+SEASON = 7      # default: weekly seasonality on daily data
+Z = 1.96        # 95% intervals
+DEFAULT_ENGINE = os.getenv("FORECAST_ENGINE", "holt_winters")
+
+
+def regular(df: pd.DataFrame, freq: str = "D") -> pd.Series:
+    """
+    y indexed by a gap-free DatetimeIndex at `freq`; periods without tests
+    are interpolated so seasonal lags stay aligned with the calendar.
+    """
+    s = df.assign(ds=pd.to_datetime(df["ds"])).groupby("ds")["y"].mean().astype(float)
+    return s.asfreq(freq).interpolate().bfill()
+
+
+class Engine:
+    name = ""
+    freq = "D"
+    period = SEASON  # season length in steps of `freq`
+
+    def __init__(self, freq: str = "D", period: int = SEASON):
+        self.freq = freq
+        self.period = period
+
+    def fit(self, df: pd.DataFrame) -> "Engine":
+        s = regular(df, self.freq)
+        if s.empty:
+            raise ValueError("No data to fit")
+        self.index = s.index
+        y = s.to_numpy()
+        self.fitted = self._fit(y)
+        m = self.period
+        resid = (y - self.fitted)[m if len(y) > 2 * m else 1:]
+        self.sigma = float(resid.std()) if len(resid) > 1 else 0.0
+        return self
+
+    def _fit(self, y: np.ndarray) -> np.ndarray:
+        """Fits the engine and returns the in-sample one-step-ahead values."""
+        raise NotImplementedError
+
+    def _forecast(self, h: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(yhat, standard error) for steps `h` (1-based) after the history."""
+        raise NotImplementedError
+
+    def predict(self, periods: int, include_history: bool = True) -> pd.DataFrame:
+        yhat, se = self._forecast(np.arange(1, periods + 1))
+        ds = pd.date_range(self.index[-1], periods=periods + 1, freq=self.freq)[1:]
+        out = pd.DataFrame({"ds": ds, "yhat": yhat, "yhat_lower": yhat - Z * se, "yhat_upper": yhat + Z * se})
+        if include_history:
+            hist = pd.DataFrame({
+                "ds": self.index, "yhat": self.fitted,
+                "yhat_lower": self.fitted - Z * self.sigma, "yhat_upper": self.fitted + Z * self.sigma,
+            })
+            out = pd.concat([hist, out], ignore_index=True)
+        return out
+
+
+class EWMA(Engine):
+    name = "ewma"
+    ALPHAS = np.linspace(0.05, 0.95, 19)
+
+    def _fit(self, y):
+        # One pass over time, vectorised over the candidate alphas
+        a = self.ALPHAS
+        level = np.full(len(a), y[0])
+        fitted = np.empty((len(a), len(y)))
+        for t, v in enumerate(y):
+            fitted[:, t] = level
+            level = a * v + (1 - a) * level
+        best = int(np.argmin(((fitted - y) ** 2).sum(axis=1)))
+        self.alpha, self.level = float(a[best]), float(level[best])
+        return fitted[best]
+
+    def _forecast(self, h):
+        return np.full(len(h), self.level), self.sigma * np.sqrt(1 + (h - 1) * self.alpha ** 2)
+
+
+class HoltWinters(Engine):
+    name = "holt_winters"
+    PHI = 0.98  # trend damping
+    GRID = np.array([(a, b, g)
+                     for a in (0.05, 0.1, 0.2, 0.3, 0.5)
+                     for b in (0.01, 0.05, 0.1)
+                     for g in (0.05, 0.1, 0.3)])
+
+    def _fit(self, y):
+        m, n, phi = self.period, len(y), self.PHI
+        alpha, beta, gamma = self.GRID.T
+        if n >= 2 * m:
+            level0 = y[:m].mean()
+            trend0 = (y[m:2 * m].mean() - level0) / m
+            season0 = y[:m] - level0
+        else:
+            # Not enough history for a season: plain damped trend
+            level0, trend0, season0 = y[0], 0.0, np.zeros(m)
+            gamma = np.zeros_like(gamma)
+        k = len(alpha)
+        level, trend = np.full(k, level0), np.full(k, trend0)
+        season = np.tile(season0, (k, 1))
+        fitted = np.empty((k, n))
+        for t, v in enumerate(y):
+            i = t % m
+            fitted[:, t] = level + phi * trend + season[:, i]
+            new_level = alpha * (v - season[:, i]) + (1 - alpha) * (level + phi * trend)
+            trend = beta * (new_level - level) + (1 - beta) * phi * trend
+            season[:, i] = gamma * (v - new_level) + (1 - gamma) * season[:, i]
+            level = new_level
+        warmup = min(m, n - 1)
+        best = int(np.argmin(((fitted[:, warmup:] - y[warmup:]) ** 2).sum(axis=1)))
+        self.alpha = float(alpha[best])
+        self.level, self.trend, self.season = float(level[best]), float(trend[best]), season[best].copy()
+        self.n = n
+        return fitted[best]
+
+    def _forecast(self, h):
+        damped = np.cumsum(self.PHI ** h)  # phi + phi^2 + ... + phi^h
+        yhat = self.level + damped * self.trend + self.season[(self.n + h - 1) % self.period]
+        # Approximate: the SES variance formula, ignoring trend/season updates
+        return yhat, self.sigma * np.sqrt(1 + (h - 1) * self.alpha ** 2)
+
+
+class SeasonalNaive(Engine):
+    name = "seasonal_naive"
+
+    def _fit(self, y):
+        self.m = self.period if len(y) > self.period else 1
+        self.tail = y[-self.m:].copy()
+        fitted = y.copy()  # no prediction for the first season; use the actuals
+        fitted[self.m:] = y[:-self.m]
+        return fitted
+
+    def _forecast(self, h):
+        return self.tail[(h - 1) % self.m], self.sigma * np.sqrt(np.ceil(h / self.m))
+
+
+class ProphetEngine(Engine):
+    name = "prophet"
+
+    def fit(self, df):
+        from forecasting import train_prophet
+        self.model = train_prophet(df)
+        return self
+
+    def predict(self, periods, include_history=True):
+        future = self.model.make_future_dataframe(periods=periods, freq=self.freq,
+                                                  include_history=include_history)
+        return self.model.predict(future)[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+
+
+ENGINES: Dict[str, Type[Engine]] = {e.name: e for e in (EWMA, HoltWinters, SeasonalNaive, ProphetEngine)}
+# Registry name of each engine's defect-rate model
+MODEL_NAMES: Dict[str, str] = {name: f"{name}_defect_rate" for name in ENGINES}
+
+
+def get(name: str) -> Type[Engine]:
+    if name not in ENGINES:
+        raise ValueError(f"Unknown engine '{name}', expected one of {sorted(ENGINES)}")
+    return ENGINES[name]
+
+
+def backtest_cutoffs(df: pd.DataFrame, horizon: int, initial: int, period: int = 1) -> List[pd.Timestamp]:
+    """
+    Rolling-origin cutoffs, latest first as in prophet.diagnostics: each one
+    leaves `horizon` days after it and at least `initial` days before it.
+    """
+    ds = pd.to_datetime(df["ds"])
+    first = ds.min() + pd.Timedelta(days=initial)
+    cutoff = ds.max() - pd.Timedelta(days=horizon)
+    out = []
+    while cutoff >= first:
+        out.append(cutoff)
+        cutoff -= pd.Timedelta(days=period)
+    return out
+
+
+def compare(df: pd.DataFrame, horizon: int = 8, names: Optional[List[str]] = None) -> List[dict]:
+    """
+    Rolling-origin back-test of each engine on the same cutoffs. Reports
+    MAPE (over days with a non-zero actual), RMSE and MAE next to the mean
+    fit and predict times.
+    """
+    df = df.assign(ds=pd.to_datetime(df["ds"]))
+    cutoffs = backtest_cutoffs(df, horizon, initial=horizon * 2)
+    if not cutoffs:
+        raise ValueError("Not enough data for back-test")
+    out = []
+    for name in names or [n for n in ENGINES if n != "prophet"]:
+        engine = get(name)
+        errors, actuals, fit_s, predict_s = [], [], [], []
+        for cutoff in cutoffs:
+            history = df[df["ds"] <= cutoff]
+            actual = df[(df["ds"] > cutoff) & (df["ds"] <= cutoff + pd.Timedelta(days=horizon))]
+            t0 = time.perf_counter()
+            model = engine().fit(history)
+            t1 = time.perf_counter()
+            pred = model.predict(horizon, include_history=False)
+            t2 = time.perf_counter()
+            fit_s.append(t1 - t0)
+            predict_s.append(t2 - t1)
+            merged = actual.merge(pred, on="ds")
+            errors.append((merged["y"] - merged["yhat"]).to_numpy())
+            actuals.append(merged["y"].to_numpy())
+        err, act = np.concatenate(errors), np.concatenate(actuals)
+        nz = act != 0
+        out.append({
+            "engine": name,
+            "cutoffs": len(cutoffs),
+            "mape": float(np.mean(np.abs(err[nz] / act[nz]))) if nz.any() else None,
+            "rmse": float(np.sqrt(np.mean(err ** 2))),
+            "mae": float(np.mean(np.abs(err))),
+            "fit_ms": round(1000 * float(np.mean(fit_s)), 3),
+            "predict_ms": round(1000 * float(np.mean(predict_s)), 3),
+        })
+    return out
@@ -0,0 +1,95 @@
+"""
+One-hot encoding of categorical fields into SciPy CSR matrices with a fixed,
+persisted vocabulary.
+
+    enc = CategoricalEncoder(["ref_asteel", "family_name"]).fit(df)
+    X = enc.transform(df)              # or a list of dicts
+    artifact = {"model": model, "encoder": enc.to_dict()}
+    enc = CategoricalEncoder.from_dict(artifact["encoder"])
+
+Columns are laid out field by field, each field's categories in vocabulary
+order, so training and serving always agree on the column order. Values not
+in the vocabulary (and None) leave their field's columns empty. Only one
+non-zero per field and row is stored, so memory grows with rows x fields
+rather than rows x categories.
+"""
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+import lazy
+
+sparse = lazy.module("scipy.sparse")
+
+
+def _values(data, field: str) -> List[str]:
+    """`field` of a DataFrame or of a sequence of dicts, as strings."""
+    raw = data[field].tolist() if hasattr(data, "columns") else [r.get(field) for r in data]
+    return ["" if v is None else str(v) for v in raw]
+
+
+class CategoricalEncoder:
+    def __init__(self, fields: Sequence[str], vocabulary: Dict[str, List[str]] = None):
+        self.fields = list(fields)
+        self.vocabulary = {f: list((vocabulary or {}).get(f, [])) for f in self.fields}
+        self._index()
+
+    def _index(self) -> None:
+        self._codes = {f: {v: i for i, v in enumerate(self.vocabulary[f])} for f in self.fields}
+        self._offsets = np.cumsum([0] + [len(self.vocabulary[f]) for f in self.fields])
+
+    @property
+    def n_features(self) -> int:
+        return int(self._offsets[-1])
+
+    def fit(self, data) -> "CategoricalEncoder":
+        """Learns the sorted distinct values of each field."""
+        self.vocabulary = {f: sorted(set(_values(data, f))) for f in self.fields}
+        self._index()
+        return self
+
+    def transform(self, data):
+        """CSR matrix (n rows, n_features) of float32 ones."""
+        rows, cols = [], []
+        n = None
+        for field, offset in zip(self.fields, self._offsets):
+            codes = self._codes[field]
+            idx = np.fromiter((codes.get(v, -1) for v in _values(data, field)), dtype=np.int64)
+            n = len(idx)
+            hit = np.flatnonzero(idx >= 0)
+            rows.append(hit)
+            cols.append(idx[hit] + offset)
+        rows, cols = np.concatenate(rows), np.concatenate(cols)
+        return sparse.csr_matrix((np.ones(len(rows), dtype=np.float32), (rows, cols)),
+                                 shape=(n or 0, self.n_features))
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+
+    def feature_names(self) -> List[str]:
+        """`<field>_<value>` per column, as pd.get_dummies names them."""
+        return [f"{f}_{v}" for f in self.fields for v in self.vocabulary[f]]
+
+    def to_dict(self) -> dict:
+        return {"fields": self.fields, "vocabulary": self.vocabulary}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "CategoricalEncoder":
+        return cls(d["fields"], d["vocabulary"])
+
+    @classmethod
+    def from_columns(cls, columns: Sequence[str], fields: Sequence[str]) -> "CategoricalEncoder":
+        """
+        Encoder reproducing a pd.get_dummies column list (fields contiguous,
+        in `fields` order); raises ValueError when the columns do not fit.
+        """
+        vocabulary = {f: [] for f in fields}
+        for col in columns:
+            field = next((f for f in fields if str(col).startswith(f + "_")), None)
+            if field is None:
+                raise ValueError(f"Column '{col}' matches none of {list(fields)}")
+            vocabulary[field].append(str(col)[len(field) + 1:])
+        enc = cls(fields, vocabulary)
+        if enc.feature_names() != [str(c) for c in columns]:
+            raise ValueError("Columns are not grouped by field in the given order")
+        return enc
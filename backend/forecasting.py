@@ -0,0 +1,87 @@
+"""
+Prophet helpers shared by ForecastService and the back-test workers.
+
+Kept free of database and FastAPI imports so process-pool workers can
+import it cheaply; Prophet itself is imported on first use.
+"""
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING, List, Tuple
+
+import engines
+import lazy
+
+if TYPE_CHECKING:
+    from prophet import Prophet
+
+pd = lazy.module("pandas")
+
+
+def train_prophet(df: pd.DataFrame) -> Prophet:
+    from prophet import Prophet
+    m = Prophet(daily_seasonality=True, weekly_seasonality=True, yearly_seasonality=False)
+    m.fit(df)
+    return m
+
+
+def backtest_one(df: pd.DataFrame, cutoff: pd.Timestamp, horizon: int) -> pd.DataFrame:
+    """
+    Fits on history up to `cutoff` and predicts the following `horizon` days.
+    Returns rows shaped like prophet.diagnostics.cross_validation output.
+    """
+    df = df.assign(ds=pd.to_datetime(df["ds"]))
+    history = df[df["ds"] <= cutoff]
+    actual = df[(df["ds"] > cutoff) & (df["ds"] <= cutoff + pd.Timedelta(days=horizon))]
+    model = train_prophet(history)
+    pred = model.predict(actual[["ds"]])[["ds", "yhat", "yhat_lower", "yhat_upper"]]
+    pred["y"] = actual["y"].to_numpy()
+    pred["cutoff"] = cutoff
+    return pred
+
+
+def backtest_performance(df_cv: pd.DataFrame) -> pd.DataFrame:
+    from prophet.diagnostics import performance_metrics
+    return performance_metrics(df_cv)
+
+
+def forecast_series(batch: List[tuple], periods: int,
+                    engine: str = "prophet") -> Tuple[List[pd.DataFrame], List[tuple]]:
+    """
+    Fits one `engine` model per (dimension, key, history) in `batch` and
+    returns (the next `periods` days of each, tagged with dimension and
+    series_key; (dimension, key, error) of the series that failed). Series
+    are batched per task to keep pickling overhead low; one failing series
+    does not lose the others.
+    """
+    out, failed = [], []
+    for dimension, key, history in batch:
+        try:
+            pred = engines.get(engine)().fit(history).predict(periods, include_history=False)
+        except Exception as e:
+            failed.append((dimension, key, f"{type(e).__name__}: {e}"))
+            continue
+        pred.insert(0, "series_key", key)
+        pred.insert(0, "dimension", dimension)
+        out.append(pred)
+    return out, failed
+
+
+def train_and_score(df: pd.DataFrame, engine: str = "prophet", holdout: int = 7) -> Tuple[engines.Engine, dict]:
+    """
+    Retrain-scheduler entry point: scores `engine` on the last `holdout`
+    days, then fits it on the full history. Returns (model, metrics).
+    """
+    cls = engines.get(engine)
+    df = df.assign(ds=pd.to_datetime(df["ds"]))
+    metrics = {"engine": engine}
+    if len(df) > holdout * 3:
+        cutoff = df["ds"].max() - pd.Timedelta(days=holdout)
+        pred = cls().fit(df[df["ds"] <= cutoff]).predict(holdout, include_history=False)
+        merged = df[df["ds"] > cutoff].merge(pred, on="ds")
+        err = merged["y"] - merged["yhat"]
+        metrics.update(holdout_days=holdout, rmse=float((err ** 2).mean() ** 0.5), mae=float(err.abs().mean()))
+    t0 = time.perf_counter()
+    model = cls().fit(df)
+    metrics["train_seconds"] = round(time.perf_counter() - t0, 3)
+    return model, metrics
@@ -0,0 +1,358 @@
+"""
+In-memory columnar copy of the last HOT_WINDOW_DAYS days of abb_dbo_test.
+
+A background thread polls for rows with Id above the last one seen and
+appends them to NumPy columns: timestamps as int64 epoch seconds, Result as
+int8 (-1 for NULL), Id_Board / Id_Machine / TypeTest / Num_Serie as int32
+dictionary codes. Recent-window queries are then answered with vectorised
+masks and bincounts instead of MySQL round trips.
+
+Readers work on an immutable snapshot, so a refresh never blocks them. Rows
+updated in place after being loaded are not seen until the next restart.
+Set HOT_WINDOW_DAYS=0 to disable.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Mapping, Optional
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+HOT_WINDOW_DAYS = float(os.getenv("HOT_WINDOW_DAYS", "2"))
+POLL_INTERVAL = float(os.getenv("HOT_WINDOW_POLL", "5"))
+BATCH_SIZE = 50000
+BOARD_REFRESH = 60.0
+# Snapshots older than this are not trusted (the poller is stuck or down).
+MAX_LAG = POLL_INTERVAL * 3 + 5
+
+# name -> (numpy dtype, fill for NULL)
+COLUMNS = {
+    "id":       (np.int64, 0),
+    "ts":       (np.int64, 0),
+    "result":   (np.int8, -1),
+    "board":    (np.int32, 0),
+    "machine":  (np.int32, 0),
+    "type_test": (np.int32, 0),
+    "serial":   (np.int32, 0),
+    "operator": (np.float64, np.nan),
+}
+
+# metric_column accepted by TestService.unique_by_metric -> column here
+METRIC_COLUMNS = {
+    "TypeTest": "type_test", "Id_Machine": "machine", "Id_Board": "board",
+    "Num_Serie": "serial", "Result": "result", "Id_Operateur": "operator",
+}
+
+
+# TrendService group_by -> column here (None: a single series)
+GROUP_COLUMNS = {None: None, "ref": "board", "machine": "machine", "type_test": "type_test"}
+
+
+def to_epoch(value) -> int:
+    """'YYYY-MM-DD[ HH:MM:SS]' string or datetime -> epoch seconds."""
+    if isinstance(value, str):
+        value = value.strip().replace(" ", "T")
+    return int(np.datetime64(value, "s").astype(np.int64))
+
+
+class Dictionary:
+    """
+    Append-only value <-> int32 code mapping. Code 0 is reserved for NULL.
+    """
+    def __init__(self):
+        self.values: list = [None]
+        self.codes: Dict[object, int] = {}
+
+    def code(self, value) -> int:
+        if value is None:
+            return 0
+        c = self.codes.get(value)
+        if c is None:
+            c = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return c
+
+    def lookup(self, value) -> Optional[int]:
+        return self.codes.get(value)
+
+
+class Snapshot:
+    """
+    Immutable view of the first `n` rows of the columns at publish time.
+    """
+    def __init__(self, cols: Dict[str, np.ndarray], n: int, horizon: int,
+                 dicts: Dict[str, Dictionary], boards: Dict[int, tuple], last_id: int = 0):
+        self.cols = {k: v[:n] for k, v in cols.items()}
+        self.n = n
+        # Every abb_dbo_test row up to this Id (and inside the horizon) is in the snapshot
+        self.last_id = last_id
+        self.horizon = horizon
+        self.dicts = dicts
+        self.sizes = {k: len(d.values) for k, d in dicts.items()}
+        self.boards = boards
+        self.published = time.monotonic()
+        self._serial_order = None
+        self._serial_rank = None
+
+    def serial_rank(self):
+        """
+        (rank, order): lexicographic rank of every serial code, NULL ranking
+        -1, and its inverse (order[rank] is the code).
+        """
+        if self._serial_rank is None:
+            values = self.dicts["serial"].values[:self.sizes["serial"]]
+            keys = np.array([""] + [str(v) for v in values[1:]], dtype=object)
+            order = np.argsort(keys, kind="stable")
+            rank = np.empty(len(keys), dtype=np.int64)
+            rank[order] = np.arange(len(keys))
+            rank[0] = -1
+            self._serial_order, self._serial_rank = order, rank
+        return self._serial_rank, self._serial_order
+
+    def mask(self, start, end) -> np.ndarray:
+        ts = self.cols["ts"]
+        return (ts >= to_epoch(start)) & (ts <= to_epoch(end))
+
+
+class HotWindow:
+    def __init__(self, days: float = HOT_WINDOW_DAYS, poll: float = POLL_INTERVAL):
+        self.days = days
+        self.poll = poll
+        self.dicts = {"board": Dictionary(), "machine": Dictionary(),
+                      "type_test": Dictionary(), "serial": Dictionary()}
+        self._cols = {k: np.empty(0, dtype=dt) for k, (dt, _) in COLUMNS.items()}
+        self._n = 0
+        self._last_id = 0
+        self._boards: Dict[int, tuple] = {}
+        self._boards_at = 0.0
+        self._snapshot: Optional[Snapshot] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.days > 0
+
+    # --- maintenance ---------------------------------------------------------
+    def _horizon(self) -> int:
+        # DateDebut_ts is naive local time, so "now" must be too
+        return to_epoch(datetime.now()) - int(self.days * 86400)
+
+    def _append(self, rows: List[tuple], horizon: int) -> None:
+        keep = [r for r in rows if r[1] is not None]
+        if not keep:
+            return
+        new = {
+            "id":       np.fromiter((r[0] for r in keep), np.int64, len(keep)),
+            "ts":       np.array([r[1] for r in keep], dtype="datetime64[s]").astype(np.int64),
+            "result":   np.fromiter((-1 if r[2] is None else r[2] for r in keep), np.int8, len(keep)),
+            "board":    np.fromiter((self.dicts["board"].code(r[3]) for r in keep), np.int32, len(keep)),
+            "machine":  np.fromiter((self.dicts["machine"].code(r[4]) for r in keep), np.int32, len(keep)),
+            "type_test": np.fromiter((self.dicts["type_test"].code(r[5]) for r in keep), np.int32, len(keep)),
+            "serial":   np.fromiter((self.dicts["serial"].code(r[6]) for r in keep), np.int32, len(keep)),
+            "operator": np.fromiter((np.nan if r[7] is None else r[7] for r in keep), np.float64, len(keep)),
+        }
+        fresh = new["ts"] >= horizon
+        if not fresh.any():
+            return
+        m = int(fresh.sum())
+        need = self._n + m
+        if need > len(self._cols["id"]):
+            # Grow geometrically into new arrays; published snapshots keep
+            # pointing at the old ones.
+            cap = max(need, 2 * len(self._cols["id"]), 1024)
+            grown = {}
+            for k, (dt, fill) in COLUMNS.items():
+                arr = np.full(cap, fill, dtype=dt)
+                arr[:self._n] = self._cols[k][:self._n]
+                grown[k] = arr
+            self._cols = grown
+        for k in COLUMNS:
+            self._cols[k][self._n:need] = new[k][fresh]
+        self._n = need
+
+    def _compact(self, horizon: int) -> None:
+        ts = self._cols["ts"][:self._n]
+        keep = ts >= horizon
+        if keep.all():
+            return
+        self._cols = {k: v[:self._n][keep].copy() for k, v in self._cols.items()}
+        self._n = len(self._cols["id"])
+
+    def _load_boards(self, conn) -> None:
+        rows = conn.execute(text("SELECT Id, REF_AsteelFlash, prix FROM abb_dbo_board")).fetchall()
+        self._boards = {int(r[0]): (r[1], r[2]) for r in rows}
+        self._boards_at = time.monotonic()
+
+    def refresh(self, engine: Engine) -> int:
+        """
+        Pulls new rows and publishes a new snapshot. Returns rows fetched.
+        """
+        horizon = self._horizon()
+        fetched = 0
+        with engine.connect() as conn:
+            if self._snapshot is None:
+                since = datetime.now() - timedelta(days=self.days)
+                self._last_id = int(conn.execute(text(
+                    "SELECT COALESCE(MIN(Id), 1) - 1 FROM abb_dbo_test WHERE DateDebut_ts >= :since"
+                ), {"since": since}).scalar() or 0)
+            if time.monotonic() - self._boards_at > BOARD_REFRESH:
+                self._load_boards(conn)
+            while True:
+                rows = conn.execute(text("""
+                    SELECT Id, DateDebut_ts, Result, Id_Board, Id_Machine, TypeTest, Num_Serie, Id_Operateur
+                    FROM abb_dbo_test WHERE Id > :last ORDER BY Id LIMIT :n
+                """), {"last": self._last_id, "n": BATCH_SIZE}).fetchall()
+                if not rows:
+                    break
+                self._append(rows, horizon)
+                self._last_id = int(rows[-1][0])
+                fetched += len(rows)
+                if len(rows) < BATCH_SIZE:
+                    break
+        self._compact(horizon)
+        self._snapshot = Snapshot(self._cols, self._n, horizon, self.dicts, self._boards, self._last_id)
+        return fetched
+
+    def _run(self, engine: Engine) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh(engine)
+            except Exception:
+                log.exception("hot window refresh failed")
+            self._stop.wait(self.poll)
+
+    def start(self, engine: Engine) -> None:
+        if not self.enabled or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, args=(engine,), name="hot-window", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    # --- queries -------------------------------------------------------------
+    def snapshot_for(self, start, end) -> Optional[Snapshot]:
+        """
+        The current snapshot if it is fresh and covers [start, end], else None.
+        """
+        snap = self._snapshot
+        if snap is None or time.monotonic() - snap.published > MAX_LAG:
+            return None
+        try:
+            if to_epoch(start) < snap.horizon or to_epoch(end) < to_epoch(start):
+                return None
+        except ValueError:
+            return None
+        return snap
+
+    def quality_groups(self, start: str, end: str) -> Optional[List[Mapping]]:
+        """
+        Per-board groups in the shape QualityAggregate.fold expects.
+        """
+        snap = self.snapshot_for(start, end)
+        if snap is None:
+            return None
+        m = snap.mask(start, end)
+        board = snap.cols["board"][m]
+        good_mask = snap.cols["result"][m] == 1
+        size = snap.sizes["board"]
+        totals = np.bincount(board, minlength=size)
+        goods = np.bincount(board, weights=good_mask, minlength=size).astype(np.int64)
+        rank, order = snap.serial_rank()
+        best = np.full(size, -1, dtype=np.int64)
+        np.maximum.at(best, board, rank[snap.cols["serial"][m]])
+
+        groups = []
+        values = snap.dicts["board"].values
+        serials = snap.dicts["serial"].values
+        for code in np.nonzero(totals)[0]:
+            board_id = values[code]
+            info = snap.boards.get(board_id) if board_id is not None else None
+            serial = serials[order[best[code]]] if best[code] >= 0 else None
+            groups.append({
+                "ref_asteel": info[0] if info else None,
+                "unit_price": info[1] if info else None,
+                "matched": info is not None,
+                "good": int(goods[code]),
+                "bad": int(totals[code] - goods[code]),
+                "num_serie": serial,
+            })
+        return groups
+
+    def hourly_counts(self, start: str, end: str, group_by: Optional[str] = None) -> Optional[List[tuple]]:
+        """
+        (hour, key, total, good, fails) rows for [start, end] in the shape of
+        RollupReader.hourly_counts (group_by None, "ref", "machine" or
+        "type_test"), or None when the window is not covered.
+        """
+        snap = self.snapshot_for(start, end)
+        if snap is None or group_by not in GROUP_COLUMNS:
+            return None
+        m = snap.mask(start, end)
+        hours = snap.cols["ts"][m] // 3600
+        if not len(hours):
+            return []
+        column = GROUP_COLUMNS[group_by]
+        if column is None:
+            codes, keys = np.zeros(len(hours), dtype=np.int64), [None]
+        else:
+            codes = snap.cols[column][m].astype(np.int64)
+            keys = snap.dicts[column].values[:snap.sizes[column]]
+            if group_by == "ref":
+                keys = [snap.boards.get(v, (None,))[0] if v is not None else None for v in keys]
+            # As strings, like the rollup's VARCHAR dimensions
+            keys = [None if k is None else str(k) for k in keys]
+        # One bincount over (hour, key) cells; boards sharing a REF are summed by the caller
+        first, width = int(hours.min()), len(keys)
+        cells = (hours - first) * width + codes
+        totals = np.bincount(cells)
+        result = snap.cols["result"][m]
+        goods = np.bincount(cells, weights=result == 1, minlength=len(totals)).astype(np.int64)
+        fails = np.bincount(cells, weights=result == 0, minlength=len(totals)).astype(np.int64)
+        nonzero = np.nonzero(totals)[0]
+        stamps = ((first + nonzero // width) * 3600).astype("datetime64[s]")
+        return [(stamp, keys[code], int(t), int(g), int(f))
+                for stamp, code, t, g, f in zip(stamps, nonzero % width, totals[nonzero], goods[nonzero],
+                                                fails[nonzero])]
+
+    def unique_ids(self, metric_column: str, metric_value: str, start: str, end: str) -> Optional[List[int]]:
+        """
+        Ids of the latest test per Num_Serie matching `metric_column = metric_value`
+        in [start, end], or None when the window is not covered.
+        """
+        snap = self.snapshot_for(start, end)
+        col = METRIC_COLUMNS.get(metric_column)
+        if snap is None or col is None:
+            return None
+        m = snap.mask(start, end)
+        if col in self.dicts:
+            value = int(metric_value) if col == "board" and metric_value.lstrip("-").isdigit() else metric_value
+            code = snap.dicts[col].lookup(value)
+            if code is None or code >= snap.sizes[col]:
+                return []
+            m &= snap.cols[col] == code
+        else:
+            try:
+                m &= snap.cols[col] == float(metric_value)
+            except ValueError:
+                return None
+        idx = np.nonzero(m)[0]
+        if not len(idx):
+            return []
+        serial = snap.cols["serial"][idx]
+        # Latest (ts, Id) per serial: sort by serial then ts/Id, keep the last of each run.
+        order = np.lexsort((snap.cols["id"][idx], snap.cols["ts"][idx], serial))
+        serial_sorted = serial[order]
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = serial_sorted[1:] != serial_sorted[:-1]
+        return snap.cols["id"][idx][order][last].tolist()
+
+
+hot_window = HotWindow()
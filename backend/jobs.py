@@ -0,0 +1,255 @@
+"""
+Background jobs for long-running forecasting work.
+
+A coordinator thread per job, in the process that started it, submits the
+CPU-bound pieces to a shared ProcessPoolExecutor (spawn context,
+BACKTEST_WORKERS processes) and tracks progress, so the request that starts
+a job returns immediately. Status, progress and the JSON result are written
+to the background_jobs table, so any API worker can answer a poll for any
+job; finished jobs are deleted after JOB_KEEP_DAYS.
+"""
+from __future__ import annotations
+
+import importlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import engines
+import forecasting
+import lazy
+
+log = logging.getLogger(__name__)
+
+pd = lazy.module("pandas")
+
+MAX_WORKERS = int(os.getenv("BACKTEST_WORKERS", str(os.cpu_count() or 2)))
+MAX_JOBS = 100
+KEEP_DAYS = float(os.getenv("JOB_KEEP_DAYS", "7"))
+PROGRESS_INTERVAL = 1.0
+TABLE = "background_jobs"
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+      id        CHAR(32)    PRIMARY KEY,
+      kind      VARCHAR(50) NOT NULL,
+      params    TEXT        NOT NULL,
+      status    VARCHAR(10) NOT NULL,
+      done      INT         NOT NULL,
+      total     INT         NOT NULL,
+      created   DATETIME    NOT NULL,
+      started   DATETIME    NULL,
+      finished  DATETIME    NULL,
+      result    LONGTEXT    NULL,
+      error     TEXT        NULL,
+      INDEX idx_background_jobs_finished (finished)
+    )
+"""
+
+SAVE_SQL = f"""
+    INSERT INTO {TABLE} (id, kind, params, status, done, total, created, started, finished, result, error)
+    VALUES (:id, :kind, :params, :status, :done, :total, :created, :started, :finished, :result, :error)
+    ON DUPLICATE KEY UPDATE status = VALUES(status), done = VALUES(done), total = VALUES(total),
+      started = VALUES(started), finished = VALUES(finished), result = VALUES(result), error = VALUES(error)
+"""
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def shutdown() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def call(target: str, *args, **kwargs) -> Any:
+    """
+    Runs "module:function" with the given arguments. Submitted to the pool,
+    the module is imported in the worker only.
+    """
+    module, name = target.split(":")
+    return getattr(importlib.import_module(module), name)(*args, **kwargs)
+
+
+def _json_default(value: Any) -> Any:
+    return value.isoformat() if hasattr(value, "isoformat") else str(value)
+
+
+class Job:
+    def __init__(self, kind: str, params: dict, job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = "pending"
+        self.done = 0
+        self.total = 0
+        self.created = datetime.now()
+        self.started: Optional[datetime] = None
+        self.finished: Optional[datetime] = None
+        self.result: Any = None
+        self.error: Optional[str] = None
+        # Set by the store that runs the job: persists it (progress, end)
+        self.on_change: Optional[Callable[["Job"], None]] = None
+        self._saved = 0.0
+        self._finished = threading.Event()
+
+    def step(self, n: int = 1) -> None:
+        """Marks `n` more pieces done; saved at most every PROGRESS_INTERVAL seconds."""
+        self.done += n
+        if self.on_change is not None and time.monotonic() - self._saved >= PROGRESS_INTERVAL:
+            self._saved = time.monotonic()
+            self.on_change(self)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Blocks until the job finishes (only for jobs running in this process)."""
+        return self._finished.wait(timeout)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id, "kind": self.kind, "params": self.params, "status": self.status,
+            "progress": {"done": self.done, "total": self.total},
+            "created": self.created, "started": self.started, "finished": self.finished,
+            "error": self.error,
+        }
+
+    def row(self) -> dict:
+        return {"id": self.id, "kind": self.kind, "params": json.dumps(self.params, default=_json_default),
+                "status": self.status, "done": self.done, "total": self.total, "created": self.created,
+                "started": self.started, "finished": self.finished, "error": self.error,
+                "result": None if self.result is None else json.dumps(self.result, default=_json_default)}
+
+    @classmethod
+    def from_row(cls, r) -> "Job":
+        job = cls(r["kind"], json.loads(r["params"]), r["id"])
+        job.status, job.done, job.total = r["status"], int(r["done"]), int(r["total"])
+        job.created, job.started, job.finished, job.error = r["created"], r["started"], r["finished"], r["error"]
+        job.result = None if r["result"] is None else json.loads(r["result"])
+        return job
+
+
+class JobStore:
+    """
+    Jobs started by this process (kept in memory, at most `max_jobs`) backed
+    by the background_jobs table, which has every worker's.
+    """
+
+    def __init__(self, max_jobs: int = MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._created = set()
+        self._lock = threading.Lock()
+
+    def _init(self, bind: Engine) -> None:
+        key = str(bind.url)
+        if key not in self._created:
+            with bind.begin() as conn:
+                conn.execute(text(DDL))
+            self._created.add(key)
+
+    def _save(self, bind: Engine, job: Job) -> None:
+        with bind.begin() as conn:
+            conn.execute(text(SAVE_SQL), job.row())
+            if job.finished:
+                conn.execute(text(f"DELETE FROM {TABLE} WHERE finished < :before"),
+                             {"before": datetime.now() - timedelta(days=KEEP_DAYS)})
+
+    def add(self, job: Job) -> Job:
+        with self._lock:
+            self._jobs[job.id] = job
+            # Forget the oldest finished jobs beyond the limit
+            for old in [j for j in self._jobs.values() if j.finished][:max(0, len(self._jobs) - self.max_jobs)]:
+                del self._jobs[old.id]
+        return job
+
+    def get(self, bind: Engine, job_id: str) -> Optional[Job]:
+        """The job, from memory when this process runs it, else from the table."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        self._init(bind)
+        with bind.connect() as conn:
+            row = conn.execute(text(f"SELECT * FROM {TABLE} WHERE id = :id"), {"id": job_id}).mappings().first()
+        return None if row is None else Job.from_row(row)
+
+    def submit(self, bind: Engine, kind: str, params: dict, run: Callable[[Job], Any]) -> Job:
+        """
+        Registers a job and runs `run(job)` on a coordinator thread; its
+        return value, which must be JSON-serialisable, becomes job.result.
+        """
+        self._init(bind)
+        job = self.add(Job(kind, params))
+        self._save(bind, job)
+
+        def save(j: Job) -> None:
+            try:
+                self._save(bind, j)
+            except Exception:
+                log.exception("could not save job %s", j.id)
+
+        job.on_change = save
+
+        def coordinator():
+            job.status, job.started = "running", datetime.now()
+            save(job)
+            try:
+                job.result = run(job)
+                job.status = "done"
+            except Exception as e:
+                job.status, job.error = "failed", f"{type(e).__name__}: {e}"
+            finally:
+                job.finished = datetime.now()
+                save(job)
+                job._finished.set()
+
+        threading.Thread(target=coordinator, name=f"job-{job.id[:8]}", daemon=True).start()
+        return job
+
+
+store = JobStore()
+
+
+def run_backtest(df: pd.DataFrame, horizon: int, job: Optional[Job] = None):
+    """
+    Rolling-origin back-test with one Prophet fit per cutoff, fanned out over
+    the process pool. Returns (df_cv, df_perf), or (None, None) when the
+    history is shorter than 3 x horizon.
+    """
+    initial = horizon * 2
+    if len(df) < initial + horizon:
+        return None, None
+    cutoffs = engines.backtest_cutoffs(df, horizon, initial)
+    if job is not None:
+        job.total = len(cutoffs)
+
+    futures = [pool().submit(forecasting.backtest_one, df, c, horizon) for c in cutoffs]
+    parts = []
+    for fut in as_completed(futures):
+        parts.append(fut.result())
+        if job is not None:
+            job.step()
+    df_cv = pd.concat(parts, ignore_index=True).sort_values(["cutoff", "ds"], ignore_index=True)
+    return df_cv, forecasting.backtest_performance(df_cv)
@@ -0,0 +1,65 @@
+"""
+Deferred imports for the data/ML stack.
+
+`pd = lazy.module("pandas")` binds a proxy that imports pandas on first
+attribute access, so API workers that only serve auth and CRUD never pay for
+pandas, joblib, Prophet or scikit-learn. Modules using a proxy in
+annotations need `from __future__ import annotations`.
+
+With WARMUP=1 the API imports the whole stack in a background thread right
+after startup, so the first forecast request does not pay for it either.
+"""
+import importlib
+import logging
+import os
+import threading
+import time
+from typing import Dict, List
+
+log = logging.getLogger(__name__)
+
+WARMUP = os.getenv("WARMUP", "0") == "1"
+# Imported by warm_up(), in this order
+HEAVY_MODULES = ["numpy", "pandas", "joblib", "sklearn.ensemble", "prophet"]
+
+
+class LazyModule:
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def warm_up(modules: List[str] = HEAVY_MODULES) -> Dict[str, float]:
+    """Imports `modules` now; returns seconds spent per module."""
+    timings = {}
+    for name in modules:
+        t0 = time.perf_counter()
+        try:
+            importlib.import_module(name)
+        except ImportError as e:
+            log.warning("warm-up could not import %s: %s", name, e)
+            continue
+        timings[name] = round(time.perf_counter() - t0, 3)
+    return timings
+
+
+def warm_up_in_background() -> threading.Thread:
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -1,5 +1,5 @@
 # main.py
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, status
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Query, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.orm import Session
@@ -16,13 +16,33 @@ from auth import (
 from schemas import (
     UserCreate, UserOut,
     BoardInfo, BoardCreate, BoardUpdate,
-    TestRecord, Token, QualityMetrics
+    TestRecord, TestPage, Token, QualityMetrics, QualityTrend,
+    TestFeatures, Prediction, BatchPredictionRequest, BatchPrediction,
+    PriceFeatures, PricePrediction, BoardPricePrediction, RiskScore, RiskySerial
 )
-from services import BoardService, TestService, MetricsService, ForecastService
-import pandas as pd
+from services import (
+    BoardService, TestService, MetricsService, TrendService, ForecastService, RiskService,
+    MAX_PAGE_SIZE, FORECAST_MODELS, MAX_HORIZON_DAYS,
+)
+from streaming import NDJSON, wants_ndjson
+from metrics_cache import quality_cache
+from hot_window import hot_window
+import singleflight
+import downsample
+import engines
+import jobs
+from model_registry import registry
+import scheduler as retrain
+import risk_scores
+import rollups
+import drift
+import lazy
+import classifier
+import pricing
+import batcher
 from io import BytesIO, StringIO
-from datetime import date, time
-from prophet import Prophet
+from datetime import date, time, datetime
+from typing import Optional, Literal
 # Create tables
 Base.metadata.create_all(bind=engine)
 
@@ -34,6 +54,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+def start_background_loaders():
+    hot_window.start(engine)
+    if rollups.ENABLED:
+        rollups.refresher.start(engine)
+    if retrain.ENABLED:
+        retrain.scheduler.start(engine)
+    classifier.preload()
+    if risk_scores.ENABLED:
+        risk_scores.risk_scorer.start(engine)
+    if drift.ENABLED:
+        drift.monitor.start(engine)
+    if lazy.WARMUP:
+        lazy.warm_up_in_background()
+
+@app.on_event("shutdown")
+def stop_background_loaders():
+    hot_window.stop()
+    rollups.refresher.stop()
+    retrain.scheduler.stop()
+    risk_scores.risk_scorer.stop()
+    drift.monitor.stop()
+    jobs.shutdown()
+
 # --- Authentication ---
 @app.post("/token", response_model=Token)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
@@ -61,6 +105,23 @@ def list_boards(db: Session = Depends(get_db), _: dict = Depends(get_current_use
 def create_board(data: BoardCreate, db: Session = Depends(get_db), __=Depends(require_admin)):
     return BoardService(db).create(data)
 
+def _board_prices(boards: list) -> list[BoardPricePrediction]:
+    predicted, version = pricing.predict_cached(boards)
+    return [BoardPricePrediction(board_id=b["id"], ref_asteel=b["ref_asteel"], family_name=b["family_name"],
+                                 prix=b["prix"], predicted_prix=p, model_version=version)
+            for b, p in zip(boards, predicted)]
+
+@app.get("/api/boards/predicted-prices", response_model=list[BoardPricePrediction])
+def predicted_prices(db: Session = Depends(get_db), _=Depends(get_current_user)):
+    return _board_prices(BoardService(db).price_features())
+
+@app.get("/api/boards/{id}/predicted-price", response_model=BoardPricePrediction)
+def predicted_price(id: int, db: Session = Depends(get_db), _=Depends(get_current_user)):
+    boards = BoardService(db).price_features(id)
+    if not boards:
+        raise HTTPException(status_code=404, detail="Board not found")
+    return _board_prices(boards)[0]
+
 @app.get("/api/boards/{id}", response_model=BoardInfo)
 def get_board(id: int, db: Session = Depends(get_db), _=Depends(get_current_user)):
     return BoardService(db).get(id)
@@ -101,12 +162,17 @@ def import_boards(file: UploadFile = File(...), db: Session = Depends(get_db), _
     return {"processed": count}
 
 # --- Tests ---
+# Test lists also stream as NDJSON when requested with `Accept: application/x-ndjson`.
 @app.get("/api/boards/{id}/tests", response_model=list[TestRecord])
-def tests_by_board(id: int, db: Session = Depends(get_db), _=Depends(get_current_user)):
-    return TestService(db).get_by_board(id)
+def tests_by_board(id: int, request: Request, db: Session = Depends(get_db), _=Depends(get_current_user)):
+    svc = TestService(db)
+    if wants_ndjson(request):
+        return StreamingResponse(svc.stream_by_board(id), media_type=NDJSON)
+    return svc.get_by_board(id)
 
 @app.get("/api/unique-tests-by-metric", response_model=list[TestRecord])
 def unique_tests(
+    request:       Request,
     metric_column: str = Query(...),
     metric_value:  str = Query(...),
     start_date:    str = Query(...),
@@ -114,43 +180,241 @@ def unique_tests(
     db:            Session = Depends(get_db),
     _=Depends(get_current_user),
 ):
-    return TestService(db).unique_by_metric(metric_column, metric_value, start_date, end_date)
+    svc = TestService(db)
+    if wants_ndjson(request):
+        return StreamingResponse(
+            svc.stream_unique_by_metric(metric_column, metric_value, start_date, end_date),
+            media_type=NDJSON,
+        )
+    return svc.unique_by_metric(metric_column, metric_value, start_date, end_date)
 
 # --- Quality Metrics ---
 @app.get("/api/quality-metrics", response_model=QualityMetrics)
 def quality_metrics(
+    request:       Request,
+    response:      Response,
+    selected_date: date = Query(...),
+    start_time:    time = Query(time(0,0,0)),
+    end_time:      time = Query(time(23,59,59)),
+    db:            Session = Depends(get_db),
+):
+    start_t, end_t = start_time.strftime("%H:%M:%S"), end_time.strftime("%H:%M:%S")
+    entry = quality_cache.get_or_compute(
+        db, selected_date, start_t, end_t,
+        lambda: MetricsService(db).quality(selected_date, start_t, end_t),
+    )
+    headers = {"ETag": entry.etag, "Cache-Control": entry.cache_control}
+    if request.headers.get("if-none-match") == entry.etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return entry.payload
+
+@app.get("/api/quality-metrics/tests", response_model=TestPage)
+def quality_metrics_tests(
+    request:       Request,
     selected_date: date = Query(...),
     start_time:    time = Query(time(0,0,0)),
     end_time:      time = Query(time(23,59,59)),
+    cursor:        Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit:         int = Query(100, ge=1, le=MAX_PAGE_SIZE),
     db:            Session = Depends(get_db),
 ):
-    return MetricsService(db).quality(selected_date, start_time.strftime("%H:%M:%S"), end_time.strftime("%H:%M:%S"))
+    start = f"{selected_date} {start_time.strftime('%H:%M:%S')}"
+    end   = f"{selected_date} {end_time.strftime('%H:%M:%S')}"
+    svc = TestService(db)
+    try:
+        if wants_ndjson(request):
+            # Whole window after `cursor`; `limit` only applies to JSON pages
+            return StreamingResponse(svc.stream_window(start, end, cursor), media_type=NDJSON)
+        return svc.page_in_window(start, end, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/quality-trend", response_model=QualityTrend)
+def quality_trend(
+    start:    datetime = Query(...),
+    end:      datetime = Query(...),
+    bucket:   Literal["hour", "shift", "day", "week"] = Query("day"),
+    group_by: Optional[Literal["ref", "machine", "type_test"]] = Query(None),
+    db:       Session = Depends(get_db),
+):
+    try:
+        return TrendService(db).trend(start, end, bucket, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/api/defect-forecast")
-def defect_forecast(periods: int = 30, db: Session = Depends(get_db)):
+def defect_forecast(
+    periods: int = Query(30, ge=1, le=MAX_HORIZON_DAYS * 24,
+                         description=f"Horizon in steps of `freq`, at most {MAX_HORIZON_DAYS} days"),
+    engine: str = Query(engines.DEFAULT_ENGINE, description=f"One of {sorted(engines.ENGINES)}"),
+    freq: Literal["day", "hour", "shift"] = "day",
+    history: Literal["full", "none", "lttb", "mean"] = Query(
+        "full", description="Past fitted values: all, none, or reduced to max_points (LTTB or bucket mean)"),
+    max_points: int = Query(500, ge=3, le=10000),
+    db: Session = Depends(get_db),
+):
     forecast_service = ForecastService(db)
-    forecast = forecast_service.forecast(periods)
-    
-    # Convert Timestamp to string for JSON serialization
-    forecast['ds'] = forecast['ds'].dt.strftime('%Y-%m-%d %H:%M:%S')
-    forecast['yhat'] = forecast['yhat'].astype(float)
-    forecast['yhat_lower'] = forecast['yhat_lower'].astype(float)
-    forecast['yhat_upper'] = forecast['yhat_upper'].astype(float)
+    try:
+        forecast = forecast_service.forecast(periods, engine, freq)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # The frame may be shared with coalesced callers, so build a new one
+    forecast = downsample.reduce_history(forecast, periods, history, max_points).assign(
+        # Convert Timestamp to string for JSON serialization
+        ds=lambda f: f['ds'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        yhat=lambda f: f['yhat'].astype(float),
+        yhat_lower=lambda f: f['yhat_lower'].astype(float),
+        yhat_upper=lambda f: f['yhat_upper'].astype(float),
+    )
     
     # Return the forecast as JSON response
     return JSONResponse(forecast.to_dict(orient="records"))
 
-@app.get("/api/defect-backtest")
+@app.get("/api/defect-forecast/engines")
+def compare_forecast_engines(
+    horizon: int = Query(8, ge=1, description="Back-test horizon in days"),
+    include_prophet: bool = Query(False, description="Also back-test Prophet (slow)"),
+    db: Session = Depends(get_db),
+    _=Depends(get_current_user),
+):
+    try:
+        return ForecastService(db).compare_engines(horizon, include_prophet)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/defect-backtest", deprecated=True)
 def defect_backtest(
+    response: Response,
     horizon: int = Query(8, description="Back-test horizon in days"),
     db: Session = Depends(get_db),
     _=Depends(get_current_user),
 ):
-    svc = ForecastService(db)
-    df_cv, df_perf = svc.backtest(horizon)
-    if df_cv is None:
-        raise HTTPException(status_code=400, detail="Not enough data for back-test")
-    return {
-        "cv": df_cv.to_dict(orient="records"),
-        "performance": df_perf.to_dict(orient="records")
-    }
\ No newline at end of file
+    """Deprecated: blocks until the back-test job is done. Use POST /api/defect-backtest/jobs."""
+    try:
+        job = ForecastService(db).start_backtest(horizon)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["Deprecation"] = "true"
+    response.headers["Link"] = f'</api/defect-backtest/jobs/{job.id}>; rel="alternate"'
+    job.wait()
+    if job.status != "done":
+        raise HTTPException(status_code=500, detail=job.error)
+    return job.result
+
+@app.post("/api/defect-backtest/jobs", status_code=status.HTTP_202_ACCEPTED)
+def start_defect_backtest(
+    horizon: int = Query(8, ge=1, description="Back-test horizon in days"),
+    db: Session = Depends(get_db),
+    _=Depends(get_current_user),
+):
+    try:
+        return ForecastService(db).start_backtest(horizon).summary()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/defect-backtest/jobs/{job_id}")
+def defect_backtest_job(job_id: str, _=Depends(get_current_user)):
+    job = jobs.store.get(engine, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    out = job.summary()
+    if job.status == "done":
+        out.update(job.result)
+    return out
+
+# --- Test-result classifier and price model ---
+def _classify(records):
+    return list(zip(*classifier.get().predict(records)))
+
+def _price(records):
+    predicted, version = pricing.predict_cached(records)
+    return [(prix, version) for prix in predicted]
+
+# Concurrent single-record requests share one model call
+classify_batcher = batcher.batcher("classifier", _classify)
+price_batcher = batcher.batcher("price", _price)
+
+@app.post("/api/predict", response_model=Prediction)
+async def predict(record: TestFeatures, _=Depends(get_current_user)):
+    prediction, probability = await classify_batcher.submit(record.model_dump())
+    return Prediction(prediction=prediction, probability=probability)
+
+@app.post("/api/predict/batch", response_model=BatchPrediction)
+def predict_batch(body: BatchPredictionRequest, _=Depends(get_current_user)):
+    if len(body.records) > classifier.MAX_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {classifier.MAX_BATCH} records per request")
+    predictions, probabilities = classifier.get().predict([r.model_dump() for r in body.records])
+    return BatchPrediction(predictions=predictions, probabilities=probabilities)
+
+@app.get("/api/risk/serials", response_model=list[RiskySerial])
+def risky_serials(
+    start_date: str = Query(...),
+    end_date: str = Query(...),
+    min_probability: float = Query(0.5, ge=0, le=1),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    _=Depends(get_current_user),
+):
+    return RiskService(db).risky_serials(start_date, end_date, min_probability, limit)
+
+@app.get("/api/risk/serials/{num_serie}", response_model=list[RiskScore])
+def serial_risk(num_serie: str, db: Session = Depends(get_db), _=Depends(get_current_user)):
+    return RiskService(db).by_serial(num_serie)
+
+@app.post("/api/predict/price", response_model=PricePrediction)
+async def predict_price(features: PriceFeatures, _=Depends(get_current_user)):
+    prix, version = await price_batcher.submit(features.model_dump())
+    return PricePrediction(prix=prix, model_version=version)
+
+# --- Admin / diagnostics ---
+@app.get("/api/admin/coalescing-stats")
+def coalescing_stats(__=Depends(require_admin)):
+    return singleflight.stats()
+
+@app.get("/api/admin/batching-stats")
+def batching_stats(__=Depends(require_admin)):
+    return batcher.stats()
+
+@app.get("/api/admin/price-cache")
+def price_cache_stats(__=Depends(require_admin)):
+    return pricing.cache.stats()
+
+@app.get("/api/admin/drift")
+def drift_report(__=Depends(require_admin)):
+    return drift.monitor.report(engine)
+
+@app.get("/api/admin/models")
+def list_models(__=Depends(require_admin)):
+    out = {}
+    for name in FORECAST_MODELS.values():
+        active = registry.active(name)
+        out[name] = {
+            "active": active.version if active else None,
+            "versions": registry.versions(name),
+        }
+    return out
+
+@app.get("/api/admin/retraining")
+def retraining_status(__=Depends(require_admin)):
+    return retrain.scheduler.status()
+
+@app.post("/api/admin/retraining/{task}", status_code=status.HTTP_202_ACCEPTED)
+def trigger_retraining(task: str, __=Depends(require_admin)):
+    if task not in retrain.scheduler.tasks:
+        raise HTTPException(status_code=404, detail="Unknown retraining task")
+    try:
+        return retrain.scheduler.trigger(task).summary()
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/api/admin/models/defect-forecast/retrain")
+def retrain_defect_forecast(
+    engine: str = Query(engines.DEFAULT_ENGINE),
+    db: Session = Depends(get_db),
+    __=Depends(require_admin),
+):
+    try:
+        return ForecastService(db).retrain(engine)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
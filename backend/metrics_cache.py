@@ -0,0 +1,162 @@
+"""
+Result cache in front of MetricsService.quality.
+
+A window that ended in the past (any window of a closed day, or an earlier
+part of today) only changes if a late row is inserted into it. Such windows
+are cached permanently: in memory with LRU eviction and, when
+QUALITY_CACHE_DIR is set, on disk so they survive restarts. Before serving
+one, the ingest watermark (max Id of abb_dbo_test / abb_dbo_intervention) is
+compared with the one it was computed at; if it moved, a PK-range probe
+checks whether any of the new rows fall inside the window. A closed
+window answered from the hot window is stored with the snapshot's last Id
+when that is lower, so rows the snapshot had not loaded yet are probed too.
+
+Windows still open get a short TTL and are dropped as soon as the watermark
+moves.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from hot_window import hot_window
+from schemas import QualityMetrics
+
+CACHE_SIZE = int(os.getenv("QUALITY_CACHE_SIZE", "512"))
+OPEN_TTL = float(os.getenv("QUALITY_CACHE_TTL", "30"))
+CACHE_DIR = os.getenv("QUALITY_CACHE_DIR")
+# Rows can land a little after their DateDebut; a window only counts as
+# closed once it ended this long ago.
+CLOSE_GRACE = timedelta(minutes=5)
+
+Watermark = Tuple[int, int]
+
+
+class CacheEntry:
+    def __init__(self, payload: QualityMetrics, watermark: Watermark, closed: bool):
+        self.payload = payload
+        self.watermark = watermark
+        self.closed = closed
+        self.created = time.monotonic()
+        self.etag = '"' + hashlib.sha1(payload.model_dump_json().encode()).hexdigest() + '"'
+
+    @property
+    def cache_control(self) -> str:
+        # Closed windows can still change with a late row: revalidate by ETag
+        if self.closed:
+            return "private, no-cache"
+        return f"private, max-age={int(OPEN_TTL)}"
+
+
+class QualityCache:
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = OPEN_TTL,
+                 directory: Optional[str] = CACHE_DIR):
+        self.size = size
+        self.ttl = ttl
+        self.directory = directory
+        self._entries: "OrderedDict[tuple, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def watermark(db: Session) -> Watermark:
+        row = db.execute(text("""
+            SELECT (SELECT COALESCE(MAX(Id), 0) FROM abb_dbo_test),
+                   (SELECT COALESCE(MAX(Id), 0) FROM abb_dbo_intervention)
+        """)).fetchone()
+        return int(row[0]), int(row[1])
+
+    @staticmethod
+    def _late_rows(db: Session, start: str, end: str, since: Watermark) -> bool:
+        """
+        True if a row inserted after `since` falls inside [start, end].
+        Both probes are PK range scans over the new rows only.
+        """
+        params = {"start": start, "end": end, "t_id": since[0], "i_id": since[1]}
+        return db.execute(text("""
+            SELECT EXISTS (SELECT 1 FROM abb_dbo_test
+                           WHERE Id > :t_id AND DateDebut_ts BETWEEN :start AND :end)
+                OR EXISTS (SELECT 1 FROM abb_dbo_intervention
+                           WHERE Id > :i_id AND DateIntervention BETWEEN :start AND :end)
+        """), params).scalar() == 1
+
+    def _path(self, key: tuple) -> str:
+        return os.path.join(self.directory, "quality_" + "_".join(key).replace(":", "") + ".json")
+
+    def _load(self, key: tuple) -> Optional[CacheEntry]:
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return CacheEntry(QualityMetrics(**data["payload"]), tuple(data["watermark"]), closed=True)
+
+    def _store(self, key: tuple, entry: CacheEntry, persist: bool = True) -> None:
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        if persist and self.directory and entry.closed:
+            tmp = self._path(key) + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"payload": entry.payload.model_dump(mode="json"),
+                           "watermark": list(entry.watermark)}, f)
+            os.replace(tmp, self._path(key))
+
+    def get_or_compute(self, db: Session, d: date, start_t: str, end_t: str,
+                       compute: Callable[[], QualityMetrics]) -> CacheEntry:
+        key = (d.isoformat(), start_t, end_t)
+        start, end = f"{d} {start_t}", f"{d} {end_t}"
+        closed = datetime.strptime(end, "%Y-%m-%d %H:%M:%S") < datetime.now() - CLOSE_GRACE
+        current = self.watermark(db)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and closed:
+            entry = self._load(key)
+
+        if entry is not None:
+            moved = entry.watermark != current
+            if not moved:
+                fresh = entry.closed or time.monotonic() - entry.created < self.ttl
+            elif entry.closed:
+                fresh = not self._late_rows(db, start, end, entry.watermark)
+                if fresh:
+                    entry.watermark = current
+            else:
+                fresh = False
+            if fresh:
+                self.hits += 1
+                self._store(key, entry, persist=moved)
+                return entry
+
+        self.misses += 1
+        snap = hot_window.snapshot_for(start, end) if closed else None
+        if snap is not None and snap.last_id < current[0]:
+            # compute() may answer from this snapshot, which lags the table
+            current = (snap.last_id, current[1])
+        entry = CacheEntry(compute(), current, closed)
+        self._store(key, entry)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+quality_cache = QualityCache()
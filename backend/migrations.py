@@ -0,0 +1,191 @@
+"""
+Schema migrations for abb_dbo_test.
+
+DateDebut/DateFin are stored as VARCHAR, so every range filter had to wrap
+them in STR_TO_DATE and could never use an index. This tool adds typed
+DATETIME shadow columns (DateDebut_ts, DateFin_ts), indexes them, keeps them
+in sync for new rows with triggers and backfills existing rows in small,
+resumable, throttled batches keyed by Id.
+
+    python migrations.py upgrade                 # columns, indexes, triggers
+    python migrations.py backfill --batch-size 5000 --sleep 0.2
+    python migrations.py status
+
+Run `upgrade` then `backfill` before deploying the services that query the
+new columns. The backfill can be interrupted at any point and restarted; it
+continues after the last committed batch.
+"""
+import argparse
+import time
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from database import engine as default_engine
+
+TABLE = "abb_dbo_test"
+STATE_TABLE = "schema_backfill_state"
+BACKFILL_NAME = "abb_dbo_test.timestamps"
+
+# DateDebut/DateFin may hold junk or fractional seconds; only well-formed
+# prefixes are converted so strict-mode UPDATEs never fail on a bad row.
+_TS_FORMAT = "'%Y-%m-%d %H:%i:%s'"
+_TS_PATTERN = "'^[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}'"
+
+
+def _parse_expr(column: str) -> str:
+    return (f"CASE WHEN {column} REGEXP {_TS_PATTERN} "
+            f"THEN STR_TO_DATE(LEFT({column}, 19), {_TS_FORMAT}) END")
+
+
+COLUMNS = {
+    "DateDebut_ts": "DATETIME NULL",
+    "DateFin_ts":   "DATETIME NULL",
+}
+
+INDEXES = {
+    "ix_test_datedebut_ts":        "(DateDebut_ts)",
+    "ix_test_datedebut_ts_result": "(DateDebut_ts, Result)",
+    "ix_test_board_datedebut_ts":  "(Id_Board, DateDebut_ts)",
+}
+
+TRIGGERS = {
+    "trg_abb_dbo_test_ts_insert": "BEFORE INSERT",
+    "trg_abb_dbo_test_ts_update": "BEFORE UPDATE",
+}
+
+
+def _existing(conn, kind: str) -> set:
+    queries = {
+        "column": """SELECT COLUMN_NAME FROM information_schema.COLUMNS
+                     WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table""",
+        "index": """SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table""",
+        "trigger": """SELECT TRIGGER_NAME FROM information_schema.TRIGGERS
+                      WHERE TRIGGER_SCHEMA = DATABASE() AND EVENT_OBJECT_TABLE = :table""",
+    }
+    return {r[0] for r in conn.execute(text(queries[kind]), {"table": TABLE})}
+
+
+def upgrade(engine: Engine = default_engine) -> None:
+    """
+    Idempotently adds the shadow columns, their indexes, the sync triggers
+    and the backfill state table.
+    """
+    with engine.begin() as conn:
+        cols = _existing(conn, "column")
+        for name, ddl in COLUMNS.items():
+            if name not in cols:
+                print(f"Adding column {TABLE}.{name}")
+                conn.execute(text(f"ALTER TABLE {TABLE} ADD COLUMN {name} {ddl}"))
+
+        idx = _existing(conn, "index")
+        for name, cols_ddl in INDEXES.items():
+            if name not in idx:
+                print(f"Creating index {name} {cols_ddl}")
+                conn.execute(text(f"CREATE INDEX {name} ON {TABLE} {cols_ddl}"))
+
+        trg = _existing(conn, "trigger")
+        for name, timing in TRIGGERS.items():
+            if name not in trg:
+                print(f"Creating trigger {name}")
+                conn.execute(text(f"""
+                    CREATE TRIGGER {name} {timing} ON {TABLE} FOR EACH ROW
+                    SET NEW.DateDebut_ts = {_parse_expr('NEW.DateDebut')},
+                        NEW.DateFin_ts   = {_parse_expr('NEW.DateFin')}
+                """))
+
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+              name       VARCHAR(100) PRIMARY KEY,
+              last_id    BIGINT NOT NULL DEFAULT 0,
+              updated_at DATETIME NOT NULL
+            )
+        """))
+
+
+def _last_id(conn) -> int:
+    row = conn.execute(text(f"SELECT last_id FROM {STATE_TABLE} WHERE name = :name"),
+                       {"name": BACKFILL_NAME}).fetchone()
+    return int(row[0]) if row else 0
+
+
+def _save_last_id(conn, last_id: int) -> None:
+    conn.execute(text(f"""
+        INSERT INTO {STATE_TABLE} (name, last_id, updated_at) VALUES (:name, :last_id, NOW())
+        ON DUPLICATE KEY UPDATE last_id = VALUES(last_id), updated_at = VALUES(updated_at)
+    """), {"name": BACKFILL_NAME, "last_id": last_id})
+
+
+def backfill(engine: Engine = default_engine, batch_size: int = 5000,
+             sleep: float = 0.2, max_batches: Optional[int] = None) -> int:
+    """
+    Fills DateDebut_ts/DateFin_ts for rows with Id above the saved watermark,
+    one committed batch at a time, sleeping `sleep` seconds between batches to
+    leave room for production traffic. Returns the number of rows updated.
+    """
+    updated = batches = 0
+    while max_batches is None or batches < max_batches:
+        with engine.begin() as conn:
+            last_id = _last_id(conn)
+            upper = conn.execute(text(f"""
+                SELECT MAX(Id) FROM (
+                  SELECT Id FROM {TABLE} WHERE Id > :last_id ORDER BY Id LIMIT :n
+                ) batch
+            """), {"last_id": last_id, "n": batch_size}).scalar()
+            if upper is None:
+                break
+            res = conn.execute(text(f"""
+                UPDATE {TABLE}
+                SET DateDebut_ts = {_parse_expr('DateDebut')},
+                    DateFin_ts   = {_parse_expr('DateFin')}
+                WHERE Id > :last_id AND Id <= :upper
+            """), {"last_id": last_id, "upper": upper})
+            _save_last_id(conn, int(upper))
+
+        updated += res.rowcount
+        batches += 1
+        print(f"Batch {batches}: Id {last_id + 1}..{upper} ({res.rowcount} rows)")
+        if sleep:
+            time.sleep(sleep)
+    return updated
+
+
+def status(engine: Engine = default_engine) -> dict:
+    with engine.connect() as conn:
+        max_id = conn.execute(text(f"SELECT MAX(Id) FROM {TABLE}")).scalar() or 0
+        last_id = _last_id(conn)
+        missing = conn.execute(text(f"""
+            SELECT COUNT(*) FROM {TABLE}
+            WHERE DateDebut_ts IS NULL AND DateDebut IS NOT NULL AND Id <= :last_id
+        """), {"last_id": last_id}).scalar()
+    return {"max_id": int(max_id), "backfilled_to": last_id, "unparseable": int(missing)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("upgrade")
+    bf = sub.add_parser("backfill")
+    bf.add_argument("--batch-size", type=int, default=5000)
+    bf.add_argument("--sleep", type=float, default=0.2, help="Pause between batches (seconds)")
+    bf.add_argument("--max-batches", type=int, default=None)
+    bf.add_argument("--reset", action="store_true", help="Restart from Id 0")
+    sub.add_parser("status")
+    args = ap.parse_args()
+
+    if args.cmd == "upgrade":
+        upgrade()
+    elif args.cmd == "backfill":
+        if args.reset:
+            with default_engine.begin() as conn:
+                _save_last_id(conn, 0)
+        n = backfill(batch_size=args.batch_size, sleep=args.sleep, max_batches=args.max_batches)
+        print(f"Backfilled {n} rows.")
+    else:
+        print(status())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+Versioned store for trained models, keyed by a fingerprint of their
+training data.
+
+    <MODEL_REGISTRY_DIR>/<name>/<version>/    artifact (see artifacts.py) with a "model" part
+    <MODEL_REGISTRY_DIR>/<name>/<version>/meta.json
+
+Only the newest MODEL_REGISTRY_KEEP versions of each model are kept; older
+ones are deleted on save.
+
+A model is trained only when no version exists for the current data
+fingerprint (or when a retrain is forced); otherwise the matching version is
+loaded once and kept in memory, together with the last
+MODEL_PREDICTION_CACHE predictions computed from it.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import artifacts
+import lazy
+
+joblib = lazy.module("joblib")
+pd = lazy.module("pandas")
+
+REGISTRY_DIR = os.getenv(
+    "MODEL_REGISTRY_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_registry"),
+)
+KEEP_VERSIONS = int(os.getenv("MODEL_REGISTRY_KEEP", "10"))
+# latest() looks for versions saved by other processes at most this often (seconds)
+CHECK_INTERVAL = float(os.getenv("MODEL_REGISTRY_POLL", "30"))
+PREDICTION_CACHE = int(os.getenv("MODEL_PREDICTION_CACHE", "64"))
+
+
+def fingerprint(df: pd.DataFrame, date_column: str = "ds") -> str:
+    """
+    Row count + max date + content checksum of a training frame.
+    """
+    checksum = hashlib.sha1(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+    max_date = str(df[date_column].max()) if date_column in df and len(df) else ""
+    return f"{len(df)}:{max_date}:{checksum}"
+
+
+class LoadedModel:
+    def __init__(self, name: str, version: str, model: Any, meta: dict):
+        self.name = name
+        self.version = version
+        self.model = model
+        self.meta = meta
+        self.predictions: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def fingerprint(self) -> str:
+        return self.meta["fingerprint"]
+
+    def predict(self, key: Hashable, fn: Callable[[Any], Any]) -> Any:
+        """
+        Memoised prediction: `fn(model)` runs once per key for this version
+        while the key is among the PREDICTION_CACHE most recently used.
+        """
+        with self._lock:
+            if key in self.predictions:
+                self.predictions.move_to_end(key)
+                return self.predictions[key]
+        result = fn(self.model)
+        with self._lock:
+            result = self.predictions.setdefault(key, result)
+            self.predictions.move_to_end(key)
+            while len(self.predictions) > PREDICTION_CACHE:
+                self.predictions.popitem(last=False)
+            return result
+
+
+class ModelRegistry:
+    def __init__(self, directory: str = REGISTRY_DIR):
+        self.directory = directory
+        self._loaded: Dict[str, LoadedModel] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._checked: Dict[str, float] = {}
+        self._guard = threading.Lock()
+
+    def _lock(self, name: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def _dir(self, name: str, version: str = "") -> str:
+        return os.path.join(self.directory, name, version)
+
+    def versions(self, name: str) -> List[dict]:
+        root = self._dir(name)
+        if not os.path.isdir(root):
+            return []
+        out = []
+        for version in sorted(os.listdir(root)):
+            try:
+                with open(os.path.join(root, version, "meta.json")) as f:
+                    out.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return out
+
+    def find(self, name: str, fp: str) -> Optional[dict]:
+        matches = [m for m in self.versions(name) if m.get("fingerprint") == fp]
+        return matches[-1] if matches else None
+
+    def _load(self, name: str, meta: dict) -> LoadedModel:
+        path = self._dir(name, meta["version"])
+        if artifacts.exists(path):
+            model = artifacts.load(path)["model"]
+        else:  # versions saved before artifacts.py
+            model = joblib.load(os.path.join(path, "model.joblib"), mmap_mode="r" if artifacts.MMAP else None)
+        return LoadedModel(name, meta["version"], model, meta)
+
+    def _prune(self, name: str) -> None:
+        """Deletes all but the newest KEEP_VERSIONS saved versions."""
+        if KEEP_VERSIONS <= 0:
+            return
+        for meta in self.versions(name)[:-KEEP_VERSIONS]:
+            shutil.rmtree(self._dir(name, meta["version"]), ignore_errors=True)
+
+    def save(self, name: str, model: Any, fp: str, **info) -> LoadedModel:
+        root = self._dir(name)
+        numbers = [int(m.group(1)) for v in (os.listdir(root) if os.path.isdir(root) else [])
+                   if (m := re.match(r"v(\d+)-", v))]
+        n = max(numbers, default=0) + 1
+        version = f"v{n:04d}-{hashlib.sha1(fp.encode()).hexdigest()[:10]}"
+        path = self._dir(name, version)
+        artifacts.save(path, {"model": model}, name=name, version=version)
+        meta = {"name": name, "version": version, "fingerprint": fp,
+                "created": datetime.now().isoformat(timespec="seconds"), **info}
+        # The version is listed once meta.json exists
+        with open(os.path.join(path, "meta.json.tmp"), "w") as f:
+            json.dump(meta, f, indent=2, default=str)
+        os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+        self._prune(name)
+        return LoadedModel(name, version, model, meta)
+
+    def publish(self, name: str, model: Any, fp: str, **info) -> LoadedModel:
+        """
+        Saves a model trained elsewhere (e.g. by the retrain scheduler) and
+        makes it the active version; readers switch over on their next call.
+        """
+        with self._lock(name):
+            loaded = self.save(name, model, fp, **info)
+            self._loaded[name] = loaded
+            return loaded
+
+    def get_or_train(self, name: str, df: pd.DataFrame, train: Callable[[pd.DataFrame], Any],
+                     force: bool = False, date_column: str = "ds", allow_stale: bool = False) -> LoadedModel:
+        """
+        The model for `df`: from memory, else from disk, else trained and
+        saved as a new version. `force` always trains a new version.
+        With `allow_stale` (models kept fresh by the scheduler) the active or
+        latest saved version is returned whatever data it was trained on.
+        """
+        if allow_stale and not force:
+            current = self.latest(name)
+            if current is not None:
+                return current
+
+        fp = fingerprint(df, date_column)
+        current = self._loaded.get(name)
+        if not force and current is not None and current.fingerprint == fp:
+            return current
+
+        with self._lock(name):
+            current = self._loaded.get(name)
+            if not force and current is not None and current.fingerprint == fp:
+                return current
+            meta = None if force else self.find(name, fp)
+            if meta is not None:
+                loaded = self._load(name, meta)
+            else:
+                t0 = time.perf_counter()
+                model = train(df)
+                loaded = self.save(name, model, fp, rows=len(df),
+                                   train_seconds=round(time.perf_counter() - t0, 3))
+            self._loaded[name] = loaded
+            return loaded
+
+    def active(self, name: str) -> Optional[LoadedModel]:
+        return self._loaded.get(name)
+
+    def _newest(self, name: str) -> Optional[str]:
+        """The newest saved version of `name`, without reading every meta.json."""
+        root = self._dir(name)
+        if not os.path.isdir(root):
+            return None
+        for version in sorted(os.listdir(root), reverse=True):
+            if os.path.isfile(os.path.join(root, version, "meta.json")):
+                return version
+        return None
+
+    def latest(self, name: str) -> Optional[LoadedModel]:
+        """
+        The newest saved version (loaded), else the active one, else None.
+        The directory is re-checked every CHECK_INTERVAL seconds, so
+        versions published by another process (the retrain scheduler's
+        worker) are picked up without a restart.
+        """
+        current = self._loaded.get(name)
+        if current is not None and time.monotonic() - self._checked.get(name, float("-inf")) < CHECK_INTERVAL:
+            return current
+        with self._lock(name):
+            self._checked[name] = time.monotonic()
+            newest = self._newest(name)
+            current = self._loaded.get(name)
+            if newest is not None and (current is None or newest > current.version):
+                with open(os.path.join(self._dir(name, newest), "meta.json")) as f:
+                    self._loaded[name] = self._load(name, json.load(f))
+            return self._loaded.get(name)
+
+
+registry = ModelRegistry()
@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, Numeric
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, Numeric, Index
 from database import Base
 from datetime import datetime
 
@@ -42,6 +42,9 @@ class Test(Base):
     Id_Operateur = Column(Float)
     DateDebut = Column(String(50))
     DateFin = Column(String(50))
+    # Typed shadows of DateDebut/DateFin, filled by migrations.py
+    DateDebut_ts = Column(DateTime)
+    DateFin_ts = Column(DateTime)
     Result = Column(Integer)
     TypeTest = Column(String(50))
     Side = Column(Float)
@@ -50,6 +53,12 @@ class Test(Base):
     Id_Process = Column(Float)
     Comment = Column(Float)
 
+    __table_args__ = (
+        Index("ix_test_datedebut_ts", "DateDebut_ts"),
+        Index("ix_test_datedebut_ts_result", "DateDebut_ts", "Result"),
+        Index("ix_test_board_datedebut_ts", "Id_Board", "DateDebut_ts"),
+    )
+
 class Famille(Base):
     __tablename__ = "abb_dbo_famille"
     Id = Column(Numeric(18, 0), primary_key=True)
@@ -1,25 +1,16 @@
 import os
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
 from prophet import Prophet
 import joblib
 from prophet.diagnostics import cross_validation, performance_metrics
+from daily_store import daily_store
 
 def load_daily_defect_rate(db_url):
     engine = create_engine(db_url)
-    # Aggregate daily counts of fails (Result=0) and totals
-    sql = text("""
-        SELECT
-            DATE(t.DateDebut) AS ds,
-            SUM(CASE WHEN t.Result = 0 THEN 1 ELSE 0 END) * 1.0 / 
-            NULLIF(COUNT(*), 0) AS defect_rate
-        FROM abb_dbo_test t
-        GROUP BY DATE(t.DateDebut)
-        ORDER BY DATE(t.DateDebut)
-    """)
-    df = pd.read_sql(sql, engine)
-    df = df.dropna(subset=['defect_rate'])
-    return df
+    # Daily counts of fails (Result=0) and totals, kept up to date incrementally
+    df = daily_store.load(engine).rename(columns={'y': 'defect_rate'})
+    return df[['ds', 'defect_rate']]
 
 def train_forecaster(df):
     # Prophet expects columns ds (date) and y (value)
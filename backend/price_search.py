@@ -0,0 +1,234 @@
+"""
+Hyperparameter search and serving benchmark for the board price model.
+
+Every candidate (model family x parameter set from CANDIDATES) is
+cross-validated on the sparse features of predictive_pipeline.preprocess,
+one fold per task in a spawn process pool. Each candidate is then refit on
+an 80% split and benchmarked: fit seconds, predict milliseconds per 1000
+rows, pickled size and holdout RMSE / R².
+
+The winner minimises
+
+    objective = cv_rmse * (1 + latency_weight * predict_ms_per_1k + size_weight * size_mb)
+
+among the candidates within --max-latency-ms / --max-size-mb; it is refit
+on all rows and published as the active `rf_price` version in the model
+registry, which pricing.py serves.
+
+    python price_search.py                                  # search, benchmark, promote
+    python price_search.py --families ridge,random_forest --no-promote
+    python price_search.py --latency-weight 0.05 --max-size-mb 50 --output search.json
+
+The retrain scheduler uses it when PRICE_TRAINER=price_search:train_model.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import lazy
+
+joblib = lazy.module("joblib")
+pd = lazy.module("pandas")
+
+# family -> ("module:class", fixed params, grid)
+CANDIDATES: Dict[str, Tuple[str, dict, Dict[str, list]]] = {
+    "ridge": ("sklearn.linear_model:Ridge", {}, {"alpha": [0.1, 1.0, 10.0]}),
+    "random_forest": (
+        "sklearn.ensemble:RandomForestRegressor", {"random_state": 42, "n_jobs": 1},
+        {"n_estimators": [50, 100, 200], "max_depth": [None, 20], "min_samples_leaf": [1, 3]},
+    ),
+    "gradient_boosting": (
+        "xgboost:XGBRegressor", {"random_state": 42, "n_jobs": 1, "tree_method": "hist"},
+        {"n_estimators": [200, 400], "max_depth": [4, 6], "learning_rate": [0.05, 0.1]},
+    ),
+}
+LATENCY_WEIGHT = 0.01   # +1% objective per ms / 1k rows
+SIZE_WEIGHT = 0.001     # +0.1% objective per MB
+BENCH_ROWS = 1000
+
+
+def candidates(families: Sequence[str] = tuple(CANDIDATES)) -> List[Tuple[str, dict]]:
+    """(family, params) for every grid point of `families`."""
+    out = []
+    for family in families:
+        if family not in CANDIDATES:
+            raise ValueError(f"Unknown model family '{family}', expected one of {sorted(CANDIDATES)}")
+        _, _, grid = CANDIDATES[family]
+        for values in itertools.product(*grid.values()):
+            out.append((family, dict(zip(grid, values))))
+    return out
+
+
+def build(family: str, params: dict):
+    target, fixed, _ = CANDIDATES[family]
+    module, name = target.split(":")
+    return getattr(importlib.import_module(module), name)(**fixed, **params)
+
+
+def _scores(y_true, y_pred) -> Tuple[float, float]:
+    from sklearn.metrics import mean_squared_error, r2_score
+    return float(mean_squared_error(y_true, y_pred) ** 0.5), float(r2_score(y_true, y_pred))
+
+
+def cv_fold(family: str, params: dict, X, y, train_idx, test_idx) -> Tuple[float, float]:
+    """(rmse, r2) of one fold; runs in a pool worker."""
+    model = build(family, params).fit(X[train_idx], y[train_idx])
+    return _scores(y[test_idx], model.predict(X[test_idx]))
+
+
+def benchmark(family: str, params: dict, X_train, y_train, X_test, y_test, repeat: int = 3) -> dict:
+    """Fit time, predict latency, size and holdout scores; runs in a pool worker."""
+    t0 = time.perf_counter()
+    model = build(family, params).fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - t0
+
+    rows = X_test[np.resize(np.arange(X_test.shape[0]), BENCH_ROWS)]
+    latency = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        model.predict(rows)
+        latency = min(latency, time.perf_counter() - t0)
+
+    buf = io.BytesIO()
+    joblib.dump(model, buf)
+    rmse, r2 = _scores(y_test, model.predict(X_test))
+    return {
+        "fit_seconds": round(fit_seconds, 4),
+        "predict_ms_per_1k": round(latency * 1000 * 1000 / BENCH_ROWS, 4),
+        "size_mb": round(buf.tell() / 1e6, 4),
+        "holdout_rmse": rmse, "holdout_r2": r2,
+    }
+
+
+def objective(c: dict, latency_weight: float, size_weight: float) -> float:
+    return c["cv_rmse"] * (1 + latency_weight * c["predict_ms_per_1k"] + size_weight * c["size_mb"])
+
+
+def search(df: pd.DataFrame, families: Sequence[str] = tuple(CANDIDATES), folds: int = 5,
+           workers: int = os.cpu_count() or 2, latency_weight: float = LATENCY_WEIGHT,
+           size_weight: float = SIZE_WEIGHT, max_latency_ms: Optional[float] = None,
+           max_size_mb: Optional[float] = None) -> dict:
+    """
+    Cross-validates and benchmarks every candidate. Returns {"candidates":
+    [...] sorted by objective, "best": the best eligible one or None}.
+    """
+    from sklearn.model_selection import KFold, train_test_split
+    from predictive_pipeline import preprocess
+
+    X, y, _ = preprocess(df)
+    y = y.to_numpy()
+    grid = candidates(families)
+    splits = list(KFold(n_splits=folds, shuffle=True, random_state=42).split(X))
+    train_idx, test_idx = train_test_split(np.arange(X.shape[0]), test_size=0.2, random_state=42)
+
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        cv = {i: [pool.submit(cv_fold, family, params, X, y, tr, te) for tr, te in splits]
+              for i, (family, params) in enumerate(grid)}
+        bench = {i: pool.submit(benchmark, family, params, X[train_idx], y[train_idx], X[test_idx], y[test_idx])
+                 for i, (family, params) in enumerate(grid)}
+        results = []
+        for i, (family, params) in enumerate(grid):
+            scores = np.array([f.result() for f in cv[i]])
+            c = {"family": family, "params": params,
+                 "cv_rmse": float(scores[:, 0].mean()), "cv_rmse_std": float(scores[:, 0].std()),
+                 "cv_r2": float(scores[:, 1].mean()), **bench[i].result()}
+            c["eligible"] = ((max_latency_ms is None or c["predict_ms_per_1k"] <= max_latency_ms)
+                             and (max_size_mb is None or c["size_mb"] <= max_size_mb))
+            c["objective"] = objective(c, latency_weight, size_weight)
+            results.append(c)
+
+    results.sort(key=lambda c: c["objective"])
+    best = next((c for c in results if c["eligible"]), None)
+    return {"rows": int(X.shape[0]), "features": int(X.shape[1]), "folds": folds,
+            "latency_weight": latency_weight, "size_weight": size_weight,
+            "candidates": results, "best": best}
+
+
+def fit_best(df: pd.DataFrame, best: dict) -> dict:
+    """The {"model", "encoder"} artifact of `best` refit on all rows."""
+    from predictive_pipeline import preprocess
+    X, y, encoder = preprocess(df)
+    model = build(best["family"], best["params"]).fit(X, y.to_numpy())
+    return {"model": model, "encoder": encoder.to_dict()}
+
+
+def _best_metrics(result: dict) -> dict:
+    best = result["best"]
+    return {
+        "family": best["family"], "params": best["params"], "rmse": best["cv_rmse"], "r2": best["cv_r2"],
+        "predict_ms_per_1k": best["predict_ms_per_1k"], "size_mb": best["size_mb"],
+        "objective": best["objective"], "candidates": len(result["candidates"]),
+    }
+
+
+def train_model(df: pd.DataFrame):
+    """Retrain-scheduler entry point, like predictive_pipeline.train_model."""
+    result = search(df)
+    if result["best"] is None:
+        raise RuntimeError("No eligible price model candidate")
+    return fit_best(df, result["best"]), _best_metrics(result)
+
+
+def promote(df: pd.DataFrame, result: dict):
+    """Refits the best candidate on `df` and makes it the active rf_price version."""
+    from model_registry import fingerprint, registry
+    from pricing import MODEL_NAME
+    return registry.publish(MODEL_NAME, fit_best(df, result["best"]), fingerprint(df, "id"),
+                            rows=len(df), reason="search", **_best_metrics(result))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--families", default=",".join(CANDIDATES))
+    ap.add_argument("--folds", type=int, default=5)
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 2)
+    ap.add_argument("--latency-weight", type=float, default=LATENCY_WEIGHT)
+    ap.add_argument("--size-weight", type=float, default=SIZE_WEIGHT)
+    ap.add_argument("--max-latency-ms", type=float, help="Exclude candidates slower per 1k rows")
+    ap.add_argument("--max-size-mb", type=float, help="Exclude larger candidates")
+    ap.add_argument("--no-promote", action="store_true", help="Only report")
+    ap.add_argument("--output", help="Write the full results as JSON to this file")
+    args = ap.parse_args()
+
+    from sqlalchemy import text
+    from database import engine
+    from predictive_pipeline import PRICE_QUERY
+    df = pd.read_sql(text(PRICE_QUERY), engine)
+    print(f"Loaded {len(df)} boards")
+
+    t0 = time.perf_counter()
+    result = search(df, [f for f in args.families.split(",") if f], args.folds, args.workers,
+                    args.latency_weight, args.size_weight, args.max_latency_ms, args.max_size_mb)
+    print(f"{len(result['candidates'])} candidates x {args.folds} folds in {time.perf_counter() - t0:.1f}s\n")
+    print(f"{'family':<18} {'cv_rmse':>10} {'cv_r2':>7} {'fit_s':>7} {'ms/1k':>8} {'MB':>8} {'objective':>10}  params")
+    for c in result["candidates"]:
+        flag = "" if c["eligible"] else "  (excluded)"
+        print(f"{c['family']:<18} {c['cv_rmse']:>10.3f} {c['cv_r2']:>7.3f} {c['fit_seconds']:>7.2f} "
+              f"{c['predict_ms_per_1k']:>8.2f} {c['size_mb']:>8.2f} {c['objective']:>10.3f}  {c['params']}{flag}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2, default=str)
+    if result["best"] is None:
+        print("\nNo candidate within the latency/size limits")
+        return
+    print(f"\nBest: {result['best']['family']} {result['best']['params']}")
+    if not args.no_promote:
+        loaded = promote(df, result)
+        print(f"Published {loaded.name} {loaded.version}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+"""
+Serving side of the board price model (RandomForest on one-hot ref_asteel
+and family_name, see predictive_pipeline.py).
+
+The latest `rf_price` version in the model registry is used when there is
+one (each worker looks for a newer one every MODEL_REGISTRY_POLL seconds);
+otherwise the `price` artifact in artifacts.ARTIFACTS_DIR as saved by
+predictive_pipeline.py, or the older model_rf_prix.joblib, versioned by the
+bundle's model checksum or the file's mtime so that a re-saved one is picked
+up within the same MODEL_REGISTRY_POLL seconds. All are
+{"model", "encoder"} artifacts, and features are built with the
+same feature_encoding.CategoricalEncoder as at training. Older artifacts
+(a bare model trained on pd.get_dummies, or {"model", "columns"}) get an
+encoder rebuilt from their column list. Values not seen at training leave
+their field's columns at zero.
+
+predict_cached() keeps an LRU of predictions keyed by a hash of the
+encoded feature vector (PRICE_CACHE_SIZE entries), emptied whenever the
+served model version changes.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import artifacts
+import lazy
+from feature_encoding import CategoricalEncoder
+from model_registry import CHECK_INTERVAL, registry
+
+joblib = lazy.module("joblib")
+pd = lazy.module("pandas")
+
+MODEL_NAME = "rf_price"
+LEGACY_PATH = os.getenv(
+    "PRICE_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "model_rf_prix.joblib"),
+)
+BUNDLE_PATH = os.path.join(artifacts.ARTIFACTS_DIR, "price")
+FIELDS = ["ref_asteel", "family_name"]
+CACHE_SIZE = int(os.getenv("PRICE_CACHE_SIZE", "4096"))
+
+
+class PriceModel:
+    def __init__(self, model: Any, encoder: CategoricalEncoder, version: str):
+        self.model = model
+        self.encoder = encoder
+        self.version = version
+        # Models fitted on a DataFrame expect one with the same column names
+        self.dense = hasattr(model, "feature_names_in_")
+
+    @classmethod
+    def from_artifact(cls, artifact: Any, version: str) -> "PriceModel":
+        if not isinstance(artifact, dict):
+            return cls(artifact, CategoricalEncoder.from_columns(artifact.feature_names_in_, FIELDS), version)
+        if "encoder" in artifact:
+            return cls(artifact["model"], CategoricalEncoder.from_dict(artifact["encoder"]), version)
+        return cls(artifact["model"], CategoricalEncoder.from_columns(artifact["columns"], FIELDS), version)
+
+    def features(self, records: Sequence[dict]):
+        return self.encoder.transform(records)
+
+    def predict_features(self, X) -> List[float]:
+        """Predicted prix per row of an encoded (CSR) matrix."""
+        if self.dense:
+            X = pd.DataFrame(X.toarray(), columns=self.encoder.feature_names())
+        return self.model.predict(X).astype(float).tolist()
+
+    def predict(self, records: Sequence[dict]) -> List[float]:
+        """Predicted prix per record (dicts with ref_asteel / family_name)."""
+        if not len(records):
+            return []
+        return self.predict_features(self.features(records))
+
+
+class PredictionCache:
+    """LRU of predictions for one model version."""
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self.version: Optional[str] = None
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_many(self, version: str, keys: Sequence[str]) -> Dict[str, float]:
+        with self._lock:
+            if version != self.version:
+                if self.version is not None:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.version = version
+            found = {}
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+            return found
+
+    def put_many(self, version: str, values: Dict[str, float]) -> None:
+        with self._lock:
+            if version != self.version:
+                return  # a newer model was swapped in meanwhile
+            self._entries.update(values)
+            for key in values:
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"version": self.version, "entries": len(self._entries), "size": self.size,
+                    "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations}
+
+
+cache = PredictionCache()
+
+
+_current: Optional[PriceModel] = None
+_lock = threading.Lock()
+_fallback: Tuple[float, str] = (float("-inf"), "")
+
+
+def _fallback_version() -> str:
+    """
+    Version of the model outside the registry: "artifact-<model sha256>" or
+    "legacy-<mtime>", re-read every CHECK_INTERVAL seconds.
+    """
+    global _fallback
+    checked, version = _fallback
+    if time.monotonic() - checked < CHECK_INTERVAL:
+        return version
+    if artifacts.exists(BUNDLE_PATH):
+        try:
+            version = "artifact-" + artifacts.read_manifest(BUNDLE_PATH)["parts"]["model"]["sha256"][:12]
+        except (artifacts.ArtifactError, KeyError):
+            version = "artifact"
+    else:
+        try:
+            version = f"legacy-{os.stat(LEGACY_PATH).st_mtime_ns}"
+        except OSError:
+            version = "legacy"
+    _fallback = (time.monotonic(), version)
+    return version
+
+
+def current() -> PriceModel:
+    """The price model to serve; follows new registry versions and re-saved files."""
+    global _current
+    loaded = registry.latest(MODEL_NAME)
+    if loaded is not None:
+        version = loaded.version
+    else:
+        version = _fallback_version()
+    if _current is None or _current.version != version:
+        with _lock:
+            if _current is None or _current.version != version:
+                if loaded is not None:
+                    artifact = loaded.model
+                elif version.startswith("artifact"):
+                    artifact = artifacts.load(BUNDLE_PATH)
+                else:
+                    artifact = joblib.load(LEGACY_PATH)
+                _current = PriceModel.from_artifact(artifact, version)
+    return _current
+
+
+def _row_keys(X) -> List[str]:
+    """Hash of each row's non-zero columns (the features are one-hot)."""
+    return [hashlib.sha1(X.indices[X.indptr[i]:X.indptr[i + 1]].tobytes()).hexdigest()
+            for i in range(X.shape[0])]
+
+
+def predict_cached(records: Sequence[dict]) -> Tuple[List[float], str]:
+    """
+    (predict() for `records`, model version), scoring only the feature
+    vectors not cached.
+    """
+    model = current()
+    if not len(records):
+        return [], model.version
+    X = model.features(records)
+    X.sort_indices()
+    keys = _row_keys(X)
+    found = cache.get_many(model.version, keys)
+    missing = [i for i, k in enumerate(keys) if k not in found]
+    if missing:
+        fresh = {}
+        for i, prix in zip(missing, model.predict_features(X[missing])):
+            fresh[keys[i]] = prix
+        cache.put_many(model.version, fresh)
+        found.update(fresh)
+    return [found[k] for k in keys], model.version
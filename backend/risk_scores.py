@@ -0,0 +1,190 @@
+"""
+Defect risk of every test record, scored ahead of time.
+
+test_risk_scores holds one row per abb_dbo_test Id with the classifier's
+P(Result = 0) for it. The highest scored Id is the watermark: each refresh
+reads the tests above it joined with their board and family (the fields of
+schemas.TestFeatures), scores them BATCH_SIZE at a time with one
+predict_proba call per batch, and writes each batch in one transaction.
+The dashboard then reads high-risk serials through the num_serie and
+(date_debut, defect_probability) indexes instead of calling the model.
+
+    python risk_scores.py refresh              # score new tests once
+    python risk_scores.py refresh --loop 300   # keep scoring every 300 s
+    python risk_scores.py rebuild              # rescore the last RISK_SCORING_DAYS days
+
+The API runs the same refresh in a background thread every
+RISK_SCORING_POLL seconds in every worker: a MySQL named lock lets one
+process score at a time, and the others skip their turn. A new classifier
+only applies to tests scored after it is deployed; run `rebuild` to rescore.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import classifier
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("RISK_SCORING", "1") != "0"
+POLL_INTERVAL = float(os.getenv("RISK_SCORING_POLL", "300"))
+# How far back the first refresh (or a rebuild) starts
+SCORING_DAYS = float(os.getenv("RISK_SCORING_DAYS", "30"))
+BATCH_SIZE = 20000
+TABLE = "test_risk_scores"
+LOCK_NAME = "test_risk_scoring"
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS {TABLE} (
+      test_id            BIGINT       PRIMARY KEY,
+      num_serie          VARCHAR(255) NULL,
+      id_board           INT          NULL,
+      date_debut         DATETIME     NULL,
+      defect_probability DOUBLE       NOT NULL,
+      model_version      VARCHAR(64)  NOT NULL,
+      scored_at          DATETIME     NOT NULL,
+      INDEX ix_risk_num_serie (num_serie),
+      INDEX ix_risk_date_probability (date_debut, defect_probability)
+    )
+"""
+
+FEATURES_SQL = """
+    SELECT
+      t.Id, t.Num_Serie, t.Id_Board, t.Id_Machine,
+      t.DateDebut_ts AS DateDebut, t.DateFin_ts AS DateFin,
+      t.Position_Flan, t.Id_ConfigLigne, t.Id_Process,
+      b.REF_AsteelFlash AS ref_asteel, b.REF_Clients AS ref_client,
+      f.Nom_Famille AS family_name, b.Board_Ver AS board_version,
+      b.Valide AS is_valid, b.Designation AS designation, b.Client AS client,
+      b.Code_Indus AS code_indus, b.Indice AS indice, b.Software_Ver AS software_ver,
+      b.Id_Assembly AS id_assembly, b.Id_Process AS id_process,
+      b.QuantCondit AS quantcondit, b.Id_Famille AS id_famille, b.prix
+    FROM abb_dbo_test t
+    LEFT JOIN abb_dbo_board b ON b.Id = t.Id_Board
+    LEFT JOIN abb_dbo_famille f ON f.Id = b.Id_Famille
+    WHERE t.Id > :last
+    ORDER BY t.Id
+    LIMIT :n
+"""
+
+
+class RiskScorer:
+    def __init__(self, poll: float = POLL_INTERVAL, days: float = SCORING_DAYS):
+        self.poll = poll
+        self.days = days
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._table_ready = False
+        self._lock = threading.Lock()
+
+    def _watermark(self, conn) -> int:
+        last = conn.execute(text(f"SELECT MAX(test_id) FROM {TABLE}")).scalar()
+        if last is not None:
+            return int(last)
+        since = datetime.now() - timedelta(days=self.days)
+        return int(conn.execute(text(
+            "SELECT COALESCE(MIN(Id), 1) - 1 FROM abb_dbo_test WHERE DateDebut_ts >= :since"
+        ), {"since": since}).scalar() or 0)
+
+    def refresh(self, bind: Engine, rebuild: bool = False) -> Optional[int]:
+        """
+        Scores every test above the watermark (after deleting every score with
+        `rebuild`). Returns the number scored, or None when another process
+        holds the scoring lock.
+        """
+        with self._lock, bind.connect() as lock_conn:
+            if not lock_conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME}).scalar():
+                return None
+            try:
+                return self._score(bind, rebuild)
+            finally:
+                lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+
+    def _score(self, bind: Engine, rebuild: bool) -> int:
+        model = classifier.get()
+        with bind.begin() as conn:
+            if not self._table_ready:
+                conn.execute(text(DDL))
+                self._table_ready = True
+            if rebuild:
+                conn.execute(text(f"DELETE FROM {TABLE}"))
+            last = self._watermark(conn)
+        scored = 0
+        while True:
+            with bind.begin() as conn:
+                rows = [dict(r) for r in conn.execute(text(FEATURES_SQL), {"last": last, "n": BATCH_SIZE}).mappings()]
+                if not rows:
+                    break
+                proba = model.predict_proba(rows)
+                now = datetime.now()
+                conn.execute(text(f"""
+                    INSERT INTO {TABLE} (test_id, num_serie, id_board, date_debut,
+                                         defect_probability, model_version, scored_at)
+                    VALUES (:test_id, :num_serie, :id_board, :date_debut, :p, :version, :now)
+                    ON DUPLICATE KEY UPDATE defect_probability = VALUES(defect_probability),
+                      model_version = VALUES(model_version), scored_at = VALUES(scored_at)
+                """), [
+                    {"test_id": r["Id"], "num_serie": r["Num_Serie"], "id_board": r["Id_Board"],
+                     "date_debut": r["DateDebut"], "p": float(1 - p), "version": model.version, "now": now}
+                    for r, p in zip(rows, proba)
+                ])
+            last = int(rows[-1]["Id"])
+            scored += len(rows)
+            if len(rows) < BATCH_SIZE:
+                break
+        return scored
+
+    def rebuild(self, bind: Engine) -> Optional[int]:
+        return self.refresh(bind, rebuild=True)
+
+    def _run(self, bind: Engine) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh(bind)
+            except Exception:
+                log.exception("risk scoring refresh failed")
+            self._stop.wait(self.poll)
+
+    def start(self, bind: Engine) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(bind,), name="risk-scoring", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+
+risk_scorer = RiskScorer()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("cmd", choices=["refresh", "rebuild"])
+    ap.add_argument("--loop", type=float, help="With refresh: repeat every LOOP seconds")
+    args = ap.parse_args()
+
+    from database import engine
+    while True:
+        t0 = time.perf_counter()
+        n = risk_scorer.refresh(engine) if args.cmd == "refresh" else risk_scorer.rebuild(engine)
+        if n is None:
+            print(f"{args.cmd}: another process is scoring; skipped")
+        else:
+            print(f"{args.cmd}: {n} test(s) scored in {time.perf_counter() - t0:.2f}s")
+        if args.cmd != "refresh" or not args.loop:
+            break
+        time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""
+Hourly rollups of abb_dbo_test and abb_dbo_intervention.
+
+rollup_test_hourly keeps a count per (hour, Id_Board, Id_Machine, TypeTest,
+Result); rollup_intervention_hourly keeps a count per (hour, Defaut). Both are
+maintained incrementally: each refresh only aggregates rows whose Id is above
+the watermark stored in rollup_state, and the increments and the new
+watermark are committed in the same transaction. Rows committed out of Id
+order can appear below the watermark, so the Ids missing from the last
+ROLLUP_GAP_WINDOW Ids under it are kept in rollup_state.gaps and looked for
+again on every refresh; those that turn up are rolled up then.
+
+Readers combine the rollups for every whole hour of a window with raw
+scans of the partial hours at the edges and of the rows not yet rolled up
+(separate range queries, UNION ALL), so the cost depends on the window length rather than on test volume.
+
+    python rollups.py init                  # create tables (after migrations.py)
+    python rollups.py refresh               # roll up new rows once
+    python rollups.py refresh --loop 60     # keep refreshing every 60 s
+    python rollups.py rebuild               # drop counts and start over
+
+The API runs the same refresh in a background thread every
+ROLLUP_REFRESH_POLL seconds once the tables exist (ROLLUP_REFRESH=0 to
+disable); a MySQL named lock lets one worker refresh at a time.
+
+Rows updated in place after being rolled up are not picked up; run
+`rebuild` after bulk corrections.
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from aggregation import GROUPS_SQL_TEMPLATE, QualityAggregate
+from database import engine as default_engine
+
+log = logging.getLogger(__name__)
+
+ENABLED = os.getenv("ROLLUP_REFRESH", "1") != "0"
+POLL_INTERVAL = float(os.getenv("ROLLUP_REFRESH_POLL", "60"))
+GAP_WINDOW = int(os.getenv("ROLLUP_GAP_WINDOW", "1000"))
+LOCK_NAME = "rollup_refresh"
+STATE_TABLE = "rollup_state"
+TEST_ROLLUP = "rollup_test_hourly"
+INTERVENTION_ROLLUP = "rollup_intervention_hourly"
+
+DDL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+      name       VARCHAR(100) PRIMARY KEY,
+      last_id    BIGINT NOT NULL DEFAULT 0,
+      gaps       TEXT NULL,
+      updated_at DATETIME NOT NULL
+    )
+    """,
+    # NULL dimensions are stored as sentinels (0, '', -1) so they can be part
+    # of the primary key used by ON DUPLICATE KEY UPDATE.
+    f"""
+    CREATE TABLE IF NOT EXISTS {TEST_ROLLUP} (
+      hour          DATETIME     NOT NULL,
+      Id_Board      INT          NOT NULL DEFAULT 0,
+      Id_Machine    VARCHAR(255) NOT NULL DEFAULT '',
+      TypeTest      VARCHAR(50)  NOT NULL DEFAULT '',
+      Result        INT          NOT NULL DEFAULT -1,
+      cnt           BIGINT       NOT NULL,
+      max_num_serie VARCHAR(255) NULL,
+      PRIMARY KEY (hour, Id_Board, Id_Machine, TypeTest, Result)
+    )
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {INTERVENTION_ROLLUP} (
+      hour   DATETIME    NOT NULL,
+      Defaut VARCHAR(30) NOT NULL,
+      cnt    BIGINT      NOT NULL,
+      PRIMARY KEY (hour, Defaut)
+    )
+    """,
+]
+
+# Each source: its Id column and the rollup INSERT ... SELECT for the Ids
+# matching `{ids}`.
+SOURCES = {
+    "abb_dbo_test": ("t.Id", f"""
+        INSERT INTO {TEST_ROLLUP} (hour, Id_Board, Id_Machine, TypeTest, Result, cnt, max_num_serie)
+        SELECT
+          DATE_FORMAT(t.DateDebut_ts, '%Y-%m-%d %H:00:00'),
+          COALESCE(t.Id_Board, 0), COALESCE(t.Id_Machine, ''),
+          COALESCE(t.TypeTest, ''), COALESCE(t.Result, -1),
+          COUNT(*), MAX(t.Num_Serie)
+        FROM abb_dbo_test t
+        WHERE {{ids}} AND t.DateDebut_ts IS NOT NULL
+        GROUP BY 1, 2, 3, 4, 5
+        ON DUPLICATE KEY UPDATE
+          cnt = cnt + VALUES(cnt),
+          max_num_serie = IF(max_num_serie IS NULL OR VALUES(max_num_serie) > max_num_serie,
+                             VALUES(max_num_serie), max_num_serie)
+    """),
+    "abb_dbo_intervention": ("i.Id", f"""
+        INSERT INTO {INTERVENTION_ROLLUP} (hour, Defaut, cnt)
+        SELECT DATE_FORMAT(i.DateIntervention, '%Y-%m-%d %H:00:00'), i.Defaut, COUNT(*)
+        FROM abb_dbo_intervention i
+        WHERE {{ids}}
+          AND i.DateIntervention IS NOT NULL AND i.Defaut IS NOT NULL
+        GROUP BY 1, 2
+        ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt)
+    """),
+}
+
+
+def init(engine: Engine = default_engine) -> None:
+    with engine.begin() as conn:
+        for ddl in DDL:
+            conn.execute(text(ddl))
+        for name in SOURCES:
+            conn.execute(text(f"""
+                INSERT IGNORE INTO {STATE_TABLE} (name, last_id, updated_at)
+                VALUES (:name, 0, NOW())
+            """), {"name": name})
+
+
+def initialised(conn) -> bool:
+    return bool(conn.execute(text("""
+        SELECT COUNT(*) FROM information_schema.TABLES
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """), {"table": STATE_TABLE}).scalar())
+
+
+def _refresh_source(engine: Engine, name: str, batch_size: int) -> int:
+    id_col, insert_sql = SOURCES[name]
+    consumed, first = 0, True
+    while True:
+        with engine.begin() as conn:
+            state = conn.execute(text(f"SELECT last_id, gaps FROM {STATE_TABLE} WHERE name = :name FOR UPDATE"),
+                                 {"name": name}).fetchone()
+            if state is None:
+                raise RuntimeError("Rollups not initialised; run `python rollups.py init`")
+            lo, gaps = int(state[0]), json.loads(state[1] or "[]")
+            if first and gaps:
+                # Rows committed after the watermark passed their Id
+                found = [r[0] for r in conn.execute(
+                    text(f"SELECT Id FROM {name} WHERE Id IN :ids").bindparams(bindparam("ids", expanding=True)),
+                    {"ids": gaps})]
+                if found:
+                    conn.execute(text(insert_sql.format(ids=f"{id_col} IN :ids"))
+                                 .bindparams(bindparam("ids", expanding=True)), {"ids": found})
+                    consumed += len(found)
+                    gaps = sorted(set(gaps) - set(found))
+            first = False
+            hi, n = conn.execute(text(f"""
+                SELECT MAX(Id), COUNT(*) FROM (
+                  SELECT Id FROM {name} WHERE Id > :lo ORDER BY Id LIMIT :n
+                ) batch
+            """), {"lo": lo, "n": batch_size}).fetchone()
+            if hi is not None:
+                conn.execute(text(insert_sql.format(ids=f"{id_col} > :lo AND {id_col} <= :hi")),
+                             {"lo": lo, "hi": hi})
+                if n < hi - lo:
+                    since = max(lo, hi - GAP_WINDOW)
+                    present = {r[0] for r in conn.execute(
+                        text(f"SELECT Id FROM {name} WHERE Id > :since AND Id <= :hi"), {"since": since, "hi": hi})}
+                    gaps += [i for i in range(since + 1, hi + 1) if i not in present]
+                lo = hi
+                consumed += int(n)
+            gaps = [g for g in gaps if g > lo - GAP_WINDOW]
+            conn.execute(text(f"""
+                UPDATE {STATE_TABLE} SET last_id = :lo, gaps = :gaps, updated_at = NOW() WHERE name = :name
+            """), {"lo": lo, "gaps": json.dumps(gaps) if gaps else None, "name": name})
+        if hi is None:
+            return consumed
+
+
+def refresh(engine: Engine = default_engine, batch_size: int = 50000) -> Dict[str, int]:
+    """
+    Rolls up the rows found in each source's gaps, then every row above its
+    watermark, `batch_size` Ids per transaction. Returns the number of source
+    rows consumed per table.
+    """
+    return {name: _refresh_source(engine, name, batch_size) for name in SOURCES}
+
+
+def rebuild(engine: Engine = default_engine) -> Dict[str, int]:
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {TEST_ROLLUP}"))
+        conn.execute(text(f"DELETE FROM {INTERVENTION_ROLLUP}"))
+        conn.execute(text(f"UPDATE {STATE_TABLE} SET last_id = 0, gaps = NULL, updated_at = NOW()"))
+    return refresh(engine)
+
+
+class RollupRefresher:
+    """Background refresh for the API, once `python rollups.py init` has run."""
+
+    def __init__(self, poll: float = POLL_INTERVAL):
+        self.poll = poll
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def refresh(self, bind: Engine) -> Optional[Dict[str, int]]:
+        """refresh(), or None when the rollups are not initialised or another worker holds the lock."""
+        with bind.connect() as lock_conn:
+            if not initialised(lock_conn):
+                return None
+            if not lock_conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": LOCK_NAME}).scalar():
+                return None
+            try:
+                return refresh(bind)
+            finally:
+                lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": LOCK_NAME})
+
+    def _run(self, bind: Engine) -> None:
+        while not self._stop.is_set():
+            try:
+                self.refresh(bind)
+            except Exception:
+                log.exception("rollup refresh failed")
+            self._stop.wait(self.poll)
+
+    def start(self, bind: Engine) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(bind,), name="rollup-refresh", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread = None
+
+
+refresher = RollupRefresher()
+
+
+# group_by -> (dimension over the rollup `r`, dimension over raw tests `t`);
+# both sides LEFT JOIN the board as `b`.
+DIMENSIONS = {
+    None:        ("NULL",                    "NULL"),
+    "ref":       ("b.REF_AsteelFlash",       "b.REF_AsteelFlash"),
+    "machine":   ("NULLIF(r.Id_Machine, '')", "t.Id_Machine"),
+    "type_test": ("NULLIF(r.TypeTest, '')",   "t.TypeTest"),
+}
+
+
+def _hour_bounds(start: str, end: str) -> Tuple[datetime, datetime]:
+    """
+    [h_lo, h_hi) is the range of hours lying entirely inside [start, end].
+    When the window does not span a whole hour both are just past `end`,
+    so the range is empty and the leading edge is the whole window.
+    """
+    s = datetime.strptime(start, "%Y-%m-%d %H:%M:%S")
+    e = datetime.strptime(end, "%Y-%m-%d %H:%M:%S") + timedelta(seconds=1)
+    h_lo = s.replace(minute=0, second=0)
+    if h_lo < s:
+        h_lo += timedelta(hours=1)
+    h_hi = e.replace(minute=0, second=0)
+    if h_lo >= h_hi:
+        return e, e
+    return h_lo, h_hi
+
+
+def _raw_parts(ts: str, id_col: str) -> List[str]:
+    """
+    Extra WHERE conditions of the raw scans, one query each, UNION ALL'ed:
+    the partial hours at both edges, then the rows above the watermark in
+    the whole hours. Each is a single range on one column, so MySQL scans
+    the edges through the date index and the new rows through the PK
+    instead of the whole window.
+    """
+    return [
+        f"AND {ts} < :h_lo",
+        f"AND {ts} >= :h_hi",
+        f"AND {ts} >= :h_lo AND {ts} < :h_hi AND {id_col} > :wm",
+    ]
+
+
+class RollupReader:
+    """
+    Answers window queries from the hourly rollups plus a raw scan of the
+    window edges and of the rows above the watermark.
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    def watermarks(self) -> Optional[Dict[str, int]]:
+        if not initialised(self.db):
+            return None
+        rows = self.db.execute(text(f"SELECT name, last_id FROM {STATE_TABLE}")).fetchall()
+        marks = {name: int(last_id) for name, last_id in rows}
+        return marks if all(n in marks for n in SOURCES) else None
+
+    def _params(self, start: str, end: str, last_id: int) -> dict:
+        h_lo, h_hi = _hour_bounds(start, end)
+        return {"start": start, "end": end, "h_lo": h_lo, "h_hi": h_hi, "wm": last_id}
+
+    def test_groups(self, start: str, end: str, last_id: int) -> List[Mapping]:
+        params = self._params(start, end, last_id)
+        rolled = self.db.execute(text(f"""
+            SELECT
+              b.REF_AsteelFlash                                 AS ref_asteel,
+              b.prix                                            AS unit_price,
+              b.Id IS NOT NULL                                  AS matched,
+              SUM(CASE WHEN r.Result = 1 THEN r.cnt ELSE 0 END) AS good,
+              SUM(CASE WHEN r.Result = 1 THEN 0 ELSE r.cnt END) AS bad,
+              MAX(r.max_num_serie)                              AS num_serie
+            FROM {TEST_ROLLUP} r
+            LEFT JOIN abb_dbo_board b ON r.Id_Board = b.Id
+            WHERE r.hour >= :h_lo AND r.hour < :h_hi
+            GROUP BY b.REF_AsteelFlash, b.prix, b.Id IS NOT NULL
+        """), params).mappings().all()
+        raw = self.db.execute(text(" UNION ALL ".join(
+            GROUPS_SQL_TEMPLATE.format(extra=extra) for extra in _raw_parts("t.DateDebut_ts", "t.Id")
+        )), params).mappings().all()
+        return list(rolled) + list(raw)
+
+    def hourly_counts(self, start: str, end: str, group_by: Optional[str] = None) -> List[tuple]:
+        """
+        (hour, key, total, good, fails) rows for [start, end], one per hour
+        and `group_by` value; fails counts Result = 0, as daily_store does. Whole hours come from the rollup when it exists;
+        otherwise every row is aggregated from abb_dbo_test.
+        """
+        rolled_dim, raw_dim = DIMENSIONS[group_by]
+        marks = self.watermarks()
+        rows = []
+        if marks is not None:
+            params = self._params(start, end, marks["abb_dbo_test"])
+            rows += self.db.execute(text(f"""
+                SELECT r.hour, {rolled_dim} AS k,
+                       SUM(r.cnt), SUM(CASE WHEN r.Result = 1 THEN r.cnt ELSE 0 END),
+                       SUM(CASE WHEN r.Result = 0 THEN r.cnt ELSE 0 END)
+                FROM {TEST_ROLLUP} r
+                LEFT JOIN abb_dbo_board b ON r.Id_Board = b.Id
+                WHERE r.hour >= :h_lo AND r.hour < :h_hi
+                GROUP BY r.hour, k
+            """), params).fetchall()
+            extras = _raw_parts("t.DateDebut_ts", "t.Id")
+        else:
+            params = {"start": start, "end": end}
+            extras = [""]
+        rows += self.db.execute(text(" UNION ALL ".join(f"""
+            SELECT DATE_FORMAT(t.DateDebut_ts, '%Y-%m-%d %H:00:00') AS hour, {raw_dim} AS k,
+                   COUNT(*), SUM(t.Result = 1), SUM(t.Result = 0)
+            FROM abb_dbo_test t
+            LEFT JOIN abb_dbo_board b ON t.Id_Board = b.Id
+            WHERE t.DateDebut_ts BETWEEN :start AND :end {extra}
+            GROUP BY hour, k
+        """ for extra in extras)), params).fetchall()
+        return rows
+
+    def defects(self, start: str, end: str, last_id: int) -> Dict[str, int]:
+        params = self._params(start, end, last_id)
+        counts: Dict[str, int] = {}
+        rolled = self.db.execute(text(f"""
+            SELECT Defaut, SUM(cnt) FROM {INTERVENTION_ROLLUP}
+            WHERE hour >= :h_lo AND hour < :h_hi
+            GROUP BY Defaut
+        """), params).fetchall()
+        raw = self.db.execute(text(" UNION ALL ".join(f"""
+            SELECT Defaut, COUNT(*) FROM abb_dbo_intervention
+            WHERE DateIntervention BETWEEN :start AND :end AND Defaut IS NOT NULL {extra}
+            GROUP BY Defaut
+        """ for extra in _raw_parts("DateIntervention", "Id"))), params).fetchall()
+        for defaut, n in list(rolled) + list(raw):
+            counts[defaut] = counts.get(defaut, 0) + int(n)
+        return counts
+
+    def quality(self, start: str, end: str) -> Optional[Tuple[QualityAggregate, Dict[str, int]]]:
+        """
+        Returns (aggregate, defect counts) for the window, or None when the
+        rollups have not been initialised.
+        """
+        marks = self.watermarks()
+        if marks is None:
+            return None
+        agg = QualityAggregate.fold(self.test_groups(start, end, marks["abb_dbo_test"]))
+        return agg, self.defects(start, end, marks["abb_dbo_intervention"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("init")
+    rf = sub.add_parser("refresh")
+    rf.add_argument("--batch-size", type=int, default=50000)
+    rf.add_argument("--loop", type=float, default=None, help="Refresh every N seconds")
+    sub.add_parser("rebuild")
+    args = ap.parse_args()
+
+    if args.cmd == "init":
+        init()
+    elif args.cmd == "rebuild":
+        print(rebuild())
+    else:
+        while True:
+            print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {refresh(batch_size=args.batch_size)}")
+            if args.loop is None:
+                break
+            time.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+In-process retraining of the forecast and price models.
+
+Each task retrains on a cron schedule (minute hour day month weekday),
+whenever its data watermark has grown by `min_new_rows` since the last
+training and, with `drift_model`, when drift.monitor reports that model's
+live inputs as drifted. The scheduler thread only loads the training frame; fitting runs
+in the jobs process pool, and the result is published to the model registry
+in one step, so requests keep using the previous version until the new one
+is ready. Every run is recorded in model_training_runs (duration, rows,
+metrics, version).
+
+Every API process runs a scheduler, so each trigger fires in every worker.
+A run holds a MySQL named lock per task (another worker's trigger for that
+task is dropped meanwhile), and a trigger decided before another worker
+recorded a run is dropped too, after taking that run's watermark as the
+baseline: one training per cron tick, data growth or drift verdict.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+import drift
+import engines
+import jobs
+import lazy
+from daily_store import daily_store
+from model_registry import fingerprint, registry
+
+log = logging.getLogger(__name__)
+
+pd = lazy.module("pandas")
+
+ENABLED = os.getenv("RETRAIN_SCHEDULER", "1") != "0"
+POLL = float(os.getenv("RETRAIN_POLL", "60"))
+RUNS_TABLE = "model_training_runs"
+LOCK_PREFIX = "retrain:"
+
+DDL = f"""
+    CREATE TABLE IF NOT EXISTS {RUNS_TABLE} (
+      id            INT AUTO_INCREMENT PRIMARY KEY,
+      task          VARCHAR(50)  NOT NULL,
+      model         VARCHAR(100) NOT NULL,
+      reason        VARCHAR(20)  NOT NULL,
+      status        VARCHAR(20)  NOT NULL,
+      started       DATETIME     NOT NULL,
+      finished      DATETIME     NULL,
+      seconds       DOUBLE       NULL,
+      rows_used     INT          NULL,
+      watermark     BIGINT       NULL,
+      version       VARCHAR(64)  NULL,
+      metrics       TEXT         NULL,
+      error         TEXT         NULL,
+      INDEX ix_training_runs_task (task, started)
+    )
+"""
+
+
+def _cron_field(spec: str, lo: int, hi: int) -> Set[int]:
+    values = set()
+    for part in spec.split(","):
+        step = 1
+        if "/" in part:
+            part, step = part.split("/")
+            step = int(step)
+        if part == "*":
+            a, b = lo, hi
+        elif "-" in part:
+            a, b = map(int, part.split("-"))
+        else:
+            a = b = int(part)
+        if a < lo or b > hi:
+            raise ValueError(f"Cron field '{spec}' out of range {lo}-{hi}")
+        values.update(range(a, b + 1, step))
+    return values
+
+
+class Cron:
+    """
+    Five-field cron expression with *, a-b, a,b and */n; weekday 0 is Sunday.
+    """
+    BOUNDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expr: str):
+        fields = expr.split()
+        if len(fields) != 5:
+            raise ValueError(f"Expected 5 cron fields, got '{expr}'")
+        self.expr = expr
+        self.minute, self.hour, self.day, self.month, self.weekday = (
+            _cron_field(f, lo, hi) for f, (lo, hi) in zip(fields, self.BOUNDS))
+
+    def matches(self, dt: datetime) -> bool:
+        return (dt.minute in self.minute and dt.hour in self.hour and dt.day in self.day
+                and dt.month in self.month and (dt.weekday() + 1) % 7 in self.weekday)
+
+
+class Task:
+    def __init__(self, name: str, model: str, load: Callable[[Engine], pd.DataFrame],
+                 train: str, watermark_sql: str, cron: Optional[str], min_new_rows: int,
+                 date_column: str = "ds", train_kwargs: Optional[dict] = None,
+                 drift_model: Optional[str] = None):
+        self.name = name
+        self.model = model
+        self.load = load
+        # "module:function" returning (model, metrics); imported in the pool worker
+        self.train = train
+        self.train_kwargs = train_kwargs or {}
+        self.watermark_sql = watermark_sql
+        self.cron = Cron(cron) if cron else None
+        self.min_new_rows = min_new_rows
+        self.date_column = date_column
+        self.drift_model = drift_model
+        self.baseline: Optional[int] = None  # watermark at the last training
+        self.seen_run = 0  # newest model_training_runs id the baseline accounts for
+        self.job: Optional[jobs.Job] = None
+
+    def watermark(self, bind: Engine) -> int:
+        with bind.connect() as conn:
+            return int(conn.execute(text(self.watermark_sql)).scalar() or 0)
+
+    @property
+    def running(self) -> bool:
+        return self.job is not None and self.job.finished is None
+
+
+class RetrainScheduler:
+    def __init__(self, tasks: List[Task], poll: float = POLL):
+        self.tasks: Dict[str, Task] = {t.name: t for t in tasks}
+        self.poll = poll
+        self.bind: Optional[Engine] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def manages(self, model: str) -> bool:
+        """True while a running scheduler keeps `model` fresh."""
+        return self._thread is not None and any(t.model == model for t in self.tasks.values())
+
+    def start(self, bind: Engine) -> None:
+        if self._thread is not None:
+            return
+        self.bind = bind
+        with bind.begin() as conn:
+            conn.execute(text(DDL))
+            for task in self.tasks.values():
+                task.seen_run = self._last_run(conn, task)
+                last = conn.execute(text(f"""
+                    SELECT watermark FROM {RUNS_TABLE}
+                    WHERE task = :task AND status = 'done'
+                    ORDER BY id DESC LIMIT 1
+                """), {"task": task.name}).scalar()
+                task.baseline = int(last) if last is not None else None
+        for task in self.tasks.values():
+            if task.baseline is None:
+                task.baseline = task.watermark(bind)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="retrain-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self) -> None:
+        last = datetime.now().replace(second=0, microsecond=0)
+        while not self._stop.wait(self.poll):
+            now = datetime.now().replace(second=0, microsecond=0)
+            # Every minute since the previous tick, so a slow tick misses nothing
+            minutes = []
+            while last < now:
+                last += timedelta(minutes=1)
+                minutes.append(last)
+            for task in self.tasks.values():
+                try:
+                    if task.cron and any(task.cron.matches(m) for m in minutes):
+                        self.trigger(task.name, "cron")
+                    elif task.min_new_rows and task.watermark(self.bind) - (task.baseline or 0) >= task.min_new_rows:
+                        self.trigger(task.name, "new_data")
+                    elif task.drift_model and drift.monitor.drifted(self.bind, task.drift_model):
+                        self.trigger(task.name, "drift")
+                except Exception:
+                    log.exception("retrain scheduler check failed for %s", task.name)
+
+    def trigger(self, name: str, reason: str = "manual") -> jobs.Job:
+        """
+        Starts a retrain of task `name` as a background job, or returns the
+        job already running for it. Other triggers are dropped when another
+        worker recorded a run of the task since this one last looked.
+        """
+        if self.bind is None:
+            raise RuntimeError("Retrain scheduler not started")
+        task = self.tasks[name]
+        with self._lock:
+            if task.running:
+                return task.job
+            seen = None if reason == "manual" else task.seen_run
+            task.job = jobs.store.submit(self.bind, "retrain", {"task": name, "reason": reason},
+                                          lambda job: self._run(task, reason, seen))
+            return task.job
+
+    @staticmethod
+    def _last_run(conn, task: Task) -> int:
+        return int(conn.execute(text(f"SELECT COALESCE(MAX(id), 0) FROM {RUNS_TABLE} WHERE task = :task"),
+                                {"task": task.name}).scalar())
+
+    def _run(self, task: Task, reason: str, seen: Optional[int]) -> dict:
+        lock = LOCK_PREFIX + task.name
+        with self.bind.connect() as lock_conn:
+            if not lock_conn.execute(text("SELECT GET_LOCK(:name, 0)"), {"name": lock}).scalar():
+                return {"task": task.name, "status": "busy"}  # another worker is training it
+            try:
+                if seen is not None and self._ran_since(task, seen):
+                    return {"task": task.name, "status": "superseded"}
+                return self._train(task, reason)
+            finally:
+                lock_conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": lock})
+
+    def _ran_since(self, task: Task, seen: int) -> bool:
+        """
+        True when another worker recorded a run of `task` after run `seen`;
+        takes its watermark as the baseline.
+        """
+        with self.bind.connect() as conn:
+            row = conn.execute(text(f"""
+                SELECT id, watermark FROM {RUNS_TABLE}
+                WHERE task = :task ORDER BY id DESC LIMIT 1
+            """), {"task": task.name}).mappings().first()
+        if row is None or row["id"] <= seen:
+            return False
+        if row["watermark"] is not None:
+            task.baseline = int(row["watermark"])
+        task.seen_run = int(row["id"])
+        return True
+
+    def _train(self, task: Task, reason: str) -> dict:
+        started, t0 = datetime.now(), time.perf_counter()
+        record = {"task": task.name, "model": task.model, "reason": reason, "started": started,
+                  "status": "failed", "rows_used": None, "watermark": None, "version": None,
+                  "metrics": None, "error": None}
+        try:
+            record["watermark"] = task.watermark(self.bind)
+            df = task.load(self.bind)
+            record["rows_used"] = len(df)
+            fp = fingerprint(df, task.date_column)
+            if reason == "cron" and registry.find(task.model, fp) is not None:
+                record["status"] = "skipped"  # nothing new since that version
+            else:
+                model, metrics = jobs.pool().submit(jobs.call, task.train, df, **task.train_kwargs).result()
+                loaded = registry.publish(task.model, model, fp, rows=len(df), reason=reason, **metrics)
+                record.update(status="done", version=loaded.version, metrics=json.dumps(metrics))
+            return record
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            # Failed runs also move the baseline: no retry on every poll
+            if record["watermark"] is not None:
+                task.baseline = record["watermark"]
+            record["finished"] = datetime.now()
+            record["seconds"] = round(time.perf_counter() - t0, 3)
+            with self.bind.begin() as conn:
+                conn.execute(text(f"""
+                    INSERT INTO {RUNS_TABLE} (task, model, reason, status, started, finished, seconds,
+                                              rows_used, watermark, version, metrics, error)
+                    VALUES (:task, :model, :reason, :status, :started, :finished, :seconds,
+                            :rows_used, :watermark, :version, :metrics, :error)
+                """), record)
+                task.seen_run = self._last_run(conn, task)
+
+    def status(self, limit: int = 20) -> dict:
+        out = {"running": self._thread is not None, "tasks": {}}
+        for task in self.tasks.values():
+            out["tasks"][task.name] = {
+                "model": task.model,
+                "cron": task.cron.expr if task.cron else None,
+                "min_new_rows": task.min_new_rows,
+                "drift_model": task.drift_model,
+                "baseline": task.baseline,
+                "job": task.job.summary() if task.job else None,
+            }
+        if self.bind is not None:
+            with self.bind.connect() as conn:
+                rows = conn.execute(text(f"SELECT * FROM {RUNS_TABLE} ORDER BY id DESC LIMIT :n"),
+                                    {"n": limit}).mappings().fetchall()
+            out["runs"] = [dict(r) for r in rows]
+        return out
+
+
+def _load_prices(bind: Engine) -> pd.DataFrame:
+    from predictive_pipeline import PRICE_QUERY
+    return pd.read_sql(text(PRICE_QUERY), bind)
+
+
+scheduler = RetrainScheduler([
+    Task(
+        "defect_forecast",
+        model=engines.MODEL_NAMES[engines.DEFAULT_ENGINE],
+        load=lambda bind: daily_store.load(bind)[["ds", "y"]],
+        train="forecasting:train_and_score",
+        train_kwargs={"engine": engines.DEFAULT_ENGINE},
+        watermark_sql="SELECT MAX(Id) FROM abb_dbo_test",
+        cron=os.getenv("FORECAST_RETRAIN_CRON", "0 3 * * *"),
+        min_new_rows=int(os.getenv("FORECAST_RETRAIN_MIN_NEW_ROWS", "20000")),
+    ),
+    Task(
+        "price_model",
+        model="rf_price",
+        load=_load_prices,
+        # "price_search:train_model" runs the full hyperparameter search instead
+        train=os.getenv("PRICE_TRAINER", "predictive_pipeline:train_model"),
+        watermark_sql="SELECT COUNT(*) FROM abb_dbo_board",
+        cron=os.getenv("PRICE_RETRAIN_CRON", "30 3 * * 0"),
+        min_new_rows=int(os.getenv("PRICE_RETRAIN_MIN_NEW_ROWS", "500")),
+        date_column="id",
+        drift_model="rf_price" if os.getenv("PRICE_RETRAIN_ON_DRIFT", "1") != "0" else None,
+    ),
+])
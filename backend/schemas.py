@@ -1,6 +1,6 @@
 # schemas.py
-from datetime import date
-from typing import Literal, Optional, List, Dict
+from datetime import date, datetime
+from typing import Literal, Optional, List, Dict, Union
 from pydantic import BaseModel, Field
 
 # --- User models ---
@@ -125,4 +125,87 @@ class QualityMetrics(BaseModel):
     defect_details: Dict[str, int]
     ref_stats: List[RefStat]
     ref_price_stats: List[RefPriceStat]
-    test_details: List[TestRecord]
+
+class TrendSeries(BaseModel):
+    key: str
+    total: List[int]
+    good: List[int]
+    bad: List[int]
+    yield_rate: List[Optional[float]]
+
+class QualityTrend(BaseModel):
+    bucket: Literal['hour','shift','day','week']
+    group_by: Optional[Literal['ref','machine','type_test']] = None
+    buckets: List[str]
+    series: List[TrendSeries]
+
+class TestPage(BaseModel):
+    items: List[TestRecord]
+    next_cursor: Optional[str] = None
+
+class TestFeatures(BaseModel):
+    """One test record as sent by the prediction page; unknown fields are ignored."""
+    Id: Optional[float] = None
+    Id_Board: Optional[int] = None
+    Id_Machine: Optional[str] = None
+    DateDebut: Optional[datetime] = None
+    DateFin: Optional[datetime] = None
+    Position_Flan: Optional[float] = None
+    Id_ConfigLigne: Optional[float] = None
+    Id_Process: Optional[float] = None
+    ref_asteel: Optional[str] = None
+    ref_client: Optional[float] = None
+    family_name: Optional[str] = None
+    board_version: Optional[str] = None
+    is_valid: Optional[float] = None
+    designation: Optional[str] = None
+    client: Optional[str] = None
+    code_indus: Optional[str] = None
+    indice: Optional[str] = None
+    software_ver: Optional[str] = None
+    id_assembly: Optional[Union[float, str]] = None
+    id_process: Optional[Union[float, str]] = None
+    quantcondit: Optional[float] = None
+    id_famille: Optional[Union[float, str]] = None
+    prix: Optional[float] = None
+
+class Prediction(BaseModel):
+    prediction: int          # predicted Result (1 = pass)
+    probability: float       # P(Result = 1)
+
+class BatchPredictionRequest(BaseModel):
+    records: List[TestFeatures]
+
+class BatchPrediction(BaseModel):
+    predictions: List[int]
+    probabilities: List[float]
+
+class PriceFeatures(BaseModel):
+    ref_asteel: str
+    family_name: Optional[str] = None
+
+class PricePrediction(BaseModel):
+    prix: float
+    model_version: str
+
+class BoardPricePrediction(BaseModel):
+    board_id: int
+    ref_asteel: str
+    family_name: str
+    prix: float              # current catalog price
+    predicted_prix: float
+    model_version: str
+
+class RiskScore(BaseModel):
+    test_id: int
+    num_serie: Optional[str] = None
+    id_board: Optional[int] = None
+    date_debut: Optional[datetime] = None
+    defect_probability: float
+    model_version: str
+
+class RiskySerial(BaseModel):
+    num_serie: str
+    max_probability: float
+    tests: int
+    last_test: Optional[datetime] = None
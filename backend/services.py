@@ -1,20 +1,38 @@
+from __future__ import annotations
+
 from datetime import datetime, date
 from sqlalchemy.orm import Session
-from sqlalchemy import text
-import pandas as pd, csv
-from typing import List
-from prophet import Prophet
-import joblib
+from sqlalchemy import text, bindparam
+import csv
+import numpy as np
+import base64, json
+from typing import Iterator, List, Optional
+import engines
+import jobs
 
 from schemas import (
     BoardInfo, BoardCreate, BoardUpdate,
-    TestRecord, RefStat, RefPriceStat, QualityMetrics
+    TestRecord, TestPage, QualityMetrics, QualityTrend, TrendSeries,
+    RiskScore, RiskySerial
 )
+from aggregation import QualityAggregator, QualityAggregate
+from hot_window import hot_window
+from rollups import RollupReader
+from streaming import stream_ndjson
+from singleflight import coalesce
+from model_registry import registry, LoadedModel
+from daily_store import daily_store
+from scheduler import scheduler
+from risk_scores import TABLE as RISK_TABLE
+import lazy
+
+pd = lazy.module("pandas")
 
 class BoardService:
     def __init__(self, db: Session):
         self.db = db
 
+    @coalesce("boards.get_all")
     def get_all(self) -> List[BoardInfo]:
         sql = text("""
           SELECT
@@ -44,6 +62,23 @@ class BoardService:
         rows = self.db.execute(sql).fetchall()
         return [BoardInfo(**r._mapping) for r in rows]
 
+    def price_features(self, board_id: Optional[int] = None) -> List[dict]:
+        """id, ref_asteel, family_name, prix of one board (or all), as the price model was trained on."""
+        where = "WHERE b.Id = :board_id" if board_id is not None else ""
+        rows = self.db.execute(text(f"""
+          SELECT
+            CAST(b.Id AS UNSIGNED)          AS id,
+            COALESCE(b.REF_AsteelFlash, '') AS ref_asteel,
+            COALESCE(f.Nom_Famille, '')     AS family_name,
+            COALESCE(b.prix, 0)             AS prix
+          FROM abb_dbo_board b
+          LEFT JOIN abb_dbo_famille f
+            ON b.Id_Famille = f.Id
+          {where}
+          ORDER BY b.Id
+        """), {"board_id": board_id}).mappings().all()
+        return [dict(r) for r in rows]
+
     def create(self, data: BoardCreate) -> BoardInfo:
         fields = data.dict(exclude_unset=True)
         fields["Date_Creation"] = datetime.utcnow()
@@ -108,194 +143,380 @@ class BoardService:
             count += 1
         return count
 
+TEST_COLUMNS = """
+    Id AS id, Id_Board AS id_board, Num_Serie AS num_serie,
+    Id_Machine AS id_machine, Id_Operateur AS id_operateur,
+    DateDebut AS date_debut, DateFin AS date_fin,
+    Result AS result, TypeTest AS type_test,
+    Side AS side, Position_Flan AS position_flan,
+    Id_ConfigLigne AS id_config_ligne, Id_Process AS id_process,
+    Comment AS comment
+"""
+
+MAX_PAGE_SIZE = 1000
+
+def _test_row(m) -> dict:
+    m = dict(m)
+    op = m.get("id_operateur")
+    m["id_operateur"] = str(int(op)) if op is not None else None
+    return m
+
+def _test_record(m) -> TestRecord:
+    return TestRecord(**_test_row(m))
+
+def encode_cursor(ts: datetime, test_id: int) -> str:
+    raw = json.dumps({"ts": ts.strftime("%Y-%m-%d %H:%M:%S"), "id": int(test_id)})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+        return datetime.strptime(data["ts"], "%Y-%m-%d %H:%M:%S"), int(data["id"])
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+
 class TestService:
+    """
+    Test-row lookups. Each lookup is built once by a `_*_query` method and
+    either materialised as TestRecords or streamed as NDJSON.
+    """
     def __init__(self, db: Session):
         self.db = db
 
-    def get_by_board(self, board_id: int) -> List[TestRecord]:
-        sql = text("""SELECT
-            Id AS id, Id_Board AS id_board, Num_Serie AS num_serie,
-            Id_Machine AS id_machine, Id_Operateur AS id_operateur,
-            DateDebut AS date_debut, DateFin AS date_fin,
-            Result AS result, TypeTest AS type_test,
-            Side AS side, Position_Flan AS position_flan,
-            Id_ConfigLigne AS id_config_ligne, Id_Process AS id_process,
-            Comment AS comment
+    def _stream(self, sql, params) -> Iterator[str]:
+        return stream_ndjson(self.db.get_bind(), sql, params, transform=_test_row)
+
+    def _by_board_query(self, board_id: int):
+        sql = text(f"""SELECT {TEST_COLUMNS}
           FROM abb_dbo_test WHERE Id_Board = :board_id
         """)
-        rows = self.db.execute(sql, {"board_id": board_id}).fetchall()
-        return [TestRecord(**r._mapping) for r in rows]
+        return sql, {"board_id": board_id}
 
-    def unique_by_metric(self, metric_column: str, metric_value: str, start: str, end: str) -> List[TestRecord]:
+    def get_by_board(self, board_id: int) -> List[TestRecord]:
+        rows = self.db.execute(*self._by_board_query(board_id)).fetchall()
+        return [_test_record(r._mapping) for r in rows]
+
+    def stream_by_board(self, board_id: int) -> Iterator[str]:
+        return self._stream(*self._by_board_query(board_id))
+
+    def _unique_query(self, metric_column: str, metric_value: str, start: str, end: str):
         allowed = {"TypeTest","Result","Id_Machine","Id_Operateur","Id_Board","Num_Serie"}
         if metric_column not in allowed:
             raise ValueError("Invalid metric_column")
         sql = text(f"""
             WITH Ranked AS (
               SELECT t.*,
-                     ROW_NUMBER() OVER (PARTITION BY t.Num_Serie ORDER BY STR_TO_DATE(t.DateDebut,'%Y-%m-%d %H:%i:%s') DESC) rn
+                     ROW_NUMBER() OVER (PARTITION BY t.Num_Serie ORDER BY t.DateDebut_ts DESC) rn
               FROM abb_dbo_test t
-              WHERE STR_TO_DATE(t.DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
+              WHERE t.DateDebut_ts BETWEEN :start AND :end
                 AND t.{metric_column} = :metric_value
             )
-            SELECT
-              Id AS id, Id_Board AS id_board, Num_Serie AS num_serie,
-              Id_Machine AS id_machine, Id_Operateur AS id_operateur,
-              DateDebut AS date_debut, DateFin AS date_fin,
-              Result AS result, TypeTest AS type_test,
-              Side AS side, Position_Flan AS position_flan,
-              Id_ConfigLigne AS id_config_ligne, Id_Process AS id_process,
-              Comment AS comment
+            SELECT {TEST_COLUMNS}
             FROM Ranked WHERE rn = 1
         """)
-        rows = self.db.execute(sql, {"start": start, "end": end, "metric_value": metric_value}).fetchall()
-        return [TestRecord(**r._mapping) for r in rows]
+        return sql, {"start": start, "end": end, "metric_value": metric_value}
 
-class MetricsService:
-    def __init__(self, db: Session):
-        self.db = db
+    def unique_by_metric(self, metric_column: str, metric_value: str, start: str, end: str) -> List[TestRecord]:
+        ids = hot_window.unique_ids(metric_column, metric_value, start, end)
+        if ids is not None:
+            if not ids:
+                return []
+            sql = text(f"SELECT {TEST_COLUMNS} FROM abb_dbo_test WHERE Id IN :ids")
+            rows = self.db.execute(sql.bindparams(bindparam("ids", expanding=True)), {"ids": ids}).fetchall()
+        else:
+            rows = self.db.execute(*self._unique_query(metric_column, metric_value, start, end)).fetchall()
+        return [_test_record(r._mapping) for r in rows]
 
-    def quality(self, d: date, start_t: str, end_t: str) -> QualityMetrics:
-        start = f"{d} {start_t}"
-        end   = f"{d} {end_t}"
+    def stream_unique_by_metric(self, metric_column: str, metric_value: str, start: str, end: str) -> Iterator[str]:
+        return self._stream(*self._unique_query(metric_column, metric_value, start, end))
 
-        total = self.db.execute(text("""
-            SELECT COUNT(*) FROM abb_dbo_test
-            WHERE STR_TO_DATE(DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
-        """), {"start": start, "end": end}).scalar() or 0
+    def _window_query(self, start: str, end: str, cursor: Optional[str] = None,
+                      limit: Optional[int] = None):
+        params = {"start": start, "end": end}
+        after = ""
+        if cursor:
+            params["c_ts"], params["c_id"] = decode_cursor(cursor)
+            after = "AND (DateDebut_ts < :c_ts OR (DateDebut_ts = :c_ts AND Id < :c_id))"
+        limit_sql = ""
+        if limit is not None:
+            params["n"] = limit
+            limit_sql = "LIMIT :n"
+        sql = text(f"""
+            SELECT {TEST_COLUMNS}, DateDebut_ts AS _ts
+            FROM abb_dbo_test
+            WHERE DateDebut_ts BETWEEN :start AND :end {after}
+            ORDER BY DateDebut_ts DESC, Id DESC
+            {limit_sql}
+        """)
+        return sql, params
+
+    def page_in_window(self, start: str, end: str, cursor: Optional[str] = None,
+                       limit: int = 100) -> TestPage:
+        """
+        Keyset page of the tests in [start, end], newest first, ordered by
+        (DateDebut_ts, Id). `next_cursor` is None on the last page.
+        """
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        rows = self.db.execute(*self._window_query(start, end, cursor, limit + 1)).mappings().all()
 
-        good = self.db.execute(text("""
-            SELECT COUNT(*) FROM abb_dbo_test
-            WHERE Result = 1 AND STR_TO_DATE(DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
-        """), {"start": start, "end": end}).scalar() or 0
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["_ts"], rows[-1]["id"])
+        items = [_test_record({k: v for k, v in r.items() if k != "_ts"}) for r in rows]
+        return TestPage(items=items, next_cursor=next_cursor)
 
-        bad = total - good
+    def stream_window(self, start: str, end: str, cursor: Optional[str] = None) -> Iterator[str]:
+        """
+        Every test in [start, end] after `cursor` (newest first), as NDJSON.
+        """
+        sql, params = self._window_query(start, end, cursor)
+        return stream_ndjson(self.db.get_bind(), sql, params,
+                             transform=lambda m: _test_row({k: v for k, v in m.items() if k != "_ts"}))
+
+class MetricsService:
+    def __init__(self, db: Session):
+        self.db = db
 
-        defects = dict(self.db.execute(text("""
+    def _defects(self, start: str, end: str) -> dict:
+        return dict(self.db.execute(text("""
             SELECT Defaut, COUNT(*) FROM abb_dbo_intervention
             WHERE DateIntervention BETWEEN :start AND :end AND Defaut IS NOT NULL
             GROUP BY Defaut
         """), {"start": start, "end": end}).fetchall())
 
-        ref_stats = self.db.execute(text("""
-            SELECT
-              b.REF_AsteelFlash AS ref_asteel,
-              SUM(t.Result = 1) AS good_count,
-              SUM(t.Result != 1 OR t.Result IS NULL) AS bad_count,
-              MAX(t.Num_Serie) AS serial_number
-            FROM abb_dbo_board b JOIN abb_dbo_test t ON t.Id_Board = b.Id
-            WHERE STR_TO_DATE(t.DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
-            GROUP BY b.REF_AsteelFlash
-        """), {"start": start, "end": end}).mappings().all()
-
-        ref_price = self.db.execute(text("""
-            SELECT
-              b.REF_AsteelFlash AS ref_asteel,
-              SUM(t.Result = 1) AS good_tests,
-              SUM(t.Result != 1 OR t.Result IS NULL) AS bad_tests,
-              b.prix AS unit_price,
-              SUM(t.Result = 1) * b.prix AS total_price,
-              MAX(t.Num_Serie) AS num_serie
-            FROM abb_dbo_board b JOIN abb_dbo_test t ON t.Id_Board = b.Id
-            WHERE STR_TO_DATE(t.DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
-            GROUP BY b.REF_AsteelFlash, b.prix
-        """), {"start": start, "end": end}).mappings().all()
-
-        rows = self.db.execute(text("""
-            SELECT
-              Id AS id, Id_Board AS id_board, Num_Serie AS num_serie,
-              Id_Machine AS id_machine, Id_Operateur AS id_operateur,
-              DateDebut AS date_debut, DateFin AS date_fin,
-              Result AS result, TypeTest AS type_test,
-              Side AS side, Position_Flan AS position_flan,
-              Id_ConfigLigne AS id_config_ligne, Id_Process AS id_process,
-              Comment AS comment
-            FROM abb_dbo_test
-            WHERE STR_TO_DATE(DateDebut,'%Y-%m-%d %H:%i:%s') BETWEEN :start AND :end
-            ORDER BY DateDebut DESC
-        """), {"start": start, "end": end}).fetchall()
+    @coalesce("metrics.quality", key=lambda d, start_t, end_t: (d.isoformat(), start_t, end_t))
+    def quality(self, d: date, start_t: str, end_t: str) -> QualityMetrics:
+        """
+        Summary KPIs of the window. Test rows are served separately, page by
+        page, by TestService.page_in_window.
+        """
+        start = f"{d} {start_t}"
+        end   = f"{d} {end_t}"
 
-        detail_list = []
-        for r in rows:
-            m = dict(r._mapping)
-            op = m.get("id_operateur")
-            m["id_operateur"] = str(int(op)) if op is not None else None
-            detail_list.append(TestRecord(**m))
+        # Cheapest source first: in-memory hot window, then rollups (kept
+        # current by rollups.refresher in the API), then raw rows
+        hot = hot_window.quality_groups(start, end)
+        if hot is not None:
+            agg, defects = QualityAggregate.fold(hot), self._defects(start, end)
+        else:
+            from_rollups = RollupReader(self.db).quality(start, end)
+            if from_rollups is not None:
+                agg, defects = from_rollups
+            else:
+                agg, defects = QualityAggregator(self.db).run(start, end), self._defects(start, end)
 
         return QualityMetrics(
             date=d,
-            total_quantity=total,
-            good_quantity=good,
-            bad_quantity=bad,
+            total_quantity=agg.total,
+            good_quantity=agg.good,
+            bad_quantity=agg.bad,
             defect_details=defects,
-            ref_stats=[RefStat(**r) for r in ref_stats],
-            ref_price_stats=[RefPriceStat(**r) for r in ref_price],
-            test_details=detail_list
+            ref_stats=agg.ref_stats,
+            ref_price_stats=agg.ref_price_stats,
         )
+SHIFT_START_HOUR = 6   # first shift of the day starts at 06:00
+SHIFT_HOURS = 8
+MAX_TREND_HOURS = 24 * 400
+
+class TrendService:
+    """
+    Total/good/bad/yield series over a date range, bucketed by hour, shift,
+    day or week and optionally split by REF, machine or test type. Counts come
+    from the hot window when it covers the range, else from one hourly
+    grouped query (rollups where available); bucketing and pivoting are
+    vectorised in pandas.
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def _bucket(ts: pd.Series, bucket: str) -> pd.Series:
+        if bucket == "hour":
+            return ts
+        if bucket == "day":
+            return ts.dt.floor("D")
+        if bucket == "week":
+            day = ts.dt.floor("D")
+            return day - pd.to_timedelta(day.dt.weekday, unit="D")
+        offset = pd.Timedelta(hours=SHIFT_START_HOUR)
+        return (ts - offset).dt.floor(f"{SHIFT_HOURS}h") + offset
+
+    @staticmethod
+    def _range(start: datetime, end: datetime, bucket: str) -> pd.DatetimeIndex:
+        first = TrendService._bucket(pd.Series([pd.Timestamp(start).floor("h")]), bucket).iloc[0]
+        freq = {"hour": "h", "day": "D", "week": "7D", "shift": f"{SHIFT_HOURS}h"}[bucket]
+        return pd.date_range(first, pd.Timestamp(end), freq=freq)
+
+    def trend(self, start: datetime, end: datetime, bucket: str = "day",
+              group_by: Optional[str] = None) -> QualityTrend:
+        if end < start:
+            raise ValueError("end must be after start")
+        if (end - start).total_seconds() > MAX_TREND_HOURS * 3600:
+            raise ValueError(f"Range too long (max {MAX_TREND_HOURS // 24} days)")
+
+        start_s, end_s = start.strftime("%Y-%m-%d %H:%M:%S"), end.strftime("%Y-%m-%d %H:%M:%S")
+        # Recent ranges from the in-memory hot window, older ones from the rollups
+        rows = hot_window.hourly_counts(start_s, end_s, group_by)
+        if rows is None:
+            rows = RollupReader(self.db).hourly_counts(start_s, end_s, group_by)
+        df = pd.DataFrame(rows, columns=["hour", "key", "total", "good", "fails"])
+        df["hour"] = pd.to_datetime(df["hour"])
+        df["key"] = df["key"].fillna("").astype(str) if group_by else "all"
+        df[["total", "good"]] = df[["total", "good"]].fillna(0).astype("int64")
+        df["bucket"] = self._bucket(df["hour"], bucket)
+
+        index = self._range(start, end, bucket)
+        pivot = df.pivot_table(index="bucket", columns="key", values=["total", "good"],
+                               aggfunc="sum", fill_value=0).reindex(index, fill_value=0)
+
+        fmt = "%Y-%m-%d" if bucket in ("day", "week") else "%Y-%m-%d %H:%M"
+        series = []
+        if len(df):
+            totals = pivot["total"].to_numpy(dtype="int64")
+            goods = pivot["good"].reindex(columns=pivot["total"].columns, fill_value=0).to_numpy(dtype="int64")
+            with np.errstate(invalid="ignore", divide="ignore"):
+                yields = np.where(totals > 0, goods / totals, np.nan)
+            for j, key in enumerate(pivot["total"].columns):
+                series.append(TrendSeries(
+                    key=key,
+                    total=totals[:, j].tolist(),
+                    good=goods[:, j].tolist(),
+                    bad=(totals[:, j] - goods[:, j]).tolist(),
+                    yield_rate=[None if np.isnan(y) else round(float(y), 6) for y in yields[:, j]],
+                ))
+        return QualityTrend(bucket=bucket, group_by=group_by,
+                            buckets=index.strftime(fmt).tolist(), series=series)
+
+FORECAST_MODELS = engines.MODEL_NAMES
+# freq -> (pandas frequency, season length): days per week, hours and
+# shifts per day
+FORECAST_FREQS = {
+    "day": ("D", 7),
+    "hour": ("h", 24),
+    "shift": (f"{SHIFT_HOURS}h", 24 // SHIFT_HOURS),
+}
+# Sub-daily models are fitted on this much recent history
+SUBDAILY_HISTORY_DAYS = 56
+# Longest forecast horizon, in days whatever the freq
+MAX_HORIZON_DAYS = 3650
+STEPS_PER_DAY = {"day": 1, "hour": 24, "shift": 24 // SHIFT_HOURS}
+
 class ForecastService:
     """
-    Handles Prophet time-series for defect_rate:
-     - load: daily defect rate from abb_dbo_test
-     - train: fit Prophet
-     - forecast: make n-day forecast
+    Handles time-series forecasts of defect_rate:
+     - load: daily defect rate from daily_store, hourly/shift from the rollups
+     - train: fit one of engines.ENGINES (NumPy engines by default, Prophet opt-in)
+     - forecast: make n-step forecast
      - backtest: cross-validate + performance metrics
+     - compare_engines: accuracy vs. fit time of each engine
     """
     def __init__(self, db: Session):
         self.db = db  # Use self.db for the database connection
 
-    def _load_defect_rate(self) -> pd.DataFrame:
-        sql = """
-            SELECT
-              DATE(t.DateDebut) AS ds,
-              SUM(CASE WHEN t.Result=0 THEN 1 ELSE 0 END) * 1.0 / 
-              NULLIF(COUNT(*),0) AS y
-            FROM abb_dbo_test t
-            GROUP BY DATE(t.DateDebut)
-            ORDER BY DATE(t.DateDebut)
-        """
-        df = pd.read_sql(sql, self.db.bind)  # Use self.db.bind instead of self.engine
-        return df.dropna()
+    def _load_defect_rate(self, freq: str = "day") -> pd.DataFrame:
+        if freq == "day":
+            # Daily counts come from the incremental store, not a full-table GROUP BY
+            return daily_store.load(self.db.bind)[["ds", "y"]]
+        # Hour/shift buckets of closed days only, so the model is refitted once a day
+        now = pd.Timestamp.now().floor("D")
+        start = now - pd.Timedelta(days=SUBDAILY_HISTORY_DAYS)
+        rows = RollupReader(self.db).hourly_counts(f"{start:%Y-%m-%d %H:%M:%S}", f"{now:%Y-%m-%d %H:%M:%S}")
+        df = pd.DataFrame(rows, columns=["hour", "key", "total", "good", "fails"])
+        df["ds"] = TrendService._bucket(pd.to_datetime(df["hour"]), freq)
+        counts = df.groupby("ds")[["total", "fails"]].sum().fillna(0).astype("int64")
+        counts = counts[(counts["total"] > 0) & (counts.index < TrendService._bucket(pd.Series([now]), freq)[0])]
+        # Result = 0 over all tests, the daily_store definition
+        return pd.DataFrame({"ds": counts.index, "y": counts["fails"] / counts["total"]}).reset_index(drop=True)
 
-    def _train(self, df: pd.DataFrame) -> Prophet:
-        m = Prophet(daily_seasonality=True, weekly_seasonality=True, yearly_seasonality=False)
-        m.fit(df)
-        return m
+    def _model(self, engine: str = engines.DEFAULT_ENGINE, force: bool = False, freq: str = "day") -> LoadedModel:
+        """
+        Registry model for the current history; refitted only when the data
+        fingerprint changes or `force` is set. Models kept fresh by the
+        retrain scheduler are served as they are, never refitted in-request.
+        """
+        name = FORECAST_MODELS[engine] if freq == "day" else f"{FORECAST_MODELS[engine]}_{freq}"
+        train = lambda df: engines.get(engine)(*FORECAST_FREQS[freq]).fit(df)
+        return registry.get_or_train(name, self._load_defect_rate(freq), train, force=force,
+                                     allow_stale=scheduler.manages(name))
 
-    def forecast(self, periods: int = 30) -> pd.DataFrame:
+    @coalesce("forecast.forecast",
+              key=lambda periods=30, engine=engines.DEFAULT_ENGINE, freq="day": (int(periods), engine, freq))
+    def forecast(self, periods: int = 30, engine: str = engines.DEFAULT_ENGINE, freq: str = "day") -> pd.DataFrame:
         """
         Returns a DataFrame with columns [ds, yhat, yhat_lower, yhat_upper]
-        for the next `periods` days.
+        for the history and the next `periods` days (hours, shifts); the
+        horizon is always the last `periods` rows. The frame is shared
+        between callers and must not be modified.
         """
-        df = self._load_defect_rate()
-        model = self._train(df)
-        future = model.make_future_dataframe(periods=periods)
-        forecast = model.predict(future)
-        
-        # Save the trained model using joblib
-        joblib.dump(model, 'prophet_defect_rate_model.joblib')
-        
-        return forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+        engines.get(engine)
+        if freq not in FORECAST_FREQS:
+            raise ValueError(f"Unknown freq '{freq}', expected one of {list(FORECAST_FREQS)}")
+        if periods > MAX_HORIZON_DAYS * STEPS_PER_DAY[freq]:
+            raise ValueError(f"periods must be at most {MAX_HORIZON_DAYS * STEPS_PER_DAY[freq]} for freq '{freq}'")
+        return self._model(engine, freq=freq).predict(("forecast", int(periods)),
+                                                      lambda model: model.predict(int(periods)))
+
+    def retrain(self, engine: str = engines.DEFAULT_ENGINE) -> dict:
+        """Admin trigger: fits and registers a new version unconditionally."""
+        engines.get(engine)
+        return self._model(engine, force=True).meta
+
+    def compare_engines(self, horizon: int = 8, include_prophet: bool = False) -> List[dict]:
+        """
+        Back-tests every engine on the same rolling cutoffs; see engines.compare.
+        """
+        names = [n for n in engines.ENGINES if include_prophet or n != "prophet"]
+        return engines.compare(self._load_defect_rate(), horizon, names)
 
     def backtest(self, horizon: int = 8):
         """
-        Performs cross-validation over the last data. 
-        Returns (df_cv, df_perf) or (None, None) if insufficient data.
+        Performs cross-validation over the last data, one cutoff per pool
+        process. Returns (df_cv, df_perf) or (None, None) if insufficient data.
+        """
+        return jobs.run_backtest(self._load_defect_rate(), horizon)
+
+    def start_backtest(self, horizon: int = 8) -> jobs.Job:
+        """
+        Same as backtest() but as a background job; poll jobs.store for it.
+        Its result is {"cv": [...], "performance": [...]}.
         """
         df = self._load_defect_rate()
-        n = len(df)
-        initial = horizon * 2
-        if n < initial + horizon:
-            return None, None
-
-        model = self._train(df)
-        df_cv = cross_validation(model,
-                                 initial=f"{initial} days",
-                                 horizon=f"{horizon} days",
-                                 period="1 day")
-        df_perf = performance_metrics(df_cv)
-
-        # also write out CSV if you want
-        df_cv.to_csv("defect_rate_backtest.csv", index=False)
-        df_perf.to_csv("defect_rate_performance_metrics.csv", index=False)
-
-        return df_cv, df_perf
+        if len(df) < horizon * 3:
+            raise ValueError("Not enough data for back-test")
+
+        def run(job):
+            df_cv, df_perf = jobs.run_backtest(df, horizon, job)
+            return {"cv": df_cv.to_dict(orient="records"), "performance": df_perf.to_dict(orient="records")}
+
+        return jobs.store.submit(self.db.get_bind(), "defect-backtest", {"horizon": horizon}, run)
+
+
+class RiskService:
+    """Reads of the precomputed defect probabilities (see risk_scores.py)."""
+    def __init__(self, db: Session):
+        self.db = db
+
+    def risky_serials(self, start: str, end: str, min_probability: float = 0.5,
+                      limit: int = 50) -> List[RiskySerial]:
+        rows = self.db.execute(text(f"""
+            SELECT num_serie, MAX(defect_probability) AS max_probability,
+                   COUNT(*) AS tests, MAX(date_debut) AS last_test
+            FROM {RISK_TABLE}
+            WHERE date_debut BETWEEN :start AND :end
+              AND defect_probability >= :min_probability
+              AND num_serie IS NOT NULL
+            GROUP BY num_serie
+            ORDER BY max_probability DESC
+            LIMIT :limit
+        """), {"start": start, "end": end, "min_probability": min_probability, "limit": limit}).mappings().all()
+        return [RiskySerial(**r) for r in rows]
+
+    def by_serial(self, num_serie: str) -> List[RiskScore]:
+        rows = self.db.execute(text(f"""
+            SELECT test_id, num_serie, id_board, date_debut, defect_probability, model_version
+            FROM {RISK_TABLE} WHERE num_serie = :num_serie
+            ORDER BY date_debut DESC
+        """), {"num_serie": num_serie}).mappings().all()
+        return [RiskScore(**r) for r in rows]
@@ -0,0 +1,94 @@
+"""
+Request coalescing ("single flight") for heavy, read-only computations.
+
+Concurrent calls with the same key share one in-flight execution: the first
+caller runs it, the others wait for it and receive the same result (or the
+same exception). Nothing is cached once the call completes. FastAPI runs sync
+endpoints in a thread pool, so this is thread based.
+"""
+import functools
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException = None
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"calls": self.calls, "executions": self.executions,
+                    "coalesced": self.coalesced, "in_flight": len(self._calls)}
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def group(name: str) -> SingleFlight:
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def coalesce(name: str, key: Callable[..., Hashable] = lambda *args, **kwargs: (args, tuple(sorted(kwargs.items())))):
+    """
+    Method decorator: concurrent calls whose `key(*args, **kwargs)` (self
+    excluded) is equal run the method once. Results are shared between the
+    callers, so they must be treated as read-only.
+    """
+    def decorator(method):
+        flight = group(name)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            return flight.do(key(*args, **kwargs), lambda: method(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+
+def stats() -> Dict[str, dict]:
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {g.name: g.stats() for g in groups}
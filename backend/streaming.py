@@ -0,0 +1,42 @@
+# streaming.py
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Iterator, Mapping, Optional
+
+from fastapi import Request
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql.elements import TextClause
+
+NDJSON = "application/x-ndjson"
+CHUNK_SIZE = 1000
+
+
+def wants_ndjson(request: Request) -> bool:
+    return NDJSON in request.headers.get("accept", "")
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def stream_ndjson(engine: Engine, sql: TextClause, params: dict,
+                  transform: Optional[Callable[[Mapping], dict]] = None,
+                  chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Runs `sql` on its own connection with a server-side cursor and yields the
+    rows as newline-delimited JSON, `chunk_size` rows per chunk, so memory
+    stays flat whatever the result size. The connection is independent of the
+    request session because the body is sent after the endpoint returns.
+    """
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(sql, params)
+        for rows in result.mappings().partitions(chunk_size):
+            yield "".join(
+                json.dumps(transform(r) if transform else dict(r), default=_default) + "\n"
+                for r in rows
+            )